@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""
+Python runner for the mdstudio_gromacs topology benchmarks, run as:
+::
+    python benchmarks --sizes 1000 10000 --output bench.json
+
+Synthetic topologies are generated for every system size and the
+parsers and writers are timed and memory profiled. Results are written
+as JSON and can be compared to a previous run with `--compare`.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Add modules in package to path so we can import them
+modulepath = os.path.abspath(os.path.join(os.path.dirname(__file__), '../'))
+sys.path.insert(0, modulepath)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy  # noqa: E402
+
+from bench_topology import BENCHMARKS  # noqa: E402
+from synthetic import write_itp, write_top  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+
+
+def git_revision():
+    """
+    Commit the benchmarks are run on, None outside a git checkout
+    """
+
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=modulepath, stderr=subprocess.STDOUT)
+        return out.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, repeat):
+    """
+    Best wall time of `repeat` calls of `func` and the peak traced memory
+    of a single call.
+    """
+
+    devnull = open(os.devnull, 'w')
+    stdout = sys.stdout
+    sys.stdout = devnull
+    try:
+        times = []
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            func()
+            times.append(timeit.default_timer() - start)
+
+        peak = None
+        if tracemalloc is not None:
+            tracemalloc.start()
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+
+    return min(times), peak
+
+
+def run_benchmarks(sizes, repeat, only=None):
+    """
+    Run all benchmarks for all system sizes
+    """
+
+    results = []
+    for size in sizes:
+        scratch = tempfile.mkdtemp(prefix='mdstudio_gromacs_bench_')
+        try:
+            files = {'itp': write_itp(os.path.join(scratch, 'synthetic.itp'), size),
+                     'top': write_top(os.path.join(scratch, 'synthetic.top'), size)}
+            for name, bench in BENCHMARKS:
+                if only and name not in only:
+                    continue
+                func = bench(files, scratch)
+                seconds, peak = measure(func, repeat)
+                results.append({'benchmark': name, 'atoms': size, 'seconds': seconds, 'peak_memory': peak})
+                sys.stderr.write('{0:<24s} {1:>9d} atoms {2:10.4f} s {3:>14s} bytes\n'.format(
+                    name, size, seconds, str(peak)))
+        finally:
+            shutil.rmtree(scratch)
+
+    return results
+
+
+def compare(results, reference):
+    """
+    Print the ratio of the timings with those of a `reference` run
+    """
+
+    ref = {(x['benchmark'], x['atoms']): x for x in reference['results']}
+    print('\n{0:<24s} {1:>9s} {2:>10s} {3:>10s} {4:>8s}'.format('benchmark', 'atoms', 'reference', 'current',
+                                                                 'ratio'))
+    for result in results:
+        key = (result['benchmark'], result['atoms'])
+        if key in ref:
+            old = ref[key]['seconds']
+            print('{0:<24s} {1:>9d} {2:10.4f} {3:10.4f} {4:8.2f}'.format(
+                key[0], key[1], old, result['seconds'], result['seconds'] / old if old else float('nan')))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='mdstudio_gromacs topology benchmarks')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='number of atoms')
+    parser.add_argument('--repeat', type=int, default=3, help='timing repetitions, the best is reported')
+    parser.add_argument('--only', nargs='+', default=None, help='run only these benchmarks')
+    parser.add_argument('--output', default=None, help='JSON file to write results to, default is stdout')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.repeat, only=args.only)
+    output = {'revision': git_revision(),
+              'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'numpy': numpy.__version__,
+              'results': results}
+
+    if args.output is None:
+        print(json.dumps(output, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks of the topology parsers and writers.
+
+Every benchmark is a function taking the synthetic input files and a
+scratch directory and returning a callable that performs the measured
+operation, so setup costs are not included in the timings.
+"""
+
+import os
+
+from mdstudio_gromacs import gromacs_topology, gromacs_topology_amber
+
+
+def bench_read_include_topology(files, scratch):
+
+    def run():
+        # Access every section, reading the file itself only indexes it
+        itp_dict, keys = gromacs_topology_amber.read_include_topology(files['itp'])
+        with itp_dict:
+            for key in keys:
+                itp_dict[key]
+    return run
+
+
+def bench_readCard(files, scratch):
+
+    def run():
+        # Access every block, readCard itself only indexes the file
+        blocks, names, mols = gromacs_topology.readCard(files['top'])
+        with blocks:
+            for i in range(len(blocks)):
+                blocks[i]
+    return run
+
+
+def bench_heavyH(files, scratch):
+
+    blocks, names, mols = gromacs_topology.readCard(files['top'])
+    for mol in mols:
+        blocks[mol['atoms']]
+        blocks[mol['bonds']]
+
+    # masses are restored so every repetition repartitions the input
+    atoms = [blocks[mol['atoms']] for mol in mols]
+    masses = [[atom[7] for atom in block] for block in atoms]
+
+    def run():
+        gromacs_topology.heavyH(names, blocks, mols)
+        for block, values in zip(atoms, masses):
+            for atom, mass in zip(block, values):
+                atom[7] = mass
+    return run
+
+
+def bench_correct_itp_amber(files, scratch):
+
+    out = os.path.join(scratch, 'ligand.itp')
+    return lambda: gromacs_topology_amber.correct_itp(files['itp'], out, posre=True)
+
+
+def bench_correct_itp_gromacs(files, scratch):
+
+    out = os.path.join(scratch, 'protein.top')
+    return lambda: gromacs_topology.correct_itp(files['top'], out, posre=True)
+
+
+def bench_fix_atom_types(files, scratch):
+
+    itp_dict, _ = gromacs_topology_amber.read_include_topology(files['itp'])
+    atomtypes = itp_dict['atomtypes']
+    ligand_atomtypes = atomtypes[:len(atomtypes) // 2]
+
+    return lambda: gromacs_topology_amber.fix_atom_types(ligand_atomtypes, atomtypes)
+
+
+def bench_write_itp(files, scratch):
+
+    itp_dict, keys = gromacs_topology_amber.read_include_topology(files['itp'])
+    out = os.path.join(scratch, 'write.itp')
+
+    return lambda: gromacs_topology_amber.write_itp(itp_dict, keys, out)
+
+
+def bench_write_posre(files, scratch):
+
+    itp_dict, _ = gromacs_topology_amber.read_include_topology(files['itp'])
+    out = os.path.join(scratch, 'posre.itp')
+
+    return lambda: gromacs_topology_amber.write_posre(itp_dict, out)
+
+
+BENCHMARKS = [
+    ('read_include_topology', bench_read_include_topology),
+    ('readCard', bench_readCard),
+    ('heavyH', bench_heavyH),
+    ('correct_itp_amber', bench_correct_itp_amber),
+    ('correct_itp_gromacs', bench_correct_itp_gromacs),
+    ('fix_atom_types', bench_fix_atom_types),
+    ('write_itp', bench_write_itp),
+    ('write_posre', bench_write_posre)]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+"""
+Synthetic GROMACS topologies for benchmarking.
+
+The generated molecule is a chain of heavy atoms each carrying a single
+hydrogen, grouped in residues of 10 atoms. Bonds, pairs, angles and
+dihedrals follow the chain so their numbers scale linearly with the
+number of atoms, as they do for proteins.
+"""
+
+import os
+
+HEAVY = [('N', 'N'), ('CX', 'CA'), ('C', 'C'), ('O', 'O'), ('CT', 'CB')]
+HYDROGEN = [('H', 'H'), ('H1', 'HA'), ('HC', 'H1'), ('HO', 'H2'), ('HC', 'HB')]
+MASSES = {'N': 14.01, 'CX': 12.01, 'C': 12.01, 'O': 16.00, 'CT': 12.01, 'H': 1.008, 'H1': 1.008, 'HC': 1.008,
+          'HO': 1.008}
+RESIDUES = ['ALA', 'GLY', 'SER', 'LEU', 'VAL']
+
+
+def write_atomtypes(f):
+    """
+    [ atomtypes ] section for all atom types used
+    """
+
+    f.write('[ atomtypes ]\n')
+    f.write(';name   bond_type     mass     charge   ptype   sigma         epsilon\n')
+    for name in sorted(MASSES):
+        f.write(' {0:>3s}  {0:>8s}  {1:15.5f}  {2:7.5f}   A  {3:13.5e}  {4:13.5e} ; synthetic\n'.format(
+            name, 0.0, 0.0, 0.3, 0.5))
+    f.write('\n')
+
+
+def write_molecule(f, name, natoms):
+    """
+    [ moleculetype ] with atoms, bonds, pairs, angles and dihedrals
+    for a chain of `natoms` atoms.
+    """
+
+    nheavy = natoms // 2
+    heavy = [2 * k + 1 for k in range(nheavy)]
+
+    f.write('[ moleculetype ]\n;name            nrexcl\n {0}            3\n\n'.format(name))
+
+    f.write('[ atoms ]\n;   nr  type  resi  res  atom  cgnr     charge      mass\n')
+    for k in range(nheavy):
+        resnr = k // 5 + 1
+        residue = RESIDUES[(resnr - 1) % len(RESIDUES)]
+        for nr, (atype, aname) in ((2 * k + 1, HEAVY[k % 5]), (2 * k + 2, HYDROGEN[k % 5])):
+            f.write('{0:6d} {1:>4s} {2:5d} {3:>5s} {4:>5s} {0:4d} {5:12.6f} {6:12.5f} ; synthetic\n'.format(
+                nr, atype, resnr, residue, aname, 0.1 if atype.startswith('H') else -0.1, MASSES[atype]))
+    f.write('\n')
+
+    f.write('[ bonds ]\n;   ai     aj funct   r             k\n')
+    for k, i in enumerate(heavy):
+        f.write('{0:6d} {1:6d}   1    1.0969e-01    2.7665e+05 ; synthetic\n'.format(i, i + 1))
+        if k + 1 < nheavy:
+            f.write('{0:6d} {1:6d}   1    1.5375e-01    2.5179e+05 ; synthetic\n'.format(i, heavy[k + 1]))
+    f.write('\n')
+
+    f.write('[ pairs ]\n;   ai     aj    funct\n')
+    for k in range(nheavy - 3):
+        f.write('{0:6d} {1:6d}      1 ; synthetic\n'.format(heavy[k], heavy[k + 3]))
+        f.write('{0:6d} {1:6d}      1 ; synthetic\n'.format(heavy[k] + 1, heavy[k + 2]))
+    f.write('\n')
+
+    f.write('[ angles ]\n;   ai     aj     ak    funct   theta         cth\n')
+    for k in range(nheavy - 2):
+        f.write('{0:6d} {1:6d} {2:6d}    1    1.0970e+02    4.1840e+02 ; synthetic\n'.format(
+            heavy[k], heavy[k + 1], heavy[k + 2]))
+        f.write('{0:6d} {1:6d} {2:6d}    1    1.0950e+02    3.2635e+02 ; synthetic\n'.format(
+            heavy[k] + 1, heavy[k], heavy[k + 1]))
+    f.write('\n')
+
+    f.write('[ dihedrals ] ; propers\n')
+    for k in range(nheavy - 3):
+        f.write('{0:6d} {1:6d} {2:6d} {3:6d}      3    0.62760    1.88280    0.00000   -2.51040    0.00000'
+                '    0.00000 ; synthetic\n'.format(heavy[k], heavy[k + 1], heavy[k + 2], heavy[k + 3]))
+    f.write('\n')
+
+
+def write_itp(path, natoms, name='LIG'):
+    """
+    Ligand style include topology: atom types and a single molecule
+    """
+
+    with open(path, 'w') as f:
+        f.write('; {0} synthetic topology with {1} atoms\n\n'.format(os.path.basename(path), natoms))
+        write_atomtypes(f)
+        write_molecule(f, name, natoms)
+
+    return path
+
+
+def write_top(path, natoms, name='PROT'):
+    """
+    Full system topology: defaults, atom types, the molecule, system
+    and molecules sections.
+    """
+
+    with open(path, 'w') as f:
+        f.write('[ defaults ]\n  1  2  yes  0.5  0.8333\n\n')
+        write_atomtypes(f)
+        write_molecule(f, name, natoms)
+        f.write('[ system ]\n  synthetic\n\n[ molecules ]\n  {0}  1\n'.format(name))
+
+    return path
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: atomtypes.py
+
+Registry of force field atom types keyed by type name.
+"""
+
+from collections import OrderedDict
+from twisted.logger import Logger
+
+logger = Logger()
+
+
+def same_parameters(params, other, rtol=1e-6):
+    """
+    Compare two lists of atom type parameters. Numeric values are
+    compared by value (e.g. 3.39967e-01 equals 0.339967), anything else
+    as text.
+    """
+
+    if len(params) != len(other):
+        return False
+
+    for a, b in zip(params, other):
+        if a == b:
+            continue
+        try:
+            x, y = float(a), float(b)
+        except ValueError:
+            return False
+        if abs(x - y) > rtol * max(abs(x), abs(y)):
+            return False
+
+    return True
+
+
+class AtomTypeRegistry(object):
+    """
+    Atom types keyed by name with O(1) membership tests.
+
+    Adding a type that is already registered keeps the registered
+    definition. If the parameters differ the clash is recorded in
+    `conflicts` as (name, registered row, rejected row) tuple, or a
+    ValueError is raised for a `strict` registry.
+
+    :param rows:   initial atom type rows (lists of strings, name first)
+    :param strict: raise on conflicting definitions
+    """
+
+    def __init__(self, rows=(), strict=False):
+
+        self.strict = strict
+        self.conflicts = []
+        self._types = OrderedDict()
+        for row in rows:
+            self.add(row)
+
+    def __contains__(self, name):
+
+        return name in self._types
+
+    def __len__(self):
+
+        return len(self._types)
+
+    def __iter__(self):
+
+        return iter(self._types.values())
+
+    def __getitem__(self, name):
+
+        return self._types[name]
+
+    def add(self, row):
+        """
+        Register the atom type `row`
+
+        :returns: True if the type was not registered before
+        """
+
+        row = list(row)
+        name = row[0]
+        registered = self._types.get(name)
+        if registered is None:
+            self._types[name] = row
+            return True
+
+        if not same_parameters(registered[1:], row[1:]):
+            if self.strict:
+                raise ValueError('Conflicting definitions for atom type {0}: {1} and {2}'.format(
+                    name, ' '.join(registered), ' '.join(row)))
+            logger.warn('Conflicting definitions for atom type {name}, keeping {kept}',
+                        name=name, kept=' '.join(registered))
+            self.conflicts.append((name, registered, row))
+
+        return False
+
+    def merge(self, rows):
+        """
+        Register many atom types
+
+        :returns: the rows that were not registered before
+        """
+
+        return [row for row in rows if self.add(row)]
+
+    def rows(self):
+        """
+        All registered atom types in registration order
+        """
+
+        return list(self._types.values())
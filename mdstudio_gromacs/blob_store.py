@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: blob_store.py
+
+Content addressed store of input files shared by the task directories.
+
+Files are stored once under the SHA-256 digest of their content and
+staged into task directories as hard links, so staging a large protein
+topology for many tasks does not duplicate it. Where a hard link is not
+possible the blob is copied, as copy-on-write reflink if the file
+system supports it. Files that are modified in the task directory are
+not staged from the store. The link count of a blob is its reference
+count, blobs no longer linked from any task directory are removed by
+`collect`. Blobs added, re-added or linked within the last `grace`
+seconds are kept, another instance sharing the store may be about to
+stage them.
+"""
+
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+from mdstudio_gromacs.file_transfer import write_content
+from mdstudio_gromacs.topology_cache import file_digest
+from mdstudio_gromacs.topology_preprocessor import LRUCache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning a file on copy-on-write file systems (btrfs, xfs)
+FICLONE = 0x40049409
+
+# Errors of os.link meaning hard links are not possible here
+LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP)
+
+# Maximum number of file digests remembered
+DIGEST_MEMO_SIZE = 4096
+
+_default_store = None
+
+
+def reflink_or_copy(source, destination):
+    """
+    Copy `source` to `destination` as reflink if supported
+    """
+
+    if fcntl is not None:
+        with open(source, 'rb') as src:
+            with open(destination, 'wb') as dst:
+                try:
+                    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                    return
+                except (IOError, OSError):
+                    pass
+
+    shutil.copyfile(source, destination)
+
+
+class BlobStore(object):
+    """
+    Content addressed file store.
+
+    :param directory: directory to keep the blobs in
+    :param grace:     seconds an unreferenced blob is kept after it was
+                      last added or linked
+    """
+
+    def __init__(self, directory, grace=3600.0):
+
+        self.directory = directory
+        self.grace = grace
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # (path, device, inode, size, mtime) -> digest
+        self._digests = LRUCache(DIGEST_MEMO_SIZE)
+
+    def path(self, digest):
+        """
+        Location of the blob with `digest`
+        """
+
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def digest(self, filename):
+        """
+        Digest of the content of `filename`, files that did not change
+        since they were last added are not read again.
+        """
+
+        st = os.stat(filename)
+        key = (os.path.realpath(filename), st.st_dev, st.st_ino, st.st_size, st.st_mtime)
+        digest = self._digests.get(key)
+        if digest is None:
+            digest = file_digest(filename)
+            self._digests.put(key, digest)
+
+        return digest
+
+    def add_file(self, filename):
+        """
+        Add the content of `filename` to the store
+
+        :returns: digest of the blob
+        """
+
+        digest = self.digest(filename)
+        if not self._touch(digest):
+            fd, tmp = self._tempfile()
+            os.close(fd)
+            shutil.copyfile(filename, tmp)
+            self._commit(tmp, digest)
+
+        return digest
+
+    def add_content(self, content, compression=None, encoding='utf-8'):
+        """
+        Add serialized file content to the store, see
+        `file_transfer.write_content`
+
+        :returns: digest of the blob
+        """
+
+        fd, tmp = self._tempfile()
+        os.close(fd)
+        write_content(content, tmp, compression=compression, encoding=encoding)
+        digest = file_digest(tmp)
+        self._commit(tmp, digest)
+
+        return digest
+
+    def stage(self, digest, destination):
+        """
+        Make the blob `digest` available as `destination`. The blob is
+        hard linked, falling back to a copy across file systems.
+        """
+
+        source = self.path(digest)
+        if os.path.lexists(destination):
+            os.remove(destination)
+
+        try:
+            os.link(source, destination)
+            return destination
+        except (OSError, AttributeError) as e:
+            if isinstance(e, OSError) and e.errno not in LINK_ERRORS:
+                raise
+
+        reflink_or_copy(source, destination)
+        os.chmod(destination, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+
+        return destination
+
+    def refcount(self, digest):
+        """
+        Number of task files linked to the blob `digest`
+        """
+
+        return os.stat(self.path(digest)).st_nlink - 1
+
+    def collect(self, grace=None):
+        """
+        Remove the blobs that are not linked from any task directory and
+        were not added or linked in the last `grace` seconds, the grace
+        period of the store by default
+
+        :returns: number of bytes freed
+        """
+
+        if grace is None:
+            grace = self.grace
+
+        # The inode change time is updated by adds, links and unlinks
+        cutoff = time.time() - grace
+        freed = 0
+        for prefix in os.listdir(self.directory):
+            subdir = os.path.join(self.directory, prefix)
+            if not os.path.isdir(subdir):
+                continue
+            for name in os.listdir(subdir):
+                path = os.path.join(subdir, name)
+                try:
+                    st = os.stat(path)
+                    if st.st_nlink > 1 or st.st_ctime > cutoff:
+                        continue
+                    os.remove(path)
+                    freed += st.st_size
+                except OSError:
+                    continue
+
+        return freed
+
+    def _touch(self, digest):
+        """
+        Mark the blob `digest` as recently added if it exists
+        """
+
+        try:
+            os.utime(self.path(digest), None)
+        except OSError:
+            return False
+
+        return True
+
+    def _tempfile(self):
+
+        return tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+
+    def _commit(self, tmp, digest):
+        """
+        Move the temporary file `tmp` in place as blob `digest`. Blobs are
+        read only to protect them from writes through their links.
+        """
+
+        path = self.path(digest)
+        if self._touch(digest):
+            os.remove(tmp)
+            return
+
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                # Created concurrently
+                pass
+
+        os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        os.rename(tmp, path)
+
+
+def configure_blob_store(directory, grace=3600.0):
+    """
+    Set the process wide blob store, None disables it.
+    """
+
+    global _default_store
+    if directory is None:
+        _default_store = None
+    else:
+        _default_store = BlobStore(directory, grace=grace)
+
+    return _default_store
+
+
+def get_blob_store():
+    """
+    The process wide blob store or None if not configured
+    """
+
+    return _default_store
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: cerise_calls.py
+
+Thread pool running the blocking calls of the Cerise client.
+
+Every call of the Cerise client (looking up services and jobs, reading
+job states and outputs, uploading input files, starting containers) is
+a blocking request to the Cerise REST API or to Docker. They run in a
+bounded thread pool of their own so the reactor thread never waits on
+them and slow services do not starve the reactor thread pool.
+"""
+
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+_call_pool = None
+
+
+def configure_call_pool(size=8):
+    """
+    Start the process wide pool of Cerise calls, or resize it if started.
+    It is stopped when the reactor shuts down.
+
+    :param size: number of Cerise calls running at once
+    """
+
+    global _call_pool
+    if _call_pool is None:
+        _call_pool = ThreadPool(minthreads=1, maxthreads=size, name='mdstudio_gromacs_cerise')
+        _call_pool.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', _call_pool.stop)
+    else:
+        _call_pool.adjustPoolsize(minthreads=1, maxthreads=size)
+
+    return _call_pool
+
+
+def get_call_pool():
+    """
+    The process wide pool of Cerise calls, started with the default size
+    if not configured
+    """
+
+    if _call_pool is None:
+        return configure_call_pool()
+
+    return _call_pool
+
+
+def call_in_pool(f, *args, **kwargs):
+    """
+    Call the blocking `f` in the pool of Cerise calls
+
+    :returns: Deferred firing with the result of `f`
+    """
+
+    return deferToThreadPool(reactor, get_call_pool(), f, *args, **kwargs)
@@ -6,13 +6,62 @@ import cerise_client.service as cc
 import docker
 import json
 import os
+import requests
 import six
 
 from collections import defaultdict
 from mdstudio.deferred.chainable import chainable
 from mdstudio.deferred.return_value import return_value
 from retrying import retry
-from time import sleep
+from twisted.internet.defer import DeferredSemaphore, gatherResults
+from twisted.logger import Logger
+
+from mdstudio_gromacs.cerise_calls import call_in_pool
+from mdstudio_gromacs.in_flight import InFlight
+from mdstudio_gromacs.job_monitor import get_monitor, job_states, job_status
+from mdstudio_gromacs.output_retrieval import get_retriever
+from mdstudio_gromacs.polling import poll
+from mdstudio_gromacs.service_pool import DEFAULT_PORT, get_service_pool, service_key
+from mdstudio_gromacs.task_events import batch_topic, publish_status, task_topic
+from mdstudio_gromacs.task_store import get_task_store
+
+# Local file name of every output of the gromit workflow
+OUTPUT_FORMATS = {
+    "gromitout": "{}.out",
+    "gromiterr": "{}.err",
+    "gromacslog2": "{}.out",
+    "gromacslog3": "{}.out",
+    "gromacslog4": "{}.out",
+    "gromacslog5": "{}.out",
+    "gromacslog6": "{}.out",
+    "gromacslog7": "{}.out",
+    "gromacslog8": "{}.out",
+    "gromacslog9": "{}.out",
+    "energy_edr":  "{}.edr",
+    "energy_dataframe": "{}.ene",
+    "energyout": "{}.out",
+    "energyerr": "{}.err",
+    "decompose_dataframe": "{}.ene",
+    "decompose_err": "{}.err",
+    "decompose_out": "{}.out"}
+
+# Named selections of outputs to retrieve
+OUTPUT_PRESETS = {
+    "energies": ["energy_dataframe"],
+    "decomposition": ["energy_dataframe", "decompose_dataframe"],
+    "logs": ["gromitout", "gromiterr"],
+    "all": sorted(OUTPUT_FORMATS)}
+
+# Outputs retrieved in addition for failed jobs
+FAILURE_OUTPUTS = ["gromitout", "gromiterr"]
+
+# Results of a bulk query retrieved at once
+RESULTS_CONCURRENCY = 4
+
+# Output extractions in progress by task_id and outputs, shared by concurrent queries
+_extractions = InFlight()
+
+logger = Logger()
 
 
 def create_cerise_config(input_session):
@@ -36,6 +85,7 @@ def create_cerise_config(input_session):
 
     # Set Workflow
     config['cwl_workflow'] = choose_cwl_workflow(input_session['protein_file'])
+    config['outputs'] = output_keys(input_session.get('outputs'))
     config['log'] = os.path.join(input_session['workdir'], 'cerise.log')
     config['workdir'] = input_session['workdir']
 
@@ -62,13 +112,17 @@ def call_cerise_gromit(gromacs_config, cerise_config, cerise_db):
     srv_data = None
     try:
         # Run Jobs
-        srv = create_service(cerise_config)
+        srv = yield acquire_service(cerise_config)
         srv_data = yield submit_new_job(srv, gromacs_config, cerise_config)
+        publish_status(srv_data['task_id'], 'queued')
 
         # Register Job
         srv_data['clean_remote'] = cerise_config['clean_remote']
         register_srv_job(srv_data, cerise_db)
 
+        # Wait for the job without blocking the reactor
+        yield wait_till_finished(srv_data)
+
         # extract results
         output = yield query_simulation_results(srv_data, cerise_db)
 
@@ -76,18 +130,15 @@ def call_cerise_gromit(gromacs_config, cerise_config, cerise_db):
         update_srv_info_at_db(srv_data, cerise_db)
 
     except Exception as e:
-        print("simulation failed due to: {0}".format(e))
+        logger.error("simulation failed due to: {error}", error=e)
         output = {'status': 'failed', 'task_id': cerise_config['task_id']}
+        publish_status(cerise_config['task_id'], 'failed')
 
     finally:
         # Shutdown Service if there are no other jobs running
         if srv_data is not None:
             yield try_to_close_service(srv_data)
 
-    while not output.get('status', 'failed') in ('completed', 'failed'):
-        output = yield query_simulation_results(srv_data, cerise_db)
-        sleep(30)
-
     return_value(output)
 
 
@@ -112,19 +163,81 @@ def call_async_cerise_gromit(gromacs_config, cerise_config, cerise_db):
     srv_data = None
     try:
         # Run Jobs
-        srv = create_service(cerise_config)
+        srv = yield acquire_service(cerise_config)
         srv_data = yield submit_new_job(srv, gromacs_config, cerise_config)
-        srv_data['status'] = yield wait_till_running(srv, srv_data['task_id'])
+        publish_status(srv_data['task_id'], 'queued')
 
         # Register Job
+        srv_data['status'] = 'running'
         srv_data['clean_remote'] = cerise_config['clean_remote']
         register_srv_job(srv_data, cerise_db)
 
+        # Results are retrieved in the background once the job ends
+        monitor_task(srv_data, cerise_db)
+        yield wait_till_running(srv_data)
+
     except Exception as e:
-        print("simulation failed due to: {0}".format(e))
+        logger.error("simulation failed due to: {error}", error=e)
+        publish_status(cerise_config['task_id'], 'failed')
         return_value({'status': 'failed', 'task_id': cerise_config['task_id']})
 
     output = {'status': 'running', 'task_id': srv_data['task_id'],
+              'query_url': 'mdgroup.mdstudio_gromacs.endpoint.query_gromacs_results',
+              'topic': task_topic(srv_data['task_id'])}
+    return_value(output)
+
+
+@chainable
+def call_async_cerise_gromit_batch(gromacs_configs, cerise_configs, cerise_db):
+    """
+    Submit the simulations of a batch of ligands to a single Cerise
+    service. It returns immediately with the task of every ligand, the
+    results of every task are queried as for `call_async_cerise_gromit`.
+
+    :param gromacs_configs: gromacs simulation parameters of every ligand
+    :type gromacs_configs:  :py:list
+    :param cerise_configs:  cerise-client process settings of every ligand
+    :type cerise_configs:   :py:list
+    :param cerise_db:       MongoDB db to store the information related to the
+                            Cerise services and jobs.
+
+    :returns:               batch_id and the status of every task
+    :rtype:                 :py:dict
+
+    State transitions of all tasks are published on the batch topic.
+    """
+
+    batch_id = cerise_configs[0]['batch_id']
+    srv = yield acquire_service(cerise_configs[0])
+
+    tasks = []
+    for gromacs_config, cerise_config in zip(gromacs_configs, cerise_configs):
+        task = {'task_id': cerise_config['task_id'], 'name': gromacs_config.get('name'),
+                'topic': task_topic(cerise_config['task_id'])}
+        try:
+            # Task ids are new, no need to look for existing jobs
+            srv_data = yield submit_new_job(srv, gromacs_config, cerise_config, new_job=True)
+            srv_data['status'] = 'running'
+
+            # Register Job
+            srv_data['clean_remote'] = cerise_config['clean_remote']
+            register_srv_job(srv_data, cerise_db)
+            task['status'] = 'running'
+            publish_status(task['task_id'], 'queued', batch_id)
+
+            # Results are retrieved in the background once the job ends
+            monitor_task(srv_data, cerise_db)
+
+        except Exception as e:
+            logger.error("simulation {task_id} of batch {batch_id} failed due to: {error}",
+                         task_id=task['task_id'], batch_id=batch_id, error=e)
+            task['status'] = 'failed'
+            publish_status(task['task_id'], 'failed', batch_id)
+
+        tasks.append(task)
+
+    status = 'failed' if all(task['status'] == 'failed' for task in tasks) else 'running'
+    output = {'status': status, 'batch_id': batch_id, 'tasks': tasks, 'topic': batch_topic(batch_id),
               'query_url': 'mdgroup.mdstudio_gromacs.endpoint.query_gromacs_results'}
     return_value(output)
 
@@ -148,33 +261,51 @@ def query_simulation_results(request, cerise_db):
             srv_data = request
         else:
             # Search for the service
-            srv_data = yield cerise_db.find_one('cerise', {'task_id': task_id})['result']
+            srv_data = yield get_task_store(cerise_db).find(task_id)
+            if srv_data is None:
+                raise cc.errors.JobNotFound(task_id)
+
+        # Job finished before, it may be removed from the service
+        if srv_data.get('status') in ('completed', 'failed'):
+            return_value({'status': srv_data['status'], 'task_id': task_id,
+                          'results': srv_data.get('results', {})})
 
         # Start service if necessary
-        srv = cc.service_from_dict(srv_data)
+        srv = yield call_in_pool(cc.service_from_dict, srv_data)
 
-        job = srv.get_job_by_name(srv_data['task_id'])
-        status = job.state
+        job = yield call_in_pool(srv.get_job_by_name, srv_data['task_id'])
+        state = yield call_in_pool(getattr, job, 'state')
+        status = job_status(state)
+        batch_id = srv_data.get('batch_id')
 
         # Job is still running
-        if any(status.lower() == x for x in ["waiting", "running"]):
+        if status in ('queued', 'running'):
+            publish_status(task_id, status, batch_id)
             status = 'running'
 
         # Job done
-        elif status.lower() == 'success':
-            output = wait_extract_clean(job, srv, srv_data['workdir'], srv_data['clean_remote'])
+        elif status == 'completed':
+            publish_status(task_id, 'downloading', batch_id)
+            keys = output_keys(srv_data.get('outputs'))
+            output = yield _extractions.run((task_id, tuple(keys)), wait_extract_clean, job, srv,
+                                            srv_data['workdir'], srv_data['clean_remote'], keys=keys)
             results = serialize_files(output)
 
-            status = 'completed'
-
             # Shutdown Service if there are no other jobs running
             yield try_to_close_service(srv_data)
         # Job fails
         else:
             print("Job {} has FAILED!\nCheck output at: {}".format(request['task_id'], srv_data['workdir']))
-            output = wait_extract_clean(job, srv, srv_data['workdir'], srv_data['clean_remote'])
+            keys = sorted(set(srv_data.get('outputs') or output_keys()).union(FAILURE_OUTPUTS))
+            output = yield _extractions.run((task_id, tuple(keys)), wait_extract_clean, job, srv,
+                                            srv_data['workdir'], srv_data['clean_remote'], keys=keys)
             status = 'failed'
 
+        # Keep the outcome, the job is gone from the service when cleaned
+        if status != 'running':
+            update_srv_info_at_db({'task_id': task_id, 'status': status, 'results': results}, cerise_db)
+            publish_status(task_id, status, batch_id)
+
         return_value({'status': status, 'task_id': task_id, 'results': results})
 
     except cc.errors.JobNotFound:
@@ -182,38 +313,134 @@ def query_simulation_results(request, cerise_db):
         raise RuntimeError(msg)
 
 
-@retry(wait_random_min=500, wait_random_max=2000)
+@chainable
+def query_simulation_states(query, cerise_db, include_results=False, concurrency=RESULTS_CONCURRENCY):
+    """
+    Check the status of many tasks at once. The tasks are read from the
+    `cerise_db` with a single query and grouped by service, the state of
+    the jobs of every service is fetched with a single call.
+
+    :param query:           MongoDB filter selecting the tasks.
+    :type query:            :py:dict
+    :param cerise_db:       MongoDB db to store the information related to the
+                            Cerise services and jobs.
+    :param include_results: retrieve the results of the finished tasks.
+    :type include_results:  :py:bool
+    :param concurrency:     number of results retrieved at once.
+    :type concurrency:      :py:int
+
+    :returns:               status of every task found
+    :rtype:                 :py:list
+    """
+
+    docs = yield get_task_store(cerise_db).find_many(query)
+
+    # Group the tasks by the service running them
+    services = defaultdict(list)
+    for srv_data in docs:
+        services[service_key(srv_data)].append(srv_data)
+
+    tasks = []
+    retrievals = []
+    semaphore = DeferredSemaphore(concurrency)
+    for srv_tasks in services.values():
+        try:
+            srv = yield call_in_pool(cc.service_from_dict, srv_tasks[0])
+            states = yield call_in_pool(job_states, srv)
+        except (cc.errors.ServiceNotFound, requests.RequestException) as e:
+            logger.warn("unable to list the jobs of service {name}: {error}", name=srv_tasks[0].get('name'), error=e)
+            states = {}
+
+        for srv_data in srv_tasks:
+            state = states.get(srv_data['task_id'])
+            if state is None:
+                # Finished and removed from the service, or unreachable
+                status = srv_data.get('status', 'unknown')
+            else:
+                status = job_status(state)
+                # Final states are published once the output is retrieved
+                if status in ('queued', 'running'):
+                    publish_status(srv_data['task_id'], status, srv_data.get('batch_id'))
+
+            task = {'task_id': srv_data['task_id'], 'status': status}
+            if include_results and status in ('completed', 'failed'):
+                if state is None:
+                    task['results'] = srv_data.get('results', {})
+                else:
+                    d = semaphore.run(query_simulation_results, srv_data, cerise_db)
+                    retrievals.append(d.addCallback(task.update))
+            tasks.append(task)
+
+    # Raise the first error of the retrievals as is
+    yield gatherResults(retrievals, consumeErrors=True).addErrback(lambda failure: failure.value.subFailure)
+
+    return_value(tasks)
+
+
+def acquire_service(cerise_config):
+    """
+    Running Cerise service for `cerise_config`, taken from the pool of
+    warm services if possible, see `service_pool`.
+
+    :returns: Deferred firing with the service
+    """
+
+    return get_service_pool(create_service).acquire(cerise_config)
+
+
+def is_docker_error(exception):
+    """
+    Whether to retry starting the service after `exception`
+    """
+
+    if isinstance(exception, docker.errors.APIError):
+        print(exception)
+        return True
+
+    return False
+
+
+@retry(retry_on_exception=is_docker_error, stop_max_attempt_number=5, wait_random_min=500, wait_random_max=2000)
 def create_service(cerise_config):
     """
     Create a Cerise service if one is not already running,
     using the `cerise_config` file.
     """
 
-    srv = None
-    try:
-        srv = cc.require_managed_service(
-                cerise_config['docker_name'],
-                cerise_config.get('port', 29593),
-                cerise_config['docker_image'],
-                cerise_config['username'],
-                cerise_config['password'])
-        print("Created a new Cerise-client service")
-    except docker.errors.APIError as e:
-        print(e)
-        pass
+    srv = cc.require_managed_service(
+            cerise_config['docker_name'],
+            cerise_config.get('port', DEFAULT_PORT),
+            cerise_config['docker_image'],
+            cerise_config['username'],
+            cerise_config['password'])
+    print("Created a new Cerise-client service")
 
     return srv
 
 
 @chainable
-def submit_new_job(srv, gromacs_config, cerise_config):
+def submit_new_job(srv, gromacs_config, cerise_config, new_job=False):
     """
     Create a new job using the provided `srv` and `cerise_config`.
     The job's input is extracted from the `gromacs_config`.
+    If `new_job` is set the job name is known to be unused.
+
+    The job is created, its input files uploaded and it is started in
+    the pool of Cerise calls, see `cerise_calls`.
+    """
+
+    srv_data = yield call_in_pool(run_new_job, srv, gromacs_config, cerise_config, new_job=new_job)
+
+    return_value(srv_data)
+
+
+def run_new_job(srv, gromacs_config, cerise_config, new_job=False):
+    """
+    Blocking part of `submit_new_job`
     """
 
     print("Creating Cerise-client job")
-    job = create_lie_job(srv, gromacs_config, cerise_config)
+    job = create_lie_job(srv, gromacs_config, cerise_config, new_job=new_job)
 
     # Associate a CWL workflow with the job
     job.set_workflow(cerise_config['cwl_workflow'])
@@ -226,36 +453,82 @@ def submit_new_job(srv, gromacs_config, cerise_config):
     job.run()
 
     # Collect data
-    srv_data = collect_srv_data(cc.service_to_dict(srv), gromacs_config, cerise_config)
+    return collect_srv_data(cc.service_to_dict(srv), gromacs_config, cerise_config)
 
-    return_value(srv_data)
+
+def monitor_task(srv_data, cerise_db):
+    """
+    Track the job of `srv_data` until it ends and retrieve its results
+    then, see `query_simulation_results`. The downloading and final
+    status of the task are published without clients querying it. A task
+    whose job disappears from the service or whose results can not be
+    retrieved is stored and published as failed.
+
+    :returns: Deferred firing with the results of the task
+    """
+
+    def retrieval_failed(failure):
+        logger.error("retrieving the results of task {task_id} failed due to: {error}",
+                     task_id=srv_data['task_id'], error=failure.getErrorMessage())
+        update_srv_info_at_db({'task_id': srv_data['task_id'], 'status': 'failed'}, cerise_db)
+        publish_status(srv_data['task_id'], 'failed', srv_data.get('batch_id'))
+
+        return {'status': 'failed', 'task_id': srv_data['task_id']}
+
+    d = get_monitor(srv_data).wait(srv_data['task_id'], batch_id=srv_data.get('batch_id'))
+    d.addCallback(lambda _: query_simulation_results(srv_data, cerise_db))
+    d.addErrback(retrieval_failed)
+
+    return d
 
 
 @chainable
-def wait_till_running(srv, job_name):
-    """wait until the job is running"""
-    job = srv.get_job_by_name(job_name)
-    while job.state.lower() == 'waiting':
-        sleep(2)
+def monitor_running_tasks(cerise_db):
+    """
+    Monitor the tasks submitted before the component started that are
+    still running, see `monitor_task`.
+    """
+
+    docs = yield get_task_store(cerise_db).find_many({'status': 'running'})
+    for srv_data in docs:
+        monitor_task(srv_data, cerise_db)
+
+    return_value(len(docs))
+
+
+@chainable
+def wait_till_running(srv_data):
+    """wait until the job left the queue, see `job_monitor`"""
+    yield get_monitor(srv_data).wait(srv_data['task_id'], lambda status: status != 'queued',
+                                     batch_id=srv_data.get('batch_id'))
 
     return_value('running')
 
 
-def wait_extract_clean(job, srv, workdir, clean_remote):
+@chainable
+def wait_till_finished(srv_data):
+    """wait until the job succeeded or failed, see `job_monitor`"""
+    status = yield get_monitor(srv_data).wait(srv_data['task_id'], batch_id=srv_data.get('batch_id'))
+
+    return_value(status)
+
+
+@chainable
+def wait_extract_clean(job, srv, workdir, clean_remote, keys=None):
     """
-    Wait for the `job` to finish, extract the output and cleanup.
+    Wait for the `job` to finish, extract the outputs in `keys` and cleanup.
     If the job fails returns None.
     """
     log = os.path.join(workdir, 'cerise.log')
-    wait_for_job(job, log)
-    output = get_output(job, workdir)
+    yield wait_for_job(job, log)
+    output = yield get_output(job, workdir, keys=keys)
 
     # Clean up the job and the service.
     if clean_remote:
         print("removing job: {} from Cerise-client".format(job.id))
-        srv.destroy_job(job)
+        yield call_in_pool(srv.destroy_job, job)
 
-    return output
+    return_value(output)
 
 
 def collect_srv_data(srv_data, gromacs_config, cerise_config):
@@ -267,18 +540,23 @@ def collect_srv_data(srv_data, gromacs_config, cerise_config):
     srv_data['task_id'] = cerise_config['task_id']
     srv_data['username'] = cerise_config['username']
     srv_data['job_type'] = gromacs_config['job_type']
-    srv_data['port'] = cerise_config.get('port', 29593)
+    srv_data['port'] = cerise_config.get('port', DEFAULT_PORT)
     srv_data['workdir'] = cerise_config['workdir']
+    srv_data['batch_id'] = cerise_config.get('batch_id')
+    srv_data['outputs'] = cerise_config.get('outputs')
 
     return srv_data
 
 
-def create_lie_job(srv, gromacs_config, cerise_config):
+def create_lie_job(srv, gromacs_config, cerise_config, new_job=False):
     """
     Create a Cerise job using the cerise `srv` and set gromacs
     parameters using `gromacs_config`.
     """
-    job = try_to_create_job(srv, cerise_config['task_id'])
+    if new_job:
+        job = srv.create_job(cerise_config['task_id'])
+    else:
+        job = try_to_create_job(srv, cerise_config['task_id'])
 
     # Copy gromacs input files
     job = add_input_files_lie(job, gromacs_config)
@@ -345,9 +623,10 @@ def set_input_parameters_lie(job, gromacs_config):
 
 def register_srv_job(srv_data, cerise_db):
     """
-    Register job in the `cerise_db`.
+    Register job in the `cerise_db`. Inserts are written in batches,
+    see `task_store`.
     """
-    cerise_db.insert_one('cerise', srv_data)
+    get_task_store(cerise_db).insert(srv_data)
     print("Added service to mongoDB")
 
 
@@ -359,43 +638,35 @@ def update_srv_info_at_db(srv_data, cerise_db):
     # Do not try to update id in the db
     if "_id" in srv_data:
         srv_data.pop("_id")
-    query = {'task_id': srv_data['task_id']}
-    cerise_db.update_one('cerise', query, {"$set": srv_data})
+    get_task_store(cerise_db).update(srv_data['task_id'], srv_data)
 
 
+@chainable
 def wait_for_job(job, cerise_log):
     """
     Wait until job is done.
     """
     print("waiting for job")
-    while job.is_running():
-        sleep(30)
+    yield poll(lambda: call_in_pool(job.is_running), lambda running: not running, in_thread=False)
 
     # Process output
-    if job.state != 'Success':
-        print('Cerise reported error: {}'.format(job.state))
+    state = yield call_in_pool(getattr, job, 'state')
+    if state != 'Success':
+        print('Cerise reported error: {}'.format(state))
 
     print('Cerise log stored at: {}'.format(cerise_log))
+    log = yield call_in_pool(getattr, job, 'log')
     with open(cerise_log, 'w') as f:
-        json.dump(job.log, f, indent=2)
+        json.dump(log, f, indent=2)
 
 
 @chainable
 def try_to_close_service(srv_data):
     """
-    Close service it There are no more jobs and
-    the service is still running.
+    Return the service to the pool. It is closed once it has been idle
+    for the idle timeout of the pool and there are no more jobs.
     """
-    try:
-        srv = cc.service_from_dict(srv_data)
-
-        if len(srv.list_jobs()) == 0:
-            print("Shutting down Cerise-client service")
-            cc.stop_managed_service(srv)
-            cc.destroy_managed_service(srv)
-
-    except cc.errors.ServiceNotFound:
-        print("There is not Cerise Service running")
+    yield get_service_pool(create_service).release(srv_data)
 
 
 def serialize_files(data):
@@ -422,46 +693,52 @@ def serialize_files(data):
     return {key: serialize(val) for key, val in data.items()}
 
 
-def get_output(job, workdir):
+@chainable
+def get_output(job, workdir, keys=None):
     """
     retrieve output information from the `job`.
+
+    Only the outputs in `keys` are retrieved, all outputs by default, see
+    `output_keys`. The outputs are copied to the localhost in parallel,
+    outputs copied before are skipped, see `output_retrieval`.
     """
-    def copy_output_from_remote(file_name, fmt):
-        """
-        Copy output files to the localhost.
-        """
-        path = os.path.join(workdir, fmt.format(file_name))
-        try:
-            job.outputs[file_name].save_as(path)
-            return path
-        except AttributeError:
-            return None
-
-    file_formats = {
-        "gromitout": "{}.out",
-        "gromiterr": "{}.err",
-        "gromacslog2": "{}.out",
-        "gromacslog3": "{}.out",
-        "gromacslog4": "{}.out",
-        "gromacslog5": "{}.out",
-        "gromacslog6": "{}.out",
-        "gromacslog7": "{}.out",
-        "gromacslog8": "{}.out",
-        "gromacslog9": "{}.out",
-        "energy_edr":  "{}.edr",
-        "energy_dataframe": "{}.ene",
-        "energyout": "{}.out",
-        "energyerr": "{}.err",
-        "decompose_dataframe": "{}.ene",
-        "decompose_err": "{}.err",
-        "decompose_out": "{}.out"}
-
-    # Save all data about the simulation
-    results = {
-        key: copy_output_from_remote(key, fmt)
-        for key, fmt in file_formats.items() if key in job.outputs}
-
-    return results
+    if keys is None:
+        keys = output_keys()
+
+    # Save the selected data about the simulation
+    outputs = yield call_in_pool(getattr, job, 'outputs')
+    outputs = {key: outputs[key] for key in keys if key in OUTPUT_FORMATS and key in outputs}
+    paths = {key: os.path.join(workdir, OUTPUT_FORMATS[key].format(key)) for key in outputs}
+
+    results = yield get_retriever().retrieve(outputs, paths, workdir)
+
+    return_value(results)
+
+
+def output_keys(manifest=None):
+    """
+    Outputs selected by an output `manifest`: a preset name or a list of
+    output and preset names. All outputs are selected by default.
+
+    :returns: sorted list of output names
+    """
+
+    if manifest is None:
+        return OUTPUT_PRESETS['all']
+    if isinstance(manifest, six.string_types):
+        manifest = [manifest]
+
+    keys = set()
+    for name in manifest:
+        if name in OUTPUT_PRESETS:
+            keys.update(OUTPUT_PRESETS[name])
+        elif name in OUTPUT_FORMATS:
+            keys.add(name)
+        else:
+            raise ValueError('Unknown output: {0}, use one of the presets {1} or the outputs {2}'.format(
+                name, ', '.join(sorted(OUTPUT_PRESETS)), ', '.join(sorted(OUTPUT_FORMATS))))
+
+    return sorted(keys)
 
 
 def choose_cwl_workflow(protein_file):
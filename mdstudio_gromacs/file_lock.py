@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: file_lock.py
+
+Advisory inter-process file locks.
+"""
+
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, locking is skipped there
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path):
+    """
+    Hold an exclusive lock on `path` for the duration of the context.
+    The lock is taken on a `<path>.lock` companion file so the locked
+    file itself may be replaced while locked.
+    """
+
+    lock_path = '{0}.lock'.format(path)
+    with open(lock_path, 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            yield lock_path
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: file_transfer.py
+
+Compressed and chunked transfer of input files.
+
+File content in a request may be compressed with gzip or zstd, in which
+case it is sent base64 encoded. Large files can be uploaded in numbered
+chunks ahead of the request, every chunk is decompressed and appended to
+a staging file on arrival and the request refers to the staged file by
+its `upload_id`.
+"""
+
+import base64
+import binascii
+import json
+import os
+import re
+import shutil
+import zlib
+
+from mdstudio_gromacs.file_lock import file_lock
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIONS = ('gzip', 'zstd')
+
+# Base64 characters decoded at once, a multiple of 4
+BLOCK_SIZE = 4 * 256 * 1024
+
+DEFAULT_UPLOAD_DIR = '/tmp/mdstudio/mdstudio_gromacs/uploads'
+
+UPLOAD_ID = re.compile(r'^[A-Za-z0-9_-]{1,128}$')
+
+_default_uploads = None
+
+
+def decompressor(compression):
+    """
+    Streaming decompressor for `compression` ('gzip' or 'zstd')
+    """
+
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise ValueError('zstd compressed content requires the zstandard package')
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    raise ValueError('Unsupported compression: {0}, use one of {1}'.format(compression, ', '.join(COMPRESSIONS)))
+
+
+def iter_content(content, compression=None, encoding='utf-8'):
+    """
+    Decoded content of a serialized file as byte blocks.
+
+    Uncompressed content is the text of the file, compressed content is
+    the base64 encoded compressed file. Compressed content is decoded and
+    decompressed block wise so the decompressed file is never held in
+    memory at once.
+    """
+
+    if compression is None:
+        if not isinstance(content, bytes):
+            content = content.encode(encoding or 'utf-8')
+        yield content
+        return
+
+    stream = decompressor(compression)
+    if isinstance(content, bytes):
+        content = content.decode('ascii')
+    # Line breaks would misalign the base64 blocks
+    if re.search(r'\s', content):
+        content = re.sub(r'\s', '', content)
+
+    for start in range(0, len(content), BLOCK_SIZE):
+        try:
+            block = base64.b64decode(content[start:start + BLOCK_SIZE])
+        except (binascii.Error, TypeError) as e:
+            raise ValueError('Invalid base64 encoded content: {0}'.format(e))
+        data = stream.decompress(block)
+        if data:
+            yield data
+
+    if hasattr(stream, 'flush'):
+        data = stream.flush()
+        if data:
+            yield data
+
+
+def write_content(content, path, compression=None, encoding='utf-8', mode='wb'):
+    """
+    Write the content of a serialized file to `path`
+
+    :returns: number of bytes written
+    """
+
+    size = 0
+    with open(path, mode) as f:
+        for block in iter_content(content, compression=compression, encoding=encoding):
+            f.write(block)
+            size += len(block)
+
+    return size
+
+
+class UploadStore(object):
+    """
+    Staging area of chunked uploads.
+
+    Chunks of an upload are numbered from 0 and appended in order to
+    `<upload_id>.part`, the number of the next expected chunk is kept in
+    `<upload_id>.json` so all component instances sharing the directory
+    accept the chunks of an upload.
+
+    :param directory: directory to stage the uploads in
+    """
+
+    def __init__(self, directory):
+
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, upload_id):
+        """
+        Location of the staging file of `upload_id`
+        """
+
+        if not UPLOAD_ID.match(upload_id or ''):
+            raise ValueError('Invalid upload_id: {0}'.format(upload_id))
+
+        return os.path.join(self.directory, '{0}.part'.format(upload_id))
+
+    def append(self, upload_id, index, content, compression=None, encoding='utf-8'):
+        """
+        Append chunk `index` of upload `upload_id`. Chunks that were
+        received before are ignored, so a chunk can be resent safely.
+
+        :returns: dictionary with the upload_id, the number of chunks and
+                  the size of the staged file
+        """
+
+        path = self.path(upload_id)
+        state_file = '{0}.json'.format(os.path.splitext(path)[0])
+        with file_lock(path):
+            state = {'chunks': 0, 'size': 0}
+            if os.path.exists(state_file):
+                with open(state_file, 'r') as f:
+                    state = json.load(f)
+
+            if index > state['chunks']:
+                raise ValueError('Chunk {0} of upload {1} received before chunk {2}'.format(
+                    index, upload_id, state['chunks']))
+            elif index == state['chunks']:
+                # Drop the remains of a chunk that failed halfway
+                with open(path, 'ab') as f:
+                    f.truncate(state['size'])
+                state['size'] += write_content(content, path, compression=compression, encoding=encoding, mode='ab')
+                state['chunks'] += 1
+                with open(state_file, 'w') as f:
+                    json.dump(state, f)
+
+        return {'upload_id': upload_id, 'chunks': state['chunks'], 'size': state['size']}
+
+    def claim(self, upload_id, destination):
+        """
+        Move the staged file of `upload_id` to `destination`
+        """
+
+        path = self.path(upload_id)
+        if not os.path.exists(path):
+            raise IOError('Unknown upload: {0}'.format(upload_id))
+
+        with file_lock(path):
+            shutil.move(path, destination)
+            for extra in ('{0}.json', '{0}.part.lock'):
+                try:
+                    os.remove(os.path.join(self.directory, extra.format(upload_id)))
+                except OSError:
+                    pass
+
+        return destination
+
+
+def configure_uploads(directory):
+    """
+    Set the process wide upload staging area
+    """
+
+    global _default_uploads
+    _default_uploads = UploadStore(directory)
+
+    return _default_uploads
+
+
+def get_uploads():
+    """
+    The process wide upload staging area, staged in `DEFAULT_UPLOAD_DIR`
+    if not configured
+    """
+
+    if _default_uploads is None:
+        return configure_uploads(DEFAULT_UPLOAD_DIR)
+
+    return _default_uploads
@@ -9,7 +9,17 @@ Linear Interaction Energy MD calculation
 
 import os
 import logging
-import re
+
+import numpy as np
+
+from mdstudio_gromacs.atomtypes import AtomTypeRegistry
+from mdstudio_gromacs.mass_repartition import repartition_masses
+from mdstudio_gromacs.position_restraints import PROTEIN_HEADER, protein_restraint_tiers, write_restraints
+from mdstudio_gromacs.topology_editor import TopologyEditor, list_molecules
+from mdstudio_gromacs.topology_index import TopologyIndex, is_continuation
+from mdstudio_gromacs.topology_table import column_widths, write_columns
+
+logger=logging.getLogger(__name__)
 
 
 def correct_itp(topfile, topOutFn, posre=True, outitp={}, removeMols=[], replaceMols=[], excludePosre=[], excludeHH=[],
@@ -18,53 +28,57 @@ def correct_itp(topfile, topOutFn, posre=True, outitp={}, removeMols=[], replace
     Correct hydrogen and heavy atom masses in the .itp file
     makes position restraint file for the ligand
     outitp={'atomtypes': {'outfile':'attype.itp', 'overwrite':True}}
+
+    The <mol>-posre.itp files are written next to topOutFn, 'posre'
+    lists their file names as included by the topology.
     """
 
-    print("CORRECT ITP")
+    logger.debug('correct topology %s'%topfile)
 
-    if posre:
-        posreNm = "%s-posre.itp"%os.path.splitext(os.path.basename(topOutFn))[0]
-    else:
-        posreNm = None
+    # posre files are written next to the output topology
+    workdir=os.path.dirname(os.path.abspath(topOutFn))
 
     #read itp
-    print("READ TOP")
+    logger.debug('read topology')
     blocks, listBlocks, listMols = readCard(topfile)
 
-    print("REMOVE MOLS")
-    # remove mols;  eg. WAT to be substituted with SOL in amber to gromacs conversion
-    blocks, listBlocks, listMols = topRmMols(blocks, listBlocks, removeMols)
-
-    print("REPLACE MOLS")
-    blocks, listBlocks=topReplaceMols(blocks, listBlocks, replaceMols)
-
-    print("HH")
-    #apply heavy hydrogens(HH)
-    newBlocks=heavyH(listBlocks, blocks, listMols, excludeList=excludeHH)
-
-    print("POSRES")
-    #create positional restraints file
-    if posre:
-        posreNm=outPosre(blocks, listBlocks, listMols, excludePosre)
-    else:
-        posreNm={}
-
-    print("ADD MOLS")
-    #add additional moleculetypes (e.g. solvent and ions)
-    miscBlocks, miscListBlocks, miscListMols=([], [], [])
-    for mol in miscMols:
-        b, lb, lm=readCard(mol)
-        miscBlocks+=b
-        miscListBlocks+=lb
-        miscListMols+=lm 
-    
-    fixNewBlocks, fixListBlocks=itpAddMols(blocks, listBlocks, miscBlocks, miscListBlocks)
-
-    # replace mols in system definition
-     
-    print("OUT ITP")
-    #write corrected itp (with HH and no atomtype section
-    topOut, extItps=itpOut(fixNewBlocks, fixListBlocks, topOutFn, posre=posreNm, excludeList=outitp)
+    # the memory map of the topology is released once it is written
+    with blocks:
+        logger.debug('edit molecules')
+        #additional moleculetypes (e.g. solvent and ions)
+        miscBlocks, miscListBlocks=([], [])
+        for mol in miscMols:
+            b, lb, lm=readCard(mol)
+            with b:
+                miscBlocks+=b
+            miscListBlocks+=lb
+
+        # remove mols;  eg. WAT to be substituted with SOL in amber to gromacs conversion
+        # replace mols in system definition and add the additional moleculetypes in one pass
+        editor=TopologyEditor(blocks, listBlocks)
+        editor.remove(removeMols)
+        for mol in replaceMols:
+            editor.replace(mol['in'], mol['out'])
+        editor.add(miscBlocks, miscListBlocks)
+        blocks, listBlocks, allMols=editor.apply()
+
+        # heavy hydrogens and restraints only apply to the molecules of the topology
+        listMols=[mol for mol in allMols if not mol.get('added')]
+
+        logger.debug('heavy hydrogens')
+        #apply heavy hydrogens(HH)
+        heavyH(listBlocks, blocks, listMols, excludeList=excludeHH)
+
+        logger.debug('position restraints')
+        #create positional restraints file
+        if posre:
+            posreNm=outPosre(blocks, listBlocks, listMols, excludePosre, workdir=workdir)
+        else:
+            posreNm={}
+
+        logger.debug('write topology %s'%topOutFn)
+        #write corrected itp (with HH and no atomtype section
+        topOut, extItps=itpOut(blocks, listBlocks, topOutFn, posre=posreNm, excludeList=outitp)
 
     results={
              'top':topOut,
@@ -76,213 +90,94 @@ def correct_itp(topfile, topOutFn, posre=True, outitp={}, removeMols=[], replace
 
 
 def readCard(filetop):
-    logging.debug('read topology')
-    
-    blockNames=[]
-    listBlocks=[]
-
-    title=False
-    read=False
-
-    with open(filetop, 'r') as itp:
-        block=[]
-        for line in itp:
-            atom=[]
-            if line.startswith('#'):
-                if block!=[]:
-                    listBlocks.append(block)
-                    block=[]
-                listBlocks.append(line)
-                blockNames.append(None)
-            else:          
-                line_sp=re.split('\s*', line[:-1])
-                for item in line_sp:
-                    if re.match(";", item):
-                        break
-
-                    elif item == "[":
-                        if block!=[]:
-                            listBlocks.append(block)
-                            block=[]
-                        title=True
-                        read=False
-                    elif item=="]":
-                        title=False
-                        read=True
-                    elif (title==True) and (item!=''):
-                        blockNames.append(item)
-                    elif (read==True) and (item!=''):
-                        atom.append(item)
-                if (atom!=[]):
-                    block.append(atom)
-    if block!=[]:
-        listBlocks.append(block)
+    """
+    Index the blocks of topology `filetop`. The returned `TopologyIndex`
+    holds the file memory mapped, close it once the blocks are written.
+    """
+
+    logger.debug('index topology %s'%filetop)
+
+    # index the sections, blocks are only parsed when accessed
+    listBlocks=TopologyIndex(filetop)
+    blockNames=list(listBlocks.names)
 
     # for molecule get:
     #    name
     #    index of the block with atoms
     #    index of block with bonds
-    listMols=[]
-    mol={}
-    for nbl, blockNm in enumerate(blockNames):
-        if blockNm == 'moleculetype':
-            if len(mol)>0:
-                listMols.append(mol)
-            mol={}
-            mol['name']=listBlocks[nbl][0][0]
-        elif blockNm == 'atoms':
-            mol['atoms']=nbl
-        elif blockNm == 'bonds':
-            mol['bonds']=nbl     
-
-    if len(mol)>0:
-        listMols.append(mol)
-
+    listMols=list_molecules(listBlocks, blockNames)
 
     return (listBlocks, blockNames, listMols)
 
 
 def topRmMols(blocks, blockNames, mols2Del):
-    print("TOP RM MOLS")
-    popOut=False
-    listOut=[]
-    for nbl, blName in enumerate(blockNames):
-        if blName=='moleculetype':
-            if blocks[nbl][0][0] in mols2Del:
-                popOut=True
-            else:
-                popOut=False
-        if blName=='system':
-            popOut=False
-        
-        if popOut:
-            listOut.append(nbl)
-    
-    listOut.sort(reverse=True)
-    print("EXCLUDE", listOut)
-    for nbl in listOut:
-        blocks.pop(nbl)
-        blockNames.pop(nbl)
-    
-    print("CREATE LISTMOLS")
-    listMols=[]
-    mol={}
-    for nbl, blockNm in enumerate(blockNames):
-        if blockNm == 'moleculetype':
-            if len(mol)>0:
-                listMols.append(mol)
-            mol={}
-            mol['name']=blocks[nbl][0][0]
-        elif blockNm == 'atoms':
-            mol['atoms']=nbl
-        elif blockNm == 'bonds':
-            mol['bonds']=nbl     
-
-    if len(mol)>0:
-        listMols.append(mol)
-    print("LISTMOLS  ", listMols)
-
-    return (blocks, blockNames, listMols)
+    logger.debug('remove molecules %s'%list(mols2Del))
+    editor=TopologyEditor(blocks, blockNames)
+    editor.remove(mols2Del)
+
+    return editor.apply()
 
 
 def topReplaceMols(blocks, blockNames, mols2Rep):
     # nol2Rep: [{'in':'WAT', 'out':'SOL'}, ..]
-    print('TOPREPLACE')
-    listin=[x['in'] for x in mols2Rep]
-    for nbl, blName in enumerate(blockNames):
-        if blName=='molecules':
-            for mol in blocks[nbl]:
-                if mol[0] in listin:
-                    mol[0]=mols2Rep[listin.index(mol[0])]['out']
-    
+    logger.debug('replace molecules %s'%mols2Rep)
+    editor=TopologyEditor(blocks, blockNames)
+    for mol in mols2Rep:
+        editor.replace(mol['in'], mol['out'])
+    blocks, blockNames, listMols=editor.apply()
+
     return (blocks, blockNames)
 
 
 def heavyH(blockNames, blocks, listMols, excludeList=['WAT']):
     '''Adjust the weights of hydrogens, and their heavy atom partner'''
     for mol in listMols:
-        if mol['name'] not in excludeList:
-            for bond in blocks[mol['bonds']]:
-                for hI in [0, 1]:
-                    if re.match("^h|^H", blocks[mol['atoms']][int(bond[hI])-1] [1]):
-                        if hI==0:
-                            hJ=1
-                        elif hI==1:
-                            hJ=0
-
-                        ## Change heavy atom (heavy -3*H)               
-                        blocks[mol['atoms']][int(bond[hJ])-1][7]=("%.5f" % ( float(blocks[mol['atoms']][int(bond[hJ])-1][7]) \
-                                                                              - float(blocks[mol['atoms']][int(bond[hI])-1][7])*3  )  )
-                        ## Change hydrogen (4*H)
-                        blocks[mol['atoms']][int(bond[hI])-1][7]=("%.5f" % ( float(blocks[mol['atoms']][int(bond[hI])-1][7])*4) )    
+        # without bonds there are no hydrogens to repartition
+        if mol['name'] in excludeList or 'bonds' not in mol:
+            continue
+
+        atoms=blocks[mol['atoms']]
+        try:
+            masses=np.array([atom[7] for atom in atoms], dtype=float)
+        except IndexError:
+            logger.warning('masses of %s are taken from the atomtypes, heavy hydrogens not applied'%mol['name'])
+            continue
+
+        types=np.array([atom[1] for atom in atoms])
+        bondBlock=blocks[mol['bonds']]
+        bonds=np.stack((np.array([int(bond[0]) for bond in bondBlock], dtype=int),
+                        np.array([int(bond[1]) for bond in bondBlock], dtype=int)), axis=1)-1
+
+        newMasses=repartition_masses(masses, types, bonds)
+
+        # only the changed masses are formatted
+        changed=np.flatnonzero(newMasses!=masses)
+        for idx, mass in zip(changed.tolist(), newMasses[changed].tolist()):
+            atoms[idx][7]="%.5f"%mass
 
     return(blocks)
 
 
-def outPosre(blocks, listBlocks, listMols, excludeList):
+def outPosre(blocks, listBlocks, listMols, excludeList, workdir='.'):
+    '''write <mol>-posre.itp files in workdir, returns the file names by molecule'''
     outposre={}
     for mol in listMols:
         if mol['name'] not in excludeList:
             oitp='%s-posre.itp'%mol['name']
             outposre[mol['name']]=oitp
-            with open(oitp, "w") as outFile:
-                outFile.write(\
-'#ifndef 1POSCOS\n\
-  #define 1POSCOS 10000\n\
-#endif\n\
-#ifndef 2POSCOS\n\
-  #define 2POSCOS 5000\n\
-#endif\n\
-#ifndef 3POSCOS\n\
-  #define 3POSCOS 2000\n\
-#endif\n\
-#ifndef 4POSCOS\n\
-  #define 4POSCOS 1000\n\
-#endif\n\
-[ position_restraints ]\n')
-                for atom in blocks[mol['atoms']]:
-                    if not atom[4].startswith('H'):
-                        if atom[3] == 'HEM':
-                            outFile.write("%-4s    1  1POSCOS 1POSCOS 1POSCOS\n" % atom[0])
-                        elif atom[4] in ['CA', 'N', 'O', 'C']:
-                            outFile.write("%-4s    1  1POSCOS 1POSCOS 1POSCOS\n" % atom[0])
-                        elif atom[4] in ['CB']:
-                            outFile.write("%-4s    1  2POSCOS 2POSCOS 2POSCOS\n" % atom[0])
-                        elif atom[4] in ['CG']:
-                            outFile.write("%-4s    1  3POSCOS 3POSCOS 3POSCOS\n" % atom[0])
-                        else:
-                            outFile.write("%-4s    1  4POSCOS 4POSCOS 4POSCOS\n" % atom[0]) 
- 
+            atoms=blocks[mol['atoms']]
+            tiers=protein_restraint_tiers([atom[4] for atom in atoms], [atom[3] for atom in atoms])
+            write_restraints(os.path.join(workdir, oitp), PROTEIN_HEADER, [atom[0] for atom in atoms], tiers)
+
     return outposre
 
 
 def itpAddMols(blocks, nameBlocks, miscBlocks, miscNameBlocks):
-    
-    ##FIX ATOMTYPES
-    idxTypes=nameBlocks.index('atomtypes')
-    idxNewTypes=[ i for i, x in enumerate(miscNameBlocks) if x=='atomtypes']
-   
-    for AttypeBlock in idxNewTypes:
-        for newAtm in miscBlocks[AttypeBlock]:
-            addAtm=True
-            for atm in blocks[idxTypes]:
-                if newAtm[0]==atm[0]:
-                    addAtm=False
-                    break
-            if addAtm:
-                blocks[idxTypes].append(newAtm)
-            
-    ## ADD MOLECULETYPE
-    # new molecules are added before the system statement   
-    idxSystem=nameBlocks.index('system')
-    blNoAty=0
-    for bl in range(len(miscNameBlocks)):
-        if bl not in idxNewTypes:
-            insIdx=idxSystem+blNoAty
-            blocks.insert(insIdx, miscBlocks[bl])
-            nameBlocks.insert(insIdx, miscNameBlocks[bl])
-            blNoAty+=1
-    
+    # atomtypes are merged, new molecules are added before the system statement
+    editor=TopologyEditor(blocks, nameBlocks)
+    editor.add(miscBlocks, miscNameBlocks)
+    blocks, nameBlocks, listMols=editor.apply()
+
     return blocks, nameBlocks
     
 
@@ -292,18 +187,27 @@ def itpOut(blocks, nameBlocks, oitp, posre, excludeList={}):
         outFile.write('#ifdef POSRES\n#include "%s"\n#endif\n\n'%posreFN)
 
     def outBlock(blockName, block, output):
-        output.write("[ %s ]\n"%blockName)
-        outFormat=defineFMTblock(block)
-        for item in block:
-            output.write(outFormat.format(d=item))
+        # blocks continuing a section after a directive have no header
+        if not is_continuation(block):
+            output.write("[ %s ]\n"%blockName)
+        columns, ncols=blockColumns(block)
+        write_columns(output, columns, column_widths(columns), ncols)
 
     extItps=[]
     with open(oitp, "w") as outFile:
         molWithPosre=False
         molName=None
         for nbl, blockName in enumerate(nameBlocks):
+            # blocks that were never parsed are copied verbatim
+            raw=None
+            if isinstance(blocks, TopologyIndex):
+                raw=blocks.raw(nbl)
+
             if blockName is None:     # preprocessing instructions
                 outFile.write(blocks[nbl])
+                if not blocks[nbl].endswith("\n"):
+                    outFile.write("\n")
+                continue
     
             elif blockName in excludeList:        # specific itp
                 #WRITE EXTERNAL ITP TO INCLUDE IF REQUIRED
@@ -331,6 +235,9 @@ def itpOut(blocks, nameBlocks, oitp, posre, excludeList={}):
                         outPosre(posre[molName])
 
                 # PRINT OUT BLOCK
+                if raw is not None:
+                    outFile.write(raw)
+                    continue
                 outBlock(blockName, blocks[nbl], outFile)
 
             outFile.write("\n")
@@ -338,28 +245,19 @@ def itpOut(blocks, nameBlocks, oitp, posre, excludeList={}):
     return oitp, extItps
 
       
-def defineFMTblock(block):
-    listFmt=[]
-    for atom in block:
-        for i, item in enumerate(atom):
-            try:
-                listFmt[i].append(len(item))
-            except IndexError:
-                listFmt.append([len(item)])
-
-    nchars=[max(x)+2 for x in listFmt]
-    fmtOut=""
-    for n, col in enumerate(nchars):
-        fmtOut=fmtOut+"{d[%d]:>%ds}"%(n, col)
-    fmtOut=fmtOut+"\n"
+def blockColumns(block):
+    '''split a block (list of rows) in string columns and the number of items per row'''
+    ncols=np.array([len(atom) for atom in block], dtype=int)
+    width=int(ncols.max()) if len(block) else 0
+    if (ncols!=width).any():
+        block=[atom+['']*(width-len(atom)) for atom in block]
+    text=np.array(block, dtype=str).reshape(len(block), width)
 
-    return fmtOut
+    return [text[:, n] for n in range(width)], ncols
 
 
 def correctAttype(itp, newtypes):
-    oldtypes=[x[0] for x in itp['atomtypes']]   
-    for attype in newtypes:
-        if not attype[0] in oldtypes:
-            itp['atomtypes'].append(attype) 
+    registry=AtomTypeRegistry(itp['atomtypes'])
+    itp['atomtypes'].extend(registry.merge(newtypes))
 
     return itp
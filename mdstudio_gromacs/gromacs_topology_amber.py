@@ -7,14 +7,33 @@ createTopology function should receive an input file
 and return a tuple containing itp and pdb of the ligand.
 """
 
+import multiprocessing
 import numpy as np
 import os
-
-from mdstudio_gromacs.parsers import itp_parser, parser_atoms_mol2, parse_file
+import re
+
+from collections import OrderedDict
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+from mdstudio_gromacs.atomtypes import AtomTypeRegistry
+from mdstudio_gromacs.file_lock import file_lock
+from mdstudio_gromacs.mass_repartition import hydrogen_partners, repartition_masses
+from mdstudio_gromacs.position_restraints import LIGAND_HEADER, ligand_restraint_tiers, write_restraints
+from mdstudio_gromacs.parsers import parse_itp, parser_atoms_mol2, parse_file
+from mdstudio_gromacs.topology_cache import configure_cache, get_cache
+from mdstudio_gromacs.topology_index import TopologyIndex
+from mdstudio_gromacs.topology_table import TopologyTable, column_widths, write_columns
 from twisted.logger import Logger
 
 logger = Logger()
 
+_correction_pool = None
+_correction_settings = {'processes': None}
+
 formats_dict = {
     "defaults":
     "{:>16s}{:>16s}{:>16s}{:>8s}{:>8s}\n",
@@ -33,6 +52,9 @@ formats_dict = {
     "{:>6s}{:>7s}{:>7s}{:>7s}{:>7s}{:>9s}{:>10s}{:>4s}\n",
     "exclusions": "{:>5s}{:>5s}\n"}
 
+# Column widths of the formats
+format_widths = {k: [int(w) for w in re.findall(r'\{:>(\d+)s\}', fmt)] for k, fmt in formats_dict.items()}
+
 
 def correct_itp(itp_file, new_itp_file, posre=True):
     """
@@ -46,74 +68,404 @@ def correct_itp(itp_file, new_itp_file, posre=True):
     else:
         posre_filename = None
 
-    # read itp
+    # read itp, the sections that are not edited are copied verbatim
     itp_dict, ordered_keys = read_include_topology(itp_file)
 
-    # apply heavy hydrogens(HH)
-    itp_dict = adjust_heavy_h(itp_dict)
+    with itp_dict:
+        # apply heavy hydrogens(HH)
+        itp_dict = adjust_heavy_h(itp_dict)
 
-    # write corrected itp (with HH and no atomtype section
-    write_itp(itp_dict, ordered_keys, new_itp_file, posre=posre_filename)
+        # write corrected itp (with HH and no atomtype section
+        write_itp(itp_dict, ordered_keys, new_itp_file, posre=posre_filename)
 
-    # create positional restraints file
-    if posre:
-        write_posre(itp_dict, posre_filename)
-    # get charge ligand
-    charge = sum(float(atom[6]) for atom in itp_dict['atoms'])
+        # create positional restraints file
+        if posre:
+            write_posre(itp_dict, posre_filename)
+        # get charge ligand
+        charge = itp_dict['atoms']['charge'].sum()
+        attypes = itp_dict['atomtypes']
 
     return {'itp_filename': new_itp_file,
             'posre_filename': posre_filename,
-            'attypes': itp_dict['atomtypes'],
+            'attypes': attypes,
             'charge': int(charge)}
 
 
+def pool_context():
+    """
+    Multiprocessing context starting the workers of the correction pool.
+
+    The component runs Twisted and worker threads, forking it may copy
+    locks held by other threads into the workers. The workers are started
+    by a fork server (or spawned) instead, Python 2 can only fork.
+    """
+
+    try:
+        methods = multiprocessing.get_all_start_methods()
+    except AttributeError:
+        return multiprocessing
+
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def configure_correction_pool(processes=None):
+    """
+    Set the size of the process wide pool of `correct_itp_batch`. The
+    current pool is stopped, the new one is started on first use. A single
+    process disables the pool.
+
+    :param processes: number of worker processes, defaults to the number
+                      of cores
+    """
+
+    close_correction_pool()
+    _correction_settings['processes'] = processes
+
+
+def get_correction_pool():
+    """
+    The process wide correction pool, started with the configured (or
+    default) size on first use. None if the pool is disabled.
+
+    The workers use the topology cache of this process, the pool is
+    started again when the cache configuration changed.
+    """
+
+    global _correction_pool
+    if _correction_settings['processes'] == 1:
+        return None
+
+    cache = cache_settings()
+    if _correction_pool is not None and _correction_settings.get('cache') != cache:
+        close_correction_pool()
+
+    if _correction_pool is None:
+        _correction_settings['cache'] = cache
+        _correction_pool = pool_context().Pool(
+            _correction_settings['processes'], initializer=init_correction_worker, initargs=(cache,))
+
+    return _correction_pool
+
+
+def cache_settings():
+    """
+    Directory and size of the process wide topology cache, None if no
+    cache is configured
+    """
+
+    cache = get_cache()
+    if cache is None:
+        return None
+
+    return cache.cache_dir, cache.max_size
+
+
+def init_correction_worker(cache):
+    """
+    Process pool initializer, configure the topology cache of the worker
+    as in the process starting the pool (see `cache_settings`). Spawned
+    and fork server workers do not inherit it.
+    """
+
+    if cache is not None:
+        configure_cache(*cache)
+
+
+def close_correction_pool():
+    """
+    Stop the workers of the correction pool
+    """
+
+    global _correction_pool
+    if _correction_pool is not None:
+        _correction_pool.terminate()
+        _correction_pool.join()
+        _correction_pool = None
+
+
+def correct_itp_batch(itp_files, new_itp_files, attypes_file=None, posre=True, processes=None):
+    """
+    Run `correct_itp` for a library of ligand topologies in the process
+    wide correction pool (see `configure_correction_pool`). The atom types
+    of all ligands are merged in a single reduction step and the shared
+    `attypes_file` is rewritten only once.
+
+    :param itp_files:     ligand topology files
+    :param new_itp_files: corrected topology file for every ligand
+    :param attypes_file:  shared atom types file to add the new types to
+    :param posre:         create position restraint files
+    :param processes:     runs serially for a single process
+    :returns:             list of `correct_itp` results
+    """
+
+    jobs = [(itp_file, new_itp_file, posre) for itp_file, new_itp_file in zip(itp_files, new_itp_files)]
+
+    pool = None
+    if processes != 1 and len(jobs) > 1:
+        pool = get_correction_pool()
+
+    if pool is None:
+        results = [correct_itp_job(job) for job in jobs]
+    else:
+        results = pool.map(correct_itp_job, jobs)
+
+    if attypes_file is not None and results:
+        fix_atom_types_file(attypes_file, merge_atom_types([result['attypes'] for result in results]))
+
+    return results
+
+
+def merge_atom_types(atomtypes_list):
+    """
+    Fold the atom types tables of many ligands into a single table holding
+    every type once, in the order they are first defined
+    """
+
+    atomtypes = atomtypes_list[0]
+    registry = AtomTypeRegistry(atomtypes.rows())
+    for ligand_atomtypes in atomtypes_list[1:]:
+        atomtypes = fix_atom_types(atomtypes, ligand_atomtypes, registry=registry)
+
+    return atomtypes
+
+
+def correct_itp_job(args):
+    """
+    Process pool entry point for `correct_itp`
+    """
+
+    itp_file, new_itp_file, posre = args
+    return correct_itp(itp_file, new_itp_file, posre=posre)
+
+
 def fix_atom_types_file(attypes_file, atomtypes_ligand):
     """
     added the missing atomtypes into the attypes.itp file.
+
+    The file is locked while it is updated so concurrent requests sharing
+    it do not lose each others atom types. When `atomtypes` is the last
+    block of the file the new types are appended to it, otherwise the
+    file is rewritten.
     """
 
-    # get a dictionary of atomtypes sections together with its sorted keys
-    itp_dict, keys = read_include_topology(attypes_file)
+    with file_lock(attypes_file):
+        # get a dictionary of atomtypes sections together with its sorted keys
+        itp_dict, keys = read_include_topology(attypes_file)
 
-    # fix the atom types using the ligand topology
-    itp_dict['atomtypes'] = fix_atom_types(itp_dict['atomtypes'], atomtypes_ligand)
+        with itp_dict:
+            # fix the atom types using the ligand topology
+            registry = AtomTypeRegistry(itp_dict['atomtypes'].rows())
+            new_types = registry_mask(registry, atomtypes_ligand)
+            if not new_types.any():
+                return
 
-    # rewrite the atom file
-    write_itp(itp_dict, keys, attypes_file, posre=None, excludeList=[])
+            if keys[-1] == 'atomtypes':
+                append_atom_types(attypes_file, atomtypes_ligand[new_types])
+            else:
+                # rewrite the atom file
+                itp_dict['atomtypes'] = itp_dict['atomtypes'].append(atomtypes_ligand[new_types])
+                tmp_file = '{0}.tmp'.format(attypes_file)
+                write_itp(itp_dict, keys, tmp_file, posre=None, exclude_list=[])
+                os.rename(tmp_file, attypes_file)
 
 
-def fix_atom_types(atomtypes, ligand_atomtypes):
+def append_atom_types(attypes_file, atomtypes):
+    """
+    Append the rows of the `atomtypes` table to the trailing atomtypes
+    block of `attypes_file`.
+    """
+
+    with open(attypes_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        newline = f.tell() > 0
+        if newline:
+            f.seek(-1, os.SEEK_END)
+            newline = f.read(1) != b'\n'
+
+    with open(attypes_file, 'a') as outFile:
+        if newline:
+            outFile.write('\n')
+        columns = atomtypes.text_columns()
+        widths = format_widths['atomtypes']
+        write_columns(outFile, columns[:len(widths)], widths, atomtypes.ncols)
+
+
+def fix_atom_types(atomtypes, ligand_atomtypes, registry=None):
     """
     Add the atom types of the ligand `ligand_atomtypes` that are not already
     present at `atomtypes`.
+
+    :param registry: `AtomTypeRegistry` holding the types in `atomtypes`,
+                     reused when folding the types of many ligands
     """
 
-    ligand_atomtypes = ligand_atomtypes.reshape(ligand_atomtypes.size // 7, 7)
-    atomtypes = atomtypes.reshape(atomtypes.size // 7, 7)
-    labels = atomtypes[:, 0]
-    new_types = [atom for atom in ligand_atomtypes if atom[0] not in labels]
+    if registry is None:
+        registry = AtomTypeRegistry(atomtypes.rows())
+    new_types = registry_mask(registry, ligand_atomtypes)
 
-    if new_types:
-        return np.vstack((atomtypes, new_types))
+    if new_types.any():
+        return atomtypes.append(ligand_atomtypes[new_types])
     else:
         return atomtypes
 
 
-def read_include_topology(itp_file):
+def registry_mask(registry, atomtypes):
+    """
+    Register the rows of the `atomtypes` table and return the mask of the
+    rows that were not known before
+    """
+
+    return np.array([registry.add(row) for row in atomtypes.rows()], dtype=bool)
+
+
+def read_include_topology(itp_file, use_pyparsing=False):
     """
     Read an include topology file and returns a dictionary
-    based on the sections.
+    based on the sections. Every section is stored as a typed
+    `TopologyTable`.
 
-    :param itp_file: path to the itp file
+    The file is indexed once and a section is only parsed when it is
+    first accessed, see `IncludeTopology`. Close the topology once it has
+    been written. Parsed sections are taken from the process wide topology
+    cache if one is configured (see `topology_cache.configure_cache`).
+
+    :param itp_file:      path to the itp file
+    :param use_pyparsing: parse all sections at once with the pyparsing
+                          based parser instead
     :returns: dict
     """
 
-    rs = parse_file(itp_parser, itp_file)
+    if use_pyparsing:
+        return parse_include_topology(itp_file, use_pyparsing=True)
+
+    itp_dict = IncludeTopology(itp_file, cache=get_cache())
+
+    return itp_dict, list(itp_dict.keys())
+
+
+class IncludeTopology(MutableMapping):
+    """
+    Sections of an include topology by unique block name (see
+    `create_unique_keys`), materialised as `TopologyTable` on first
+    access.
+
+    The file is memory mapped through a `TopologyIndex`. Sections that
+    were never accessed are written back verbatim by `write_itp` using
+    `raw`. Preprocessor directives are skipped and rows following a
+    directive inside a section belong to that section, as with
+    `parse_itp`.
+
+    :param itp_file: path to the itp file
+    :param cache:    `TopologyCache` the sections are loaded from
+    """
+
+    def __init__(self, itp_file, cache=None):
+
+        self.itp_file = itp_file
+        self.cache = cache
+        self.index = TopologyIndex(itp_file)
+
+        # block name -> positions of its blocks in the index
+        self._blocks = OrderedDict()
+        names = []
+        for i, name in enumerate(self.index.names):
+            if name is None:
+                continue
+            if self.index.continues(i) and names:
+                self._blocks[names[-1]].append(i)
+            else:
+                names.append(check_name(name, names))
+                self._blocks[names[-1]] = [i]
+
+        self._tables = {}
+        # sections handed out or replaced, written back from their table
+        self._accessed = set()
+
+    def __getitem__(self, key):
+
+        if key not in self._tables:
+            if self.cache is not None:
+                self._tables.update((k, v) for k, v in self._cached().items() if k not in self._tables)
+            else:
+                rows = [row for i in self._blocks[key] for row in self.index[i]]
+                self._tables[key] = TopologyTable.from_rows(key, rows)
+
+        self._accessed.add(key)
+
+        return self._tables[key]
+
+    def __setitem__(self, key, table):
+
+        if key not in self._blocks:
+            self._blocks[key] = []
+        self._tables[key] = table
+        self._accessed.add(key)
+
+    def __delitem__(self, key):
+
+        del self._blocks[key]
+        self._tables.pop(key, None)
+        self._accessed.discard(key)
+
+    def __iter__(self):
+
+        return iter(self._blocks)
+
+    def __len__(self):
+
+        return len(self._blocks)
+
+    def __contains__(self, key):
+
+        return key in self._blocks
+
+    def _cached(self):
+
+        # Every section of the file is loaded at once from the cache
+        tables, _ = self.cache.load(self.itp_file, parse_include_topology)
+        self.cache = None
+
+        return tables
+
+    def raw(self, key):
+        """
+        Verbatim text of section `key`, header included. None if the
+        section has been accessed or spans several blocks.
+        """
+
+        blocks = self._blocks[key]
+        if key in self._accessed or len(blocks) != 1:
+            return None
+
+        return self.index.raw(blocks[0])
+
+    def close(self):
+        """
+        Release the memory map of the file
+        """
+
+        self.index.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+
+def parse_include_topology(itp_file, use_pyparsing=False):
+    """
+    Parse an include topology file into a dictionary of typed
+    `TopologyTable` sections together with the ordered section keys.
+    """
+
+    sections = parse_itp(itp_file, use_pyparsing=use_pyparsing)
 
     # tranform the result into a dict
-    vals = rs[0][1::2]
-    unique_keys = create_unique_keys(rs[0][0::2])
-    d = {k: np.array(v) for k, v in zip(unique_keys, vals)}
+    unique_keys = create_unique_keys([name for name, _ in sections])
+    d = {k: TopologyTable.from_rows(k, rows) for k, (_, rows) in zip(unique_keys, sections)}
 
     return d, unique_keys
 
@@ -145,77 +497,57 @@ def adjust_heavy_h(itp_dict):
     Adjust the weights of hydrogen's, and their heavy atom partner
     """
 
-    # Indices of the hydrogens and their heavy companions
-    hs, ps = compute_index_hs_and_partners(itp_dict)
-
-    # Count the number of hydrogens attached to the heavy atoms
-    heavy, coordination = np.unique(ps, return_counts=True)
-
-    # Update the weights
-    new_atoms = adjust_atom_weight(
-        itp_dict['atoms'], hs, heavy, coordination)
-    itp_dict['atoms'] = new_atoms
+    atoms = itp_dict['atoms']
+    atoms['mass'] = repartition_masses(atoms['mass'], atoms['type'], bond_indices(itp_dict))
 
     return itp_dict
 
 
-def adjust_atom_weight(atoms, hs, heavy, coordination):
+def compute_index_hs_and_partners(itp_dict):
     """
-    Weight the masses of the `atoms` specified  in `indices`
-    using the `weights`.
+    Extract the indices of the hydrogens and their heavy partners
     """
 
-    mass_hydrogen = float(atoms[hs[0], 7])
-    masses_hs = 4 * np.array(atoms[hs, 7], dtype=np.float)
-    masses_heavy = np.array(atoms[heavy, 7], dtype=np.float)
-    new_heavy_mass = masses_heavy - 3 * mass_hydrogen * coordination
-
-    # Array to string
-    fmt_hs = ['{:.4f}'.format(x) for x in masses_hs]
-    fmt_heavy = ['{:.4f}'.format(x) for x in new_heavy_mass]
-
-    # Update weights
-    atoms[hs, 7] = fmt_hs
-    atoms[heavy, 7] = fmt_heavy
-
-    return atoms
+    return hydrogen_partners(itp_dict['atoms']['type'], bond_indices(itp_dict))
 
 
-def compute_index_hs_and_partners(itp_dict):
+def bond_indices(itp_dict):
     """
-    Extract the indices of the hydrogens and their heavy partners
-    Assuming the the hydrogens are always listed after the heavy
-    partner.
+    Zero based atom indices of the bonds, an empty array for molecules
+    without bonds
     """
 
-    atoms = itp_dict['atoms']
-    bonds = itp_dict['bonds']
-
-    # Extract the bond indices
-    bs = np.array(bonds[:, :2], dtype=np.int) - 1
-
-    # Hydrogen indices
-    symbols = atoms[bs[:, 1], 1]
-    idxs = np.where([x.startswith(('h', 'H')) for x in symbols])
-    hs = bs[idxs, 1]
+    if 'bonds' not in itp_dict:
+        return np.empty((0, 2), dtype=int)
 
-    # Heavy partners
-    ps = bs[idxs, 0]
+    bonds = itp_dict['bonds']
 
-    return hs.flatten(), ps.flatten()
+    return np.stack((bonds['ai'], bonds['aj']), axis=1) - 1
 
 
 def write_itp(itp_dict, keys, itp_filename, posre=None, exclude_list=['atomtypes']):
     """
     write new itp. atomtype block is removed
+
+    Blocks are formatted in bulk using the column widths in `formats_dict`,
+    blocks without a predefined format are aligned on their widest item.
+    Sections of an `IncludeTopology` that were never accessed are copied
+    from the input file instead.
     """
 
     with open(itp_filename, "w") as outFile:
         for block_name in keys:
             if block_name not in exclude_list:
+                # sections that were never accessed are copied verbatim
+                raw = itp_dict.raw(block_name) if isinstance(itp_dict, IncludeTopology) else None
+                if raw is not None:
+                    outFile.write(raw if raw.endswith("\n") else raw + "\n")
+                    continue
                 outFile.write("[ {} ]\n".format(check_block_name(block_name)))
-                for item in itp_dict[block_name]:
-                    outFile.write(formats_dict[block_name].format(*item))
+                table = itp_dict[block_name]
+                columns = table.text_columns()
+                widths = format_widths.get(block_name) or column_widths(columns)
+                write_columns(outFile, columns[:len(widths)], widths, table.ncols)
         outFile.write("\n")
         if posre is not None:
             basename = os.path.basename(posre)
@@ -239,26 +571,8 @@ def write_posre(itp_dict, output_itp):
     Write position restraint itp file.
     """
 
-    header = """
-#ifndef 3POSCOS
-  #define 2POSCOS 5000
-#endif
-
-#ifndef 5POSCOS
-  #define 5POSCOS 0
-#endif
-
-[ position_restraints ]
-"""
-    with open(output_itp, "w") as f:
-        f.write(header)
-        for atom in itp_dict['atoms']:
-            if atom[1].lower().startswith("h"):
-                f.write(
-                    "{:4}    1  5POSCOS 5POSCOS 5POSCOS\n".format(atom[0]))
-            else:
-                f.write(
-                    "{:4}    1  2POSCOS 2POSCOS 2POSCOS\n".format(atom[0]))
+    atoms = itp_dict['atoms']
+    write_restraints(output_itp, LIGAND_HEADER, atoms['nr'], ligand_restraint_tiers(atoms['type']))
 
 
 def reorderhem(file_input, file_output='reordered.pdb', path_to_hem_template=None):
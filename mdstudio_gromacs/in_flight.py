@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: in_flight.py
+
+Deferred operations shared by concurrent callers.
+
+Retrieving the outputs of a job or starting a Cerise service may be
+requested again while it is in progress. Callers asking for an operation
+with the key of one in progress wait for its result instead of starting
+it again.
+"""
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+
+class InFlight(object):
+    """
+    Deferred operations by key. Callers starting an operation while one
+    with the same key is in progress receive its result instead of
+    starting another one.
+    """
+
+    def __init__(self):
+
+        # key -> Deferreds of the callers waiting for the operation
+        self._waiting = {}
+
+    def __contains__(self, key):
+
+        return key in self._waiting
+
+    def run(self, key, f, *args, **kwargs):
+        """
+        Call `f` unless an operation with `key` is in progress
+
+        :returns: Deferred firing with the result of the operation
+        """
+
+        d = Deferred()
+        waiting = self._waiting.get(key)
+        if waiting is not None:
+            waiting.append(d)
+            return d
+
+        self._waiting[key] = [d]
+        maybeDeferred(f, *args, **kwargs).addBoth(self._done, key)
+
+        return d
+
+    def _done(self, result, key):
+
+        for d in self._waiting.pop(key):
+            if isinstance(result, Failure):
+                d.errback(result)
+            else:
+                d.callback(result)
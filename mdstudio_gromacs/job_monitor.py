@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: job_monitor.py
+
+Monitor of the jobs running on the Cerise services.
+
+Every submitted job is tracked by the monitor of the service it runs on
+until it ends, callers waiting for a job register with the monitor
+instead of polling the job themselves. On every tick the monitor fetches
+the state of all tracked jobs of its service with a single call, stores
+the changed states through the task store (see `task_store`), publishes
+the transitions (see `task_events`) and wakes the callers whose
+condition is met. The number of calls against the Cerise services grows
+with the number of services rather than with the number of jobs. The
+waits between the ticks follow the polling backoff (see `polling`):
+they start short when a job is tracked or changes state and grow while
+the jobs of the service keep their state.
+"""
+
+import cerise_client.service as cc
+import requests
+
+from collections import defaultdict
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.logger import Logger
+
+from mdstudio_gromacs.cerise_calls import call_in_pool
+from mdstudio_gromacs.polling import get_backoff
+from mdstudio_gromacs.task_events import publish_status
+
+logger = Logger()
+
+_monitors = {}
+_monitor_settings = {'tasks': None, 'backoff': None}
+
+
+def jobs_url(srv):
+    """
+    URL of the jobs of the Cerise service `srv` in its REST API. The
+    Cerise client does not expose it, so it is taken from the client
+    internals in this function only: the private `Service._jobs`
+    attribute of cerise_client 0.3. Other versions of the client raise
+    a RuntimeError here rather than failing later on.
+    """
+
+    try:
+        return srv._jobs
+    except AttributeError:
+        raise RuntimeError('Unsupported cerise_client version: the jobs URL of service {0} is unknown'.format(
+            getattr(srv, 'name', None)))
+
+
+def job_states(srv, timeout=30.0):
+    """
+    State of every job of the service `srv` by job name, retrieved with
+    a single call to the Cerise REST API. The jobs returned by
+    `srv.list_jobs` request their state one by one. A service that does
+    not answer within `timeout` seconds raises a `requests.Timeout`.
+    """
+    response = requests.get(jobs_url(srv), timeout=timeout)
+    response.raise_for_status()
+
+    return {job['name']: job['state'] for job in response.json()}
+
+
+def job_status(state):
+    """
+    Task status for the Cerise job `state`
+    """
+    state = state.lower()
+    if state == 'waiting':
+        return 'queued'
+    elif state == 'running':
+        return 'running'
+    elif state == 'success':
+        return 'completed'
+
+    return 'failed'
+
+
+def is_final(status):
+    """
+    Whether a job with `status` has ended
+    """
+
+    return status in ('completed', 'failed')
+
+
+class JobMonitor(object):
+    """
+    Track the jobs of one Cerise service until they end.
+
+    :param srv_data: Cerise service dictionary, see `cc.service_to_dict`
+    :param tasks:    `task_store.TaskStore` of the Cerise jobs, the states
+                     are not stored if None
+    :param backoff:  `polling.Backoff` of the waits between the checks of
+                     the service, the process wide backoff by default
+    :param clock:    reactor to schedule the checks on
+    """
+
+    def __init__(self, srv_data, tasks=None, backoff=None, clock=None):
+
+        self.srv_data = srv_data
+        self.tasks = tasks
+        self.backoff = backoff or get_backoff()
+        self.clock = clock or reactor
+        self.in_thread = True
+
+        # task_id -> last Cerise state, batch_id and waiting callers
+        self.states = {}
+        self._batches = {}
+        self._waiters = defaultdict(list)
+        self._delays = self.backoff.delays()
+        self._timer = None
+        self._checking = False
+
+    @property
+    def tracked(self):
+        """
+        task_ids of the jobs being monitored
+        """
+
+        return list(self._batches)
+
+    @property
+    def running(self):
+        """
+        Whether a check of the service is scheduled or in progress
+        """
+
+        return self._checking or (self._timer is not None and self._timer.active())
+
+    def track(self, task_id, batch_id=None):
+        """
+        Monitor the job `task_id` until it ends. Its transitions are
+        stored and published whether or not a caller waits for it.
+        """
+
+        new = task_id not in self._batches
+        if self._batches.get(task_id) is None:
+            self._batches[task_id] = batch_id
+
+        if new:
+            # Check the new job soon, the backoff starts over
+            self._delays = self.backoff.delays()
+            if self._timer is not None and self._timer.active():
+                self._timer.cancel()
+
+        if not self._checking:
+            self._schedule()
+
+    def wait(self, task_id, condition=is_final, batch_id=None):
+        """
+        Wait until the status of the job `task_id` meets `condition`.
+        Callers are woken with the final status once the job ends,
+        whatever their condition.
+
+        :returns: Deferred firing with the status of the job
+        """
+
+        d = Deferred()
+        self._waiters[task_id].append((condition, d))
+        self.track(task_id, batch_id=batch_id)
+
+        return d
+
+    def list_states(self):
+        """
+        Current state of all jobs of the service
+        """
+
+        return job_states(cc.service_from_dict(self.srv_data))
+
+    def tick(self):
+        """
+        Check the jobs of the service once. Errors are logged, they
+        never stop the monitor.
+        """
+
+        if self.in_thread:
+            d = call_in_pool(self.list_states)
+        else:
+            d = maybeDeferred(self.list_states)
+
+        d.addCallbacks(self.update, self._list_failed)
+        d.addErrback(self._update_failed)
+
+        return d
+
+    def update(self, states):
+        """
+        Process the job `states` of the service: store and publish the
+        changes and wake the callers waiting for them.
+        """
+
+        changed = defaultdict(list)
+        woken = []
+        for task_id in list(self._batches):
+            state = states.get(task_id)
+            if state is None:
+                logger.warn("job {task_id} was not found in service {name}", task_id=task_id,
+                            name=self.srv_data.get('name'))
+                error = RuntimeError('Job {0} was not found in service {1}'.format(task_id, self.srv_data.get('name')))
+                woken.extend((d, error) for _, d in self._waiters.get(task_id, []))
+                self._forget(task_id)
+                continue
+
+            status = job_status(state)
+            if state != self.states.get(task_id):
+                self.states[task_id] = state
+                changed[state].append(task_id)
+                # Final states are published once the output is retrieved
+                if not is_final(status):
+                    publish_status(task_id, status, self._batches.get(task_id))
+
+            waiting = []
+            for condition, d in self._waiters.pop(task_id, []):
+                if is_final(status) or condition(status):
+                    woken.append((d, status))
+                else:
+                    waiting.append((condition, d))
+            if waiting:
+                self._waiters[task_id] = waiting
+
+            if is_final(status):
+                self._forget(task_id)
+
+        if self.tasks is not None:
+            for state, task_ids in changed.items():
+                self.tasks.update_many(task_ids, {'job_state': state})
+                # Other fields may have been changed by other instances
+                self.tasks.invalidate(task_ids)
+
+        # Check again soon after a change, the backoff starts over
+        if changed:
+            self._delays = self.backoff.delays()
+
+        for d, result in woken:
+            if isinstance(result, Exception):
+                d.errback(result)
+            else:
+                d.callback(result)
+
+    def _schedule(self):
+
+        if self._batches and (self._timer is None or not self._timer.active()):
+            self._timer = self.clock.callLater(next(self._delays), self._tick)
+
+    def _tick(self):
+
+        self._timer = None
+        self._checking = True
+        self.tick().addBoth(self._ticked)
+
+    def _ticked(self, _):
+
+        self._checking = False
+        self._schedule()
+
+    def _list_failed(self, failure):
+
+        # Keep monitoring, the service may be restarting
+        logger.warn("listing the jobs of service {name} failed: {error}",
+                    name=self.srv_data.get('name'), error=failure.getErrorMessage())
+
+    def _update_failed(self, failure):
+
+        # The jobs are processed again on the next tick
+        logger.error("updating the jobs of service {name} failed: {error}",
+                     name=self.srv_data.get('name'), error=failure.getErrorMessage())
+
+    def _forget(self, task_id):
+
+        self._waiters.pop(task_id, None)
+        self._batches.pop(task_id, None)
+        self.states.pop(task_id, None)
+
+
+def configure_monitors(tasks=None, backoff=None):
+    """
+    Set the task store and the backoff of the checks of the job monitors,
+    the process wide polling backoff by default
+    """
+
+    _monitor_settings['tasks'] = tasks
+    _monitor_settings['backoff'] = backoff
+
+
+def get_monitor(srv_data):
+    """
+    The monitor of the Cerise service described by `srv_data`
+    """
+
+    key = (srv_data.get('name'), srv_data.get('port'))
+    monitor = _monitors.get(key)
+    if monitor is None:
+        monitor = JobMonitor(srv_data, tasks=_monitor_settings['tasks'], backoff=_monitor_settings['backoff'])
+        _monitors[key] = monitor
+
+    return monitor
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: mass_repartition.py
+
+Hydrogen mass repartitioning (heavy hydrogens) on atom arrays.
+
+The mass of every hydrogen is multiplied by `factor` and the added mass
+is taken from the heavy atom(s) it is bonded to, keeping the total mass
+of the molecule unchanged.
+"""
+
+import numpy as np
+
+HYDROGEN_FACTOR = 4
+
+
+def hydrogen_mask(types):
+    """
+    Boolean mask of the hydrogen atoms, these have a type starting
+    with `h` or `H`.
+
+    :param types: array of atom types, either str or bytes
+    """
+
+    types = np.asarray(types)
+    if types.dtype.kind == 'S':
+        first = types.astype('S1')
+        return (first == b'h') | (first == b'H')
+
+    first = types.astype('U1')
+    return (first == u'h') | (first == u'H')
+
+
+def hydrogen_partners(types, bonds):
+    """
+    Hydrogen and heavy partner of all bonds between a hydrogen and a
+    heavy atom, whatever the order of the atoms in the bond.
+
+    :param types: array of atom types
+    :param bonds: (n, 2) array of zero based atom indices
+    :returns:     tuple of index arrays of the hydrogens and of their
+                  heavy partners
+    """
+
+    bonds = np.asarray(bonds, dtype=int).reshape(-1, 2)
+    is_h = hydrogen_mask(types)
+
+    first = is_h[bonds[:, 0]]
+    second = is_h[bonds[:, 1]]
+    selection = first != second
+    bonds = bonds[selection]
+    first = first[selection]
+
+    hs = np.where(first, bonds[:, 0], bonds[:, 1])
+    ps = np.where(first, bonds[:, 1], bonds[:, 0])
+
+    return hs, ps
+
+
+def repartition_masses(masses, types, bonds, factor=HYDROGEN_FACTOR, atol=1e-4):
+    """
+    Repartition the masses of the hydrogens bonded to heavy atoms
+
+    :param masses: array of atom masses
+    :param types:  array of atom types
+    :param bonds:  (n, 2) array of zero based atom indices
+    :param factor: hydrogen mass multiplier
+    :param atol:   allowed change of the total mass
+    :returns:      new array of masses
+    :raises:       ValueError if the total mass is not conserved or a
+                   heavy atom ends up without mass
+    """
+
+    masses = np.asarray(masses, dtype=float)
+    hs, ps = hydrogen_partners(types, bonds)
+    if hs.size == 0:
+        return masses.copy()
+
+    n = len(masses)
+
+    # Heavy partners per hydrogen, a hydrogen bonded to several heavy
+    # atoms takes its extra mass evenly from all of them
+    partners = np.bincount(hs, minlength=n)
+    extra = (factor - 1) * masses[hs] / partners[hs]
+
+    new_masses = masses - np.bincount(ps, weights=extra, minlength=n)
+    hydrogens = np.unique(hs)
+    new_masses[hydrogens] = factor * masses[hydrogens]
+
+    if abs(new_masses.sum() - masses.sum()) > atol:
+        raise ValueError('Mass repartitioning changed the total mass from {0} to {1}'.format(
+            masses.sum(), new_masses.sum()))
+    if (new_masses[np.unique(ps)] <= 0).any():
+        raise ValueError('Mass repartitioning left heavy atoms without mass')
+
+    return new_masses
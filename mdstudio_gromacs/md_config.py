@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
-from os.path import join
+from os.path import basename, dirname, join
 from twisted.logger import Logger
 
-from mdstudio_gromacs.gromacs_topology_amber import correct_itp, fix_atom_types_file
+from mdstudio_gromacs.gromacs_topology_amber import (correct_itp, correct_itp_batch, fix_atom_types_file,
+                                                   merge_atom_types)
+from mdstudio_gromacs.prepared_topology import get_prepared_cache
+from mdstudio_gromacs.topology_cache import file_digest
+from mdstudio_gromacs.topology_preprocessor import load_topology
 
 logger = Logger()
 
@@ -16,29 +20,158 @@ def set_gromacs_input(dict_input):
     # added a job type
     dict_input['job_type'] = "solvent_ligand_md" if dict_input.get('protein_file') is None else "protein_ligand_md"
 
+    check_protein_topology(dict_input)
+
     # correct topology
     return fix_topology_ligand(dict_input, dict_input['workdir'])
 
 
+def set_gromacs_inputs(dict_inputs, attype_itp=None):
+    """
+    Create input files for gromacs for a batch of ligands sharing the
+    atom types file `attype_itp`.
+    """
+
+    for dict_input in dict_inputs:
+        dict_input['job_type'] = "solvent_ligand_md" if dict_input.get('protein_file') is None else "protein_ligand_md"
+
+    # The protein topology is shared by the batch
+    if dict_inputs:
+        check_protein_topology(dict_inputs[0])
+
+    return fix_topology_ligands(dict_inputs, attype_itp=attype_itp)
+
+
 def fix_topology_ligand(gromacs_config, workdir):
     """
     Adjust topology for the ligand.
+
+    Prepared topologies are taken from the process wide prepared topology
+    cache if one is configured (see `prepared_topology.configure_prepared_cache`).
     """
 
     itp_file = join(workdir, 'ligand.itp')
-    dict_results = correct_itp(gromacs_config['topology_file'], itp_file, posre=True)
+    attype_itp = gromacs_config.get('attype_itp')
+
+    cache = get_prepared_cache()
+    dict_results = None
+    if cache is not None:
+        attypes_digest = file_digest(attype_itp) if attype_itp is not None else None
+        key = cache.key(gromacs_config['topology_file'], attype_itp,
+                        options={'posre': True, 'itp_name': basename(itp_file)})
+        dict_results = cache.fetch(key, itp_file, attype_itp)
+
+    if dict_results is None:
+        dict_results = correct_itp(gromacs_config['topology_file'], itp_file, posre=True)
+
+        # correct atomtypes file
+        if attype_itp is not None:
+            fix_atom_types_file(attype_itp, dict_results['attypes'])
+
+        if cache is not None:
+            cache.store(key, dict_results, attypes_digest=attypes_digest, attypes_file=attype_itp)
+    else:
+        logger.info("prepared topology taken from cache: {key}", key=key)
 
     # Add charges and topology
     gromacs_config['charge'] = dict_results['charge']
     gromacs_config['topology_file'] = dict_results['itp_filename']
 
-    # correct atomtypes file
-    if 'attype_itp' in gromacs_config:
-        fix_atom_types_file(gromacs_config['attype_itp'], dict_results['attypes'])
-
     # Added further include file
     include_itp = dict_results.get('posre_filename', None)
     if include_itp is not None:
         gromacs_config['include'].append(include_itp)
 
     return gromacs_config
+
+
+def fix_topology_ligands(gromacs_configs, attype_itp=None, processes=None):
+    """
+    Adjust the topologies of many ligands in parallel, see
+    `fix_topology_ligand`. The new atom types of all ligands are added
+    to the shared `attype_itp` file in a single write.
+
+    Every ligand is looked up in the prepared topology cache first, only
+    the misses are prepared. The shared atom types file changes with every
+    batch, so the entries of a batch are keyed without it and their atom
+    types are merged into `attype_itp` here.
+    """
+
+    itp_files = [join(config['workdir'], 'ligand.itp') for config in gromacs_configs]
+
+    cache = get_prepared_cache()
+    results = [None] * len(gromacs_configs)
+    keys = [None] * len(gromacs_configs)
+    if cache is not None:
+        for i, (config, itp_file) in enumerate(zip(gromacs_configs, itp_files)):
+            keys[i] = cache.key(config['topology_file'], options={'posre': True, 'itp_name': basename(itp_file)})
+            results[i] = cache.fetch(keys[i], itp_file)
+
+    missing = [i for i, dict_results in enumerate(results) if dict_results is None]
+    prepared = correct_itp_batch([gromacs_configs[i]['topology_file'] for i in missing],
+                                 [itp_files[i] for i in missing], posre=True, processes=processes)
+    for i, dict_results in zip(missing, prepared):
+        results[i] = dict_results
+        if cache is not None:
+            cache.store(keys[i], dict_results)
+
+    if cache is not None and len(missing) < len(results):
+        logger.info("{count} prepared topologies taken from cache", count=len(results) - len(missing))
+
+    # correct atomtypes file
+    if attype_itp is not None and results:
+        fix_atom_types_file(attype_itp, merge_atom_types([dict_results['attypes'] for dict_results in results]))
+
+    for gromacs_config, dict_results in zip(gromacs_configs, results):
+        gromacs_config['charge'] = dict_results['charge']
+        gromacs_config['topology_file'] = dict_results['itp_filename']
+
+        include_itp = dict_results.get('posre_filename', None)
+        if include_itp is not None:
+            gromacs_config['include'].append(include_itp)
+
+    return gromacs_configs
+
+
+def load_protein_topology(gromacs_config, defines=('POSRES',)):
+    """
+    Preprocess the protein topology for the given `defines`.
+
+    Includes are resolved relative to the protein topology and against
+    the directories of the include files (attype_itp, protein_posre_itp)
+    staged by `setup_environment`. Included files are tokenized once per
+    process.
+    """
+
+    include_dirs = sorted(set(dirname(path) for path in gromacs_config.get('include', [])))
+
+    return load_topology(gromacs_config['protein_top'], defines=list(defines), include_dirs=include_dirs)
+
+
+def check_protein_topology(gromacs_config):
+    """
+    Preprocess the protein topology, resolving the include files staged
+    by `setup_environment` and keeping them in the include cache for
+    later requests.
+
+    grompp reads the topology on the Cerise service, so problems are only
+    logged: includes that are not staged (e.g. the force field files of
+    GMXLIB provided by the service) and conditionals the loader does not
+    support.
+    """
+
+    if gromacs_config.get('protein_top') is None:
+        return None
+
+    try:
+        topology = load_protein_topology(gromacs_config)
+    except (ValueError, IOError) as e:
+        logger.warn("unable to preprocess the protein topology {name}: {error}",
+                    name=basename(gromacs_config['protein_top']), error=e)
+        return None
+
+    for source, name in topology.missing:
+        logger.info("{name} included by {source} is not staged with the protein topology",
+                    name=name, source=basename(source))
+
+    return topology
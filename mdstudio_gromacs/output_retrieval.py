@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: output_retrieval.py
+
+Parallel and resumable retrieval of the outputs of a Cerise job.
+
+Outputs are downloaded in a bounded thread pool. Every output is saved
+to a uniquely named temporary file that is renamed into place once
+complete, and its size (and optionally its checksum) is merged into a
+manifest in the task workdir. Outputs recorded in the manifest whose
+file still matches are not downloaded again, so retrieving the outputs
+after a failure only transfers the missing files. Concurrent retrievals
+of the same outputs into the same task workdir share a single download.
+"""
+
+import json
+import os
+import tempfile
+
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList
+from twisted.internet.threads import deferToThreadPool
+from twisted.logger import Logger
+from twisted.python.threadpool import ThreadPool
+
+from mdstudio_gromacs.in_flight import InFlight
+from mdstudio_gromacs.topology_cache import file_digest
+
+MANIFEST = 'outputs.json'
+
+logger = Logger()
+
+_default_retriever = None
+
+
+def save_output(output, path, checksum=False):
+    """
+    Save the Cerise `output` file as `path` through a temporary file
+
+    :returns: manifest record of the file
+    """
+
+    fd, tmp = tempfile.mkstemp(suffix='.part', prefix='{0}.'.format(os.path.basename(path)),
+                               dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        output.save_as(tmp)
+        record = {'size': os.path.getsize(tmp)}
+        if checksum:
+            record['sha256'] = file_digest(tmp)
+        os.rename(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+    return record
+
+
+def read_manifest(manifest_file):
+    """
+    Records of the outputs retrieved before, by output name
+    """
+
+    try:
+        with open(manifest_file, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def write_manifest(manifest_file, manifest):
+    """
+    Atomically replace the manifest
+    """
+
+    tmp = '{0}.tmp'.format(manifest_file)
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.rename(tmp, manifest_file)
+
+
+def is_retrieved(path, record, checksum=False):
+    """
+    Whether `path` holds the complete output described by `record`
+    """
+
+    if record is None or not os.path.isfile(path):
+        return False
+    if os.path.getsize(path) != record.get('size'):
+        return False
+    if checksum and 'sha256' in record:
+        return file_digest(path) == record['sha256']
+
+    return True
+
+
+class OutputRetriever(object):
+    """
+    Retrieve job outputs in a thread pool.
+
+    :param size:     number of outputs downloaded at once
+    :param checksum: record and verify SHA-256 checksums besides the size
+    """
+
+    def __init__(self, size=4, checksum=False):
+
+        self.size = size
+        self.checksum = checksum
+        self.pool = None
+
+        # Retrievals in progress by workdir and output names
+        self._retrievals = InFlight()
+
+    def start(self):
+        """
+        Start the download pool, stopped when the reactor shuts down
+        """
+
+        if self.pool is None:
+            self.pool = ThreadPool(minthreads=1, maxthreads=self.size, name='mdstudio_gromacs_output')
+            self.pool.start()
+            reactor.addSystemEventTrigger('before', 'shutdown', self.pool.stop)
+
+    def retrieve(self, outputs, paths, workdir):
+        """
+        Save every output in `outputs` at its path in `paths`
+
+        :param outputs: Cerise output files by name
+        :param paths:   local path of every output by name
+        :param workdir: task workdir holding the manifest
+        :returns:       Deferred firing with the path of every output by
+                        name, None for outputs the job did not produce
+
+        A retrieval of the same outputs into `workdir` while another one
+        is in progress fires with the result of the latter.
+        """
+
+        key = (workdir, frozenset(outputs))
+        return self._retrievals.run(key, self._retrieve, outputs, paths, workdir)
+
+    def _retrieve(self, outputs, paths, workdir):
+
+        self.start()
+
+        manifest_file = os.path.join(workdir, MANIFEST)
+        manifest = read_manifest(manifest_file)
+
+        results = {}
+        errors = []
+        downloads = []
+        for name, output in outputs.items():
+            path = paths[name]
+            if is_retrieved(path, manifest.get(name), checksum=self.checksum):
+                results[name] = path
+                continue
+
+            d = deferToThreadPool(reactor, self.pool, save_output, output, path, checksum=self.checksum)
+            d.addCallbacks(self._saved, self._failed, callbackArgs=(name, path, manifest_file, results),
+                           errbackArgs=(name, results, errors))
+            downloads.append(d)
+
+        def done(_):
+            if errors:
+                errors[0].raiseException()
+            return results
+
+        return DeferredList(downloads).addCallback(done)
+
+    def _saved(self, record, name, path, manifest_file, results):
+
+        # Runs in the reactor thread, one manifest update at a time. The
+        # manifest is read again to keep the records of other retrievals
+        # into the same workdir.
+        manifest = read_manifest(manifest_file)
+        manifest[name] = record
+        write_manifest(manifest_file, manifest)
+        results[name] = path
+
+    def _failed(self, failure, name, results, errors):
+
+        # The job did not produce the output
+        if failure.check(AttributeError):
+            results[name] = None
+            return
+
+        logger.warn("retrieving output {name} failed: {error}", name=name, error=failure.getErrorMessage())
+        errors.append(failure)
+
+
+def configure_retriever(size=4, checksum=False):
+    """
+    Set the process wide output retriever
+    """
+
+    global _default_retriever
+    _default_retriever = OutputRetriever(size=size, checksum=checksum)
+
+    return _default_retriever
+
+
+def get_retriever():
+    """
+    The process wide output retriever, with the default settings if not
+    configured
+    """
+
+    if _default_retriever is None:
+        return configure_retriever()
+
+    return _default_retriever
@@ -17,6 +17,78 @@ def parse_file(p, file_name):
         raise
 
 
+def iter_sections(file_name):
+    """
+    Stream the sections of a GROMACS topology (.itp/.top) file.
+
+    Single pass, line oriented tokenizer that yields one `(section, rows)`
+    tuple at a time so the file is never held in memory as a whole.
+    Comments, blank lines and preprocessor directives are skipped and
+    every row is returned as a list of whitespace separated tokens.
+
+    :param file_name: path to the topology file
+    :returns:         generator of (section name, list of rows) tuples
+    """
+
+    with open(file_name, 'r') as f:
+        for section, rows in tokenize_sections(f):
+            yield section, rows
+
+
+def tokenize_sections(lines):
+    """
+    Group an iterable of topology `lines` into `(section, rows)` tuples.
+    """
+
+    section = None
+    rows = []
+    for line in lines:
+        line = line.split(';', 1)[0].strip()
+        if not line or line.startswith('#'):
+            continue
+
+        if line.startswith('['):
+            if section is not None:
+                yield section, rows
+            section = line[1:line.find(']')].strip()
+            rows = []
+        elif section is not None:
+            rows.append(line.split())
+
+    if section is not None:
+        yield section, rows
+
+
+def tokenize_rows(lines):
+    """
+    Rows of tokens in a chunk of topology `lines`, section headers,
+    comments and preprocessor directives are skipped.
+    """
+
+    rows = []
+    for line in lines:
+        line = line.split(';', 1)[0].strip()
+        if line and not line.startswith(('#', '[')):
+            rows.append(line.split())
+
+    return rows
+
+
+def parse_itp(file_name, use_pyparsing=False):
+    """
+    Parse a topology file into a list of `(section, rows)` tuples.
+
+    The streaming tokenizer is used by default, the (much slower)
+    pyparsing `itp_parser` is kept as opt-in fallback for comparison.
+    """
+
+    if use_pyparsing:
+        rs = parse_file(itp_parser, file_name)
+        return list(zip(rs[0][0::2], rs[0][1::2]))
+
+    return list(iter_sections(file_name))
+
+
 def skip_supress(z):
     """Suppress stream until `z`"""
     return pp.Suppress(pp.SkipTo(z))
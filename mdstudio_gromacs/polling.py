@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: polling.py
+
+Polling of remote state on reactor timers.
+
+A check, for instance reading the state of a Cerise job, is repeated
+until its result is final. The checks run in the reactor thread pool and
+the waits between them are reactor timers, so any number of jobs can be
+waited for without blocking the component. The wait grows exponentially
+up to a maximum and is jittered so the checks of jobs submitted together
+spread out over time.
+"""
+
+import random
+
+from twisted.internet import reactor, task, threads
+from twisted.internet.defer import Deferred, maybeDeferred
+
+_default_backoff = None
+
+
+class Backoff(object):
+    """
+    Exponential backoff with jitter.
+
+    :param initial: first wait in seconds
+    :param maximum: longest wait in seconds
+    :param factor:  growth of the wait after every check
+    :param jitter:  fraction of the wait added or removed at random
+    """
+
+    def __init__(self, initial=2.0, maximum=30.0, factor=1.5, jitter=0.1):
+
+        if initial <= 0 or maximum < initial or factor < 1 or not 0 <= jitter < 1:
+            raise ValueError('Invalid backoff: initial={0}, maximum={1}, factor={2}, jitter={3}'.format(
+                initial, maximum, factor, jitter))
+
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+    def delays(self):
+        """
+        Endless sequence of waits in seconds
+        """
+
+        delay = self.initial
+        while True:
+            yield delay * (1 + random.uniform(-self.jitter, self.jitter))
+            delay = min(delay * self.factor, self.maximum)
+
+
+def poll(check, done, backoff=None, clock=None, in_thread=True):
+    """
+    Call `check` until `done` holds for its result, waiting between the
+    calls with `backoff` (the process wide backoff by default).
+
+    :param check:     function returning the current state, may return a
+                      Deferred if not run `in_thread`
+    :param done:      function telling if a state is final
+    :param clock:     reactor to schedule the checks on
+    :param in_thread: run `check` in the reactor thread pool, for checks
+                      doing blocking I/O
+    :returns:         Deferred firing with the final state
+    """
+
+    backoff = backoff or get_backoff()
+    clock = clock or reactor
+    delays = backoff.delays()
+    result = Deferred()
+
+    def call():
+        if in_thread:
+            d = threads.deferToThread(check)
+        else:
+            d = maybeDeferred(check)
+        d.addCallbacks(checked, result.errback)
+
+    def checked(state):
+        try:
+            final = done(state)
+        except Exception:
+            result.errback()
+            return
+
+        if final:
+            result.callback(state)
+        else:
+            task.deferLater(clock, next(delays), call).addErrback(result.errback)
+
+    call()
+
+    return result
+
+
+def configure_polling(initial=2.0, maximum=30.0, factor=1.5, jitter=0.1):
+    """
+    Set the process wide polling backoff
+    """
+
+    global _default_backoff
+    _default_backoff = Backoff(initial=initial, maximum=maximum, factor=factor, jitter=jitter)
+
+    return _default_backoff
+
+
+def get_backoff():
+    """
+    The process wide polling backoff, the defaults of `Backoff` if not
+    configured
+    """
+
+    if _default_backoff is None:
+        return configure_polling()
+
+    return _default_backoff
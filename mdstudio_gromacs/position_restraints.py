@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: position_restraints.py
+
+Position restraint (posre) files from atom arrays.
+
+Atoms are classified into restraint tiers with array masks, tier `n`
+restrains the atom with the force constant `nPOSCOS` defined in the
+header of the file and tier 0 leaves the atom free.
+"""
+
+import numpy as np
+
+from mdstudio_gromacs.mass_repartition import hydrogen_mask
+
+BACKBONE = ('CA', 'N', 'O', 'C')
+
+PROTEIN_HEADER = """#ifndef 1POSCOS
+  #define 1POSCOS 10000
+#endif
+#ifndef 2POSCOS
+  #define 2POSCOS 5000
+#endif
+#ifndef 3POSCOS
+  #define 3POSCOS 2000
+#endif
+#ifndef 4POSCOS
+  #define 4POSCOS 1000
+#endif
+[ position_restraints ]
+"""
+
+LIGAND_HEADER = """
+#ifndef 3POSCOS
+  #define 2POSCOS 5000
+#endif
+
+#ifndef 5POSCOS
+  #define 5POSCOS 0
+#endif
+
+[ position_restraints ]
+"""
+
+
+def protein_restraint_tiers(names, residues):
+    """
+    Restraint tiers of protein atoms: backbone (CA, N, O, C) and heme
+    atoms in tier 1, CB in tier 2, CG in tier 3 and the other heavy
+    atoms in tier 4. Hydrogens are not restrained.
+
+    :param names:    array of atom names
+    :param residues: array of residue names
+    """
+
+    names = np.asarray(names, dtype=str)
+    residues = np.asarray(residues, dtype=str)
+
+    tiers = np.full(len(names), 4, dtype=int)
+    tiers[names == 'CG'] = 3
+    tiers[names == 'CB'] = 2
+    tiers[np.isin(names, BACKBONE)] = 1
+    tiers[residues == 'HEM'] = 1
+    tiers[np.char.startswith(names, 'H')] = 0
+
+    return tiers
+
+
+def ligand_restraint_tiers(types):
+    """
+    Restraint tiers of ligand atoms: heavy atoms in tier 2 and hydrogens
+    in tier 5.
+
+    :param types: array of atom types
+    """
+
+    return np.where(hydrogen_mask(types), 5, 2)
+
+
+def format_restraints(numbers, tiers):
+    """
+    Format the position restraints of the atoms with a tier above 0
+
+    :param numbers: array of atom numbers
+    :param tiers:   array of restraint tiers
+    :returns:       the restraint lines as one string
+    """
+
+    tiers = np.asarray(tiers, dtype=int)
+    restrained = tiers > 0
+    if not restrained.any():
+        return ''
+
+    numbers = np.char.ljust(np.asarray(numbers).astype(str)[restrained], 4)
+    suffixes = np.array(['    1  {0}POSCOS {0}POSCOS {0}POSCOS\n'.format(tier)
+                         for tier in range(tiers.max() + 1)])
+
+    return ''.join(np.char.add(numbers, suffixes[tiers[restrained]]).tolist())
+
+
+def write_restraints(filename, header, numbers, tiers):
+    """
+    Write a position restraint file in a single call
+    """
+
+    with open(filename, 'w') as f:
+        f.write(header + format_restraints(numbers, tiers))
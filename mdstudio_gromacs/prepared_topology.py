@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: prepared_topology.py
+
+Cache of prepared ligand topologies.
+
+Preparing a ligand topology (`gromacs_topology_amber.correct_itp`)
+writes the corrected itp and position restraint files and adds the
+ligand atom types to the atom types file. The cache stores these results
+keyed by the content of the input itp, the content of the atom types
+file and the preparation options, so resubmitting the same ligand only
+links the prepared files into the new task directory. Cached files are
+read only, a write through one of their links fails rather than
+changing the entry for later tasks.
+"""
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+from mdstudio_gromacs.file_lock import file_lock
+from mdstudio_gromacs.gromacs_topology_amber import fix_atom_types_file
+from mdstudio_gromacs.topology_cache import file_digest, read_tables, write_tables
+
+# Bump when the preparation of the topologies changes
+PREPARED_VERSION = b'prepared-topology-2'
+
+# Mode of the files of a cache entry
+READ_ONLY = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+
+_default_cache = None
+
+
+def link_or_copy(source, destination):
+    """
+    Hard link `source` to `destination`, copying it if the files are on
+    different file systems or hard links are not supported.
+    """
+
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except (OSError, AttributeError) as e:
+        if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        shutil.copy(source, destination)
+
+
+class PreparedTopologyCache(object):
+    """
+    On-disk cache of prepared ligand topologies with LRU eviction.
+
+    Every entry is a directory holding the prepared files, the ligand
+    atom types and a `metadata.json` file.
+
+    :param cache_dir: directory to store the prepared topologies in
+    :param max_size:  maximum total size of the cache in bytes
+    """
+
+    def __init__(self, cache_dir, max_size=512 * 1024 ** 2):
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, itp_file, attypes_file=None, options=None):
+        """
+        Cache key of the preparation of `itp_file` with the atom types in
+        `attypes_file` and the preparation `options`
+        """
+
+        sha = hashlib.sha256(PREPARED_VERSION)
+        sha.update(file_digest(itp_file).encode('ascii'))
+        if attypes_file is not None:
+            sha.update(file_digest(attypes_file).encode('ascii'))
+        sha.update(json.dumps(options or {}, sort_keys=True).encode('utf-8'))
+
+        return sha.hexdigest()
+
+    def path(self, key):
+        """
+        Location of the cache entry for `key`
+        """
+
+        return os.path.join(self.cache_dir, key)
+
+    def fetch(self, key, itp_file, attypes_file=None):
+        """
+        Link the prepared topology stored under `key` to `itp_file` and
+        restore the prepared atom types file.
+
+        :returns: the `correct_itp` results or None on a cache miss
+        """
+
+        entry = self.path(key)
+        try:
+            with open(os.path.join(entry, 'metadata.json'), 'r') as f:
+                metadata = json.load(f)
+            tables, _ = read_tables(os.path.join(entry, 'attypes.npz'))
+        except (IOError, OSError, ValueError, KeyError):
+            self._count('misses')
+            return None
+
+        link_or_copy(os.path.join(entry, 'ligand.itp'), itp_file)
+        posre_filename = None
+        if metadata['posre']:
+            posre_filename = "{}-posre.itp".format(os.path.splitext(itp_file)[0])
+            link_or_copy(os.path.join(entry, 'ligand-posre.itp'), posre_filename)
+
+        if attypes_file is not None:
+            restored = restore_attypes(os.path.join(entry, 'attype.itp'), attypes_file, metadata['attypes_digest'])
+            if not restored:
+                # Changed since the key was computed, add the types instead
+                fix_atom_types_file(attypes_file, tables['atomtypes'])
+
+        # Mark as recently used
+        os.utime(entry, None)
+        self._count('hits')
+
+        return {'itp_filename': itp_file,
+                'posre_filename': posre_filename,
+                'attypes': tables['atomtypes'],
+                'charge': metadata['charge']}
+
+    def store(self, key, results, attypes_digest=None, attypes_file=None):
+        """
+        Store the `correct_itp` results under `key` together with the
+        prepared `attypes_file`. Concurrent stores of the same entry are
+        harmless, the first one wins.
+
+        :param attypes_digest: digest of the atom types file before it
+                               was prepared
+        """
+
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            shutil.copy(results['itp_filename'], os.path.join(tmp, 'ligand.itp'))
+            if results['posre_filename'] is not None:
+                shutil.copy(results['posre_filename'], os.path.join(tmp, 'ligand-posre.itp'))
+            if attypes_file is not None:
+                shutil.copy(attypes_file, os.path.join(tmp, 'attype.itp'))
+            write_tables(os.path.join(tmp, 'attypes.npz'), {'atomtypes': results['attypes']}, ['atomtypes'])
+
+            metadata = {'charge': results['charge'],
+                        'posre': results['posre_filename'] is not None,
+                        'attypes_digest': attypes_digest}
+            with open(os.path.join(tmp, 'metadata.json'), 'w') as f:
+                json.dump(metadata, f)
+
+            for name in os.listdir(tmp):
+                os.chmod(os.path.join(tmp, name), READ_ONLY)
+            os.rename(tmp, self.path(key))
+        except OSError:
+            # Entry stored by a concurrent request
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def entries(self):
+        """
+        Cache entries as (path, size, last access) tuples, oldest first
+        """
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, x)) for x in os.listdir(path))
+                entries.append((path, size, os.stat(path).st_mtime))
+            except OSError:
+                continue
+
+        return sorted(entries, key=lambda x: x[2])
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits
+        in `max_size`. Files linked into task directories are not
+        affected.
+        """
+
+        entries = self.entries()
+        size = sum(x[1] for x in entries)
+        for path, entry_size, _ in entries:
+            if size <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            size -= entry_size
+
+    def _count(self, counter):
+        """
+        Increment the hit or miss `counter`, the cache is used from the
+        setup pool threads
+        """
+
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        """
+        Hit/miss counters and the current size of the cache
+        """
+
+        entries = self.entries()
+
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(entries),
+                'size': sum(x[1] for x in entries)}
+
+
+def restore_attypes(cached_attypes, attypes_file, attypes_digest):
+    """
+    Replace `attypes_file` by the prepared atom types file if it still
+    holds the content the entry was prepared from. The atom types file
+    is modified by other preparations, so it is copied rather than
+    linked and does not take the read only mode of the entry.
+    """
+
+    with file_lock(attypes_file):
+        if file_digest(attypes_file) != attypes_digest:
+            return False
+
+        tmp = '{0}.tmp'.format(attypes_file)
+        shutil.copyfile(cached_attypes, tmp)
+        os.rename(tmp, attypes_file)
+
+    return True
+
+
+def configure_prepared_cache(cache_dir, max_size=512 * 1024 ** 2):
+    """
+    Set the process wide prepared topology cache, None disables caching.
+    """
+
+    global _default_cache
+    if cache_dir is None:
+        _default_cache = None
+    else:
+        _default_cache = PreparedTopologyCache(cache_dir, max_size=max_size)
+
+    return _default_cache
+
+
+def get_prepared_cache():
+    """
+    The process wide prepared topology cache or None if not configured
+    """
+
+    return _default_cache
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: service_pool.py
+
+Pool of managed Cerise services kept warm between submissions.
+
+Starting a managed Cerise service means starting its Docker container.
+The pool hands out running services to submissions after a cheap health
+check (a single call to the REST API of the service) and keeps services
+without jobs running for an idle period, so consecutive submissions do
+not pay the container start-up again. Services are started, checked and
+closed in the pool of Cerise calls (see `cerise_calls`). A service is stopped and destroyed
+once it has been idle for `idle_timeout` seconds and has no jobs left.
+Acquisitions of a service that is being closed wait for the close to
+finish and then start a fresh service.
+"""
+
+import cerise_client.service as cc
+import requests
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+from twisted.logger import Logger
+
+from mdstudio_gromacs.cerise_calls import call_in_pool
+from mdstudio_gromacs.in_flight import InFlight
+from mdstudio_gromacs.job_monitor import jobs_url
+
+# Port of the managed Cerise services if not configured
+DEFAULT_PORT = 29593
+
+logger = Logger()
+
+_default_pool = None
+
+
+def service_key(srv_data):
+    """
+    Key of a service in the pool: the name and port of the service
+    dictionary `srv_data`, see `cc.service_to_dict`
+    """
+
+    return (srv_data.get('name'), srv_data.get('port', DEFAULT_PORT))
+
+
+def managed_service_data(cerise_config):
+    """
+    Service dictionary of the managed service of `cerise_config`, the
+    name of a managed service is the name of its Docker container
+    """
+
+    return {'name': cerise_config['docker_name'], 'port': cerise_config.get('port', DEFAULT_PORT)}
+
+
+def service_is_healthy(srv, timeout=5.0):
+    """
+    Whether the REST API of the service `srv` answers
+    """
+
+    try:
+        response = requests.get(jobs_url(srv), timeout=timeout)
+        response.raise_for_status()
+    except requests.RequestException:
+        return False
+
+    return True
+
+
+class ServicePool(object):
+    """
+    Managed Cerise services by name and port.
+
+    :param create:       function starting or connecting to the service of
+                         a Cerise configuration
+    :param idle_timeout: seconds a service without submissions is kept
+    :param health_ttl:   seconds a successful health check stays valid
+    :param clock:        reactor to schedule the idle checks on
+    """
+
+    def __init__(self, create, idle_timeout=600.0, health_ttl=30.0, clock=None):
+
+        self.create = create
+        self.idle_timeout = idle_timeout
+        self.health_ttl = health_ttl
+        self.clock = clock or reactor
+        self.started = 0
+        self.reused = 0
+
+        # key -> {'srv', 'last_used', 'checked', 'timer', 'closing'}, closing
+        # holds the acquisitions waiting for a close in progress
+        self._services = {}
+        # Acquisitions in progress by key
+        self._acquisitions = InFlight()
+
+    def acquire(self, cerise_config):
+        """
+        Running service for `cerise_config`, reusing a pooled service
+        that passes the health check. Concurrent acquisitions of a
+        service share its health check or start.
+
+        :returns: Deferred firing with the service
+        """
+
+        key = service_key(managed_service_data(cerise_config))
+
+        return self._acquisitions.run(key, self._acquire, key, cerise_config)
+
+    def release(self, srv_data):
+        """
+        Mark the service of `srv_data` as used, it is closed after the
+        idle timeout if no jobs are left
+
+        :returns: Deferred firing once the service is marked
+        """
+
+        key = service_key(srv_data)
+        if key in self._services:
+            self._used(key)
+            return succeed(None)
+
+        # Service started before a restart of the component
+        d = call_in_pool(cc.service_from_dict, srv_data)
+        d.addCallbacks(self._adopted, self._not_found, callbackArgs=(key,))
+
+        return d
+
+    def close_idle(self, key):
+        """
+        Close the service `key` if it is idle and has no jobs, otherwise
+        check again later
+        """
+
+        entry = self._services.get(key)
+        if entry is None or entry['closing'] is not None:
+            return
+
+        entry['timer'] = None
+        idle = self.clock.seconds() - entry['last_used']
+        if idle < self.idle_timeout:
+            self._schedule(key, self.idle_timeout - idle)
+            return
+
+        entry['closing'] = []
+        d = call_in_pool(close_service, entry['srv'])
+        d.addCallbacks(self._closed, self._close_failed, callbackArgs=(key, entry), errbackArgs=(key, entry))
+        d.addBoth(self._close_done, entry)
+
+        return d
+
+    def stats(self):
+        """
+        Number of pooled, started and reused services
+        """
+
+        return {'services': len(self._services), 'started': self.started, 'reused': self.reused}
+
+    def _acquire(self, key, cerise_config):
+
+        entry = self._services.get(key)
+        if entry is None:
+            return self._start(key, cerise_config)
+
+        if entry['closing'] is not None:
+            # Acquire again once the service is closed or kept
+            waiter = Deferred()
+            waiter.addCallback(lambda _: self._acquire(key, cerise_config))
+            entry['closing'].append(waiter)
+            return waiter
+
+        if self.clock.seconds() - entry['checked'] < self.health_ttl:
+            return self._reuse(entry)
+
+        d = call_in_pool(service_is_healthy, entry['srv'])
+        d.addCallback(self._checked, key, entry, cerise_config)
+
+        return d
+
+    def _checked(self, healthy, key, entry, cerise_config):
+
+        if healthy:
+            entry['checked'] = self.clock.seconds()
+            return self._reuse(entry)
+
+        logger.warn("Cerise service {name} failed the health check, restarting it", name=key[0])
+        if self._services.get(key) is entry:
+            self._drop(key)
+
+        return self._start(key, cerise_config)
+
+    def _start(self, key, cerise_config):
+
+        d = call_in_pool(self.create, cerise_config)
+        d.addCallback(self._started, key)
+
+        return d
+
+    def _started(self, srv, key):
+
+        now = self.clock.seconds()
+        self.started += 1
+        self._services[key] = {'srv': srv, 'last_used': now, 'checked': now, 'timer': None, 'closing': None}
+        self._schedule(key, self.idle_timeout)
+
+        return srv
+
+    def _reuse(self, entry):
+
+        entry['last_used'] = self.clock.seconds()
+        self.reused += 1
+
+        return entry['srv']
+
+    def _adopted(self, srv, key):
+
+        if key not in self._services:
+            self._services[key] = {'srv': srv, 'checked': 0, 'timer': None, 'closing': None}
+        self._used(key)
+
+    def _not_found(self, failure):
+
+        failure.trap(cc.errors.ServiceNotFound)
+
+    def _used(self, key):
+
+        self._services[key]['last_used'] = self.clock.seconds()
+        self._schedule(key, self.idle_timeout)
+
+    def _closed(self, closed, key, entry):
+
+        if self._services.get(key) is not entry:
+            return
+        if closed:
+            del self._services[key]
+        else:
+            # Jobs left, keep the service
+            entry['last_used'] = self.clock.seconds()
+            self._schedule(key, self.idle_timeout)
+
+    def _close_failed(self, failure, key, entry):
+
+        logger.warn("closing Cerise service {name} failed: {error}", name=key[0], error=failure.getErrorMessage())
+
+        # The service may be half stopped, check it before the next use
+        if self._services.get(key) is entry:
+            entry['checked'] = 0
+            entry['last_used'] = self.clock.seconds()
+            self._schedule(key, self.idle_timeout)
+
+    def _close_done(self, result, entry):
+
+        waiters, entry['closing'] = entry['closing'], None
+        for waiter in waiters:
+            waiter.callback(None)
+
+    def _schedule(self, key, delay):
+
+        entry = self._services[key]
+        if entry['timer'] is not None and entry['timer'].active():
+            entry['timer'].cancel()
+        entry['timer'] = self.clock.callLater(delay, self.close_idle, key)
+
+    def _drop(self, key):
+
+        entry = self._services.pop(key)
+        if entry['timer'] is not None and entry['timer'].active():
+            entry['timer'].cancel()
+
+
+def close_service(srv):
+    """
+    Stop and destroy the managed service `srv` if it has no jobs
+
+    :returns: True if the service was closed
+    """
+
+    try:
+        if len(srv.list_jobs()) > 0:
+            return False
+
+        print("Shutting down Cerise-client service")
+        cc.stop_managed_service(srv)
+        cc.destroy_managed_service(srv)
+    except cc.errors.ServiceNotFound:
+        print("There is not Cerise Service running")
+
+    return True
+
+
+def configure_service_pool(create, idle_timeout=600.0, health_ttl=30.0):
+    """
+    Set the process wide service pool
+    """
+
+    global _default_pool
+    _default_pool = ServicePool(create, idle_timeout=idle_timeout, health_ttl=health_ttl)
+
+    return _default_pool
+
+
+def get_service_pool(create=None):
+    """
+    The process wide service pool, created with the default settings
+    and `create` if not configured
+    """
+
+    if _default_pool is None:
+        return configure_service_pool(create)
+
+    return _default_pool
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: task_events.py
+
+Publication of task state transitions.
+
+Whenever the component detects a new status of a task (queued, running,
+downloading, completed or failed) it publishes the status on the topic
+of the task and, for tasks submitted with `async_gromacs_batch`, on the
+topic of the batch. Clients subscribe to these topics instead of polling
+the query endpoints. Every event is a dictionary with the `task_id`,
+`batch_id` and `status` of the task.
+"""
+
+import threading
+
+from collections import OrderedDict
+from twisted.internet import reactor
+from twisted.logger import Logger
+
+TASK_TOPIC = 'mdgroup.mdstudio_gromacs.task.{0}'
+BATCH_TOPIC = 'mdgroup.mdstudio_gromacs.batch.{0}'
+
+STATUSES = ('queued', 'running', 'downloading', 'completed', 'failed')
+
+logger = Logger()
+
+_default_events = None
+
+
+def task_topic(task_id):
+    """
+    Topic of the state transitions of task `task_id`
+    """
+
+    return TASK_TOPIC.format(task_id)
+
+
+def batch_topic(batch_id):
+    """
+    Topic of the state transitions of all tasks of batch `batch_id`
+    """
+
+    return BATCH_TOPIC.format(batch_id)
+
+
+class TaskEvents(object):
+    """
+    Publish the state transitions of tasks, a status is only published
+    when it differs from the last status published for the task.
+
+    :param publish:   WAMP publish method of the component session
+    :param max_tasks: number of tasks to remember the last status of
+    """
+
+    def __init__(self, publish, max_tasks=100000):
+
+        self.publish = publish
+        self.max_tasks = max_tasks
+        self._status = OrderedDict()
+        self._lock = threading.Lock()
+
+    def transition(self, task_id, status, batch_id=None):
+        """
+        Publish `status` of the task if it changed. Safe to call from
+        any thread, the events are published from the reactor thread.
+
+        :returns: True if the status was published
+        """
+
+        if status not in STATUSES:
+            raise ValueError('Unknown task status: {0}'.format(status))
+
+        with self._lock:
+            if self._status.get(task_id) == status:
+                return False
+
+            self._status.pop(task_id, None)
+            self._status[task_id] = status
+            while len(self._status) > self.max_tasks:
+                self._status.popitem(last=False)
+
+        event = {'task_id': task_id, 'batch_id': batch_id, 'status': status}
+        topics = [task_topic(task_id)]
+        if batch_id is not None:
+            topics.append(batch_topic(batch_id))
+        for topic in topics:
+            reactor.callFromThread(self._publish, topic, event)
+
+        return True
+
+    def _publish(self, topic, event):
+
+        try:
+            d = self.publish(topic, event)
+        except Exception as e:
+            logger.warn("publishing on {topic} failed: {error}", topic=topic, error=e)
+            return
+
+        if d is not None and hasattr(d, 'addErrback'):
+            d.addErrback(lambda failure: logger.warn("publishing on {topic} failed: {error}",
+                                                     topic=topic, error=failure.getErrorMessage()))
+
+
+def configure_events(publish):
+    """
+    Set the process wide task event publisher, None disables publishing.
+    """
+
+    global _default_events
+    if publish is None:
+        _default_events = None
+    else:
+        _default_events = TaskEvents(publish)
+
+    return _default_events
+
+
+def get_events():
+    """
+    The process wide task event publisher or None if not configured
+    """
+
+    return _default_events
+
+
+def publish_status(task_id, status, batch_id=None):
+    """
+    Publish the `status` of a task with the process wide publisher,
+    does nothing if no publisher is configured.
+    """
+
+    if _default_events is None:
+        return False
+
+    return _default_events.transition(task_id, status, batch_id=batch_id)
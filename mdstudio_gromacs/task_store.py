@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: task_store.py
+
+Cached and batched access to the task documents of the `cerise`
+collection.
+
+Task documents are kept in an in-process cache for a short time, so
+repeated queries of a task do not reach MongoDB. The cache is not shared
+by the instances of the component serving the roundrobin endpoints, a
+document may be up to `ttl` seconds behind the writes of another
+instance. Documents of tasks that did not end yet change often and are
+cached for `running_ttl` seconds only. Inserts and updates are
+queued and written in batches: all queued inserts with one `insert_many`
+and the queued updates with one `update_many` per distinct update.
+Updates are applied to the cached documents right away and the batches
+are written in order. The writes of a batch that fail are tried again
+after `flush_interval` seconds, up to `max_attempts` times in all,
+before the later batches are written. The indexes the queries rely on
+are created when the component starts.
+"""
+
+import json
+
+from collections import OrderedDict
+from mdstudio.db.index import Index
+from mdstudio.db.sort_mode import SortMode
+from twisted.internet import reactor, task
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+from twisted.logger import Logger
+
+COLLECTION = 'cerise'
+
+# Statuses of tasks that ended, their documents no longer change often
+FINAL_STATUSES = ('completed', 'failed')
+
+logger = Logger()
+
+_default_store = None
+
+
+def task_indexes():
+    """
+    Indexes of the task collection: unique task_id, status, service and
+    batch
+    """
+
+    return [Index(keys=[('task_id', SortMode.Asc)], unique=True),
+            Index(keys=[('status', SortMode.Asc)]),
+            Index(keys=[('name', SortMode.Asc), ('port', SortMode.Asc)]),
+            Index(keys=[('batch_id', SortMode.Asc)])]
+
+
+class TaskStore(object):
+    """
+    Task documents of the `cerise` collection.
+
+    :param cerise_db:      MongoDB db of the component
+    :param ttl:            seconds a document is served from the cache
+    :param running_ttl:    seconds the document of a task that did not end
+                           is served from the cache
+    :param flush_interval: seconds writes are queued before being written
+    :param max_pending:    number of queued writes triggering a write
+    :param max_cached:     number of cached documents above which expired
+                           documents are dropped
+    :param max_attempts:   number of times the writes of a batch are tried
+    :param clock:          reactor to schedule the writes on
+    """
+
+    def __init__(self, cerise_db, ttl=30.0, running_ttl=5.0, flush_interval=1.0, max_pending=500, max_cached=10000,
+                 max_attempts=3, clock=None):
+
+        self.cerise_db = cerise_db
+        self.ttl = ttl
+        self.running_ttl = min(running_ttl, ttl)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_cached = max_cached
+        self.max_attempts = max_attempts
+        self.clock = clock or reactor
+
+        # task_id -> (expiry time, document)
+        self._cache = {}
+        # task_id -> document to insert, task_id -> fields to set
+        self._inserts = OrderedDict()
+        self._updates = OrderedDict()
+        self._timer = None
+        self._writes = succeed(None)
+
+    def ensure_indexes(self):
+        """
+        Create the indexes of the task collection if they do not exist
+        """
+
+        d = maybeDeferred(self.cerise_db.create_indexes, COLLECTION, task_indexes())
+        d.addErrback(lambda failure: logger.warn("creating the task indexes failed: {error}",
+                                                 error=failure.getErrorMessage()))
+
+        return d
+
+    def find(self, task_id):
+        """
+        Document of task `task_id`
+
+        :returns: Deferred firing with the document or None
+        """
+
+        if task_id in self._inserts:
+            return succeed(dict(self._inserts[task_id]))
+
+        cached = self._cache.get(task_id)
+        if cached is not None and cached[0] > self.clock.seconds():
+            return succeed(dict(cached[1]))
+
+        # Queued updates of the task are written before reading it
+        d = self.flush() if task_id in self._updates else succeed(None)
+        d.addCallback(lambda _: self.cerise_db.find_one(COLLECTION, {'task_id': task_id}))
+        d.addCallback(lambda response: self._cached(self._pending(response['result'])))
+
+        return d
+
+    def find_many(self, query):
+        """
+        Documents of the tasks matching `query`, queued writes are
+        written first
+
+        :returns: Deferred firing with the list of documents
+        """
+
+        d = self.flush()
+        d.addCallback(lambda _: self.cerise_db.find_many(COLLECTION, query))
+        d.addCallback(lambda response: [self._cached(doc) for doc in response['results']])
+
+        return d
+
+    def insert(self, doc):
+        """
+        Queue the insert of a task document
+        """
+
+        doc = dict((k, v) for k, v in doc.items() if k != '_id')
+        self._inserts[doc['task_id']] = doc
+        self._cache[doc['task_id']] = (self._expiry(doc), doc)
+        self._prune()
+        self._queued()
+
+    def update(self, task_id, fields):
+        """
+        Queue setting `fields` of the document of task `task_id`
+        """
+
+        self.update_many([task_id], fields)
+
+    def update_many(self, task_ids, fields):
+        """
+        Queue setting `fields` of the documents of all `task_ids`. Cached
+        documents are updated right away.
+        """
+
+        fields = dict((k, v) for k, v in fields.items() if k != '_id')
+        for task_id in task_ids:
+            if task_id in self._inserts:
+                self._inserts[task_id].update(fields)
+                continue
+
+            cached = self._cache.get(task_id)
+            if cached is not None:
+                cached[1].update(fields)
+            self._updates.setdefault(task_id, {}).update(fields)
+
+        self._queued()
+
+    def invalidate(self, task_ids):
+        """
+        Drop the cached documents of `task_ids`
+        """
+
+        for task_id in task_ids:
+            self._cache.pop(task_id, None)
+
+    def flush(self):
+        """
+        Write the queued inserts and updates
+
+        :returns: Deferred firing once they are written
+        """
+
+        if self._timer is not None and self._timer.active():
+            self._timer.cancel()
+        self._timer = None
+
+        inserts = list(self._inserts.values())
+        updates = self._updates
+        self._inserts = OrderedDict()
+        self._updates = OrderedDict()
+
+        if inserts or updates:
+            # Batches are written in order, an update never overtakes the
+            # insert of its document
+            self._writes.addCallback(lambda _: self._write(inserts, updates))
+
+        # Fires once the writes queued so far are done
+        done = Deferred()
+
+        def written(result):
+            done.callback(None)
+            return result
+
+        self._writes.addBoth(written)
+
+        return done
+
+    def _write(self, inserts, updates):
+
+        # One update per distinct set of fields
+        groups = OrderedDict()
+        for task_id, fields in updates.items():
+            key = json.dumps(fields, sort_keys=True, default=str)
+            groups.setdefault(key, (fields, []))[1].append(task_id)
+
+        return self._write_pending({'inserts': inserts, 'groups': list(groups.values())}, 1)
+
+    def _write_pending(self, pending, attempt):
+
+        # `pending` holds the writes not done yet
+        d = succeed(None)
+        if pending['inserts']:
+            d.addCallback(lambda _: self.cerise_db.insert_many(COLLECTION, pending['inserts']))
+            d.addCallback(lambda _: pending.update(inserts=[]))
+
+        for fields, task_ids in list(pending['groups']):
+            d.addCallback(self._update_many, task_ids, fields)
+            d.addCallback(lambda _: pending['groups'].pop(0))
+
+        d.addErrback(self._write_failed, pending, attempt)
+
+        return d
+
+    def _update_many(self, _, task_ids, fields):
+
+        return self.cerise_db.update_many(COLLECTION, {'task_id': {'$in': task_ids}}, {'$set': fields})
+
+    def _write_failed(self, failure, pending, attempt):
+
+        count = len(pending['inserts']) + sum(len(task_ids) for _, task_ids in pending['groups'])
+        if attempt >= self.max_attempts:
+            logger.error("writing {count} task documents failed {attempt} times, giving up: {error}",
+                         count=count, attempt=attempt, error=failure.getErrorMessage())
+            return
+
+        logger.warn("writing {count} task documents failed, retrying: {error}",
+                    count=count, error=failure.getErrorMessage())
+
+        # Retried in place, the later batches keep waiting for it
+        return task.deferLater(self.clock, self.flush_interval, self._write_pending, pending, attempt + 1)
+
+    def _queued(self):
+
+        if len(self._inserts) + len(self._updates) >= self.max_pending:
+            self.flush()
+        elif self._timer is None or not self._timer.active():
+            self._timer = self.clock.callLater(self.flush_interval, self.flush)
+
+    def _pending(self, doc):
+
+        # Updates queued while the document was read
+        if doc is not None and doc['task_id'] in self._updates:
+            doc.update(self._updates[doc['task_id']])
+
+        return doc
+
+    def _expiry(self, doc):
+
+        if doc.get('status') in FINAL_STATUSES:
+            return self.clock.seconds() + self.ttl
+
+        return self.clock.seconds() + self.running_ttl
+
+    def _cached(self, doc):
+
+        if doc is None:
+            return None
+
+        doc.pop('_id', None)
+        self._cache[doc['task_id']] = (self._expiry(doc), doc)
+        self._prune()
+
+        return dict(doc)
+
+    def _prune(self):
+
+        # Expired documents are dropped as the cache grows
+        if len(self._cache) > self.max_cached:
+            now = self.clock.seconds()
+            for task_id in [k for k, v in self._cache.items() if v[0] <= now]:
+                del self._cache[task_id]
+
+
+def configure_task_store(cerise_db, ttl=30.0, running_ttl=5.0, flush_interval=1.0, max_pending=500,
+                         max_cached=10000, max_attempts=3):
+    """
+    Set the process wide task store of `cerise_db`, queued writes are
+    written before the reactor shuts down
+    """
+
+    global _default_store
+    _default_store = TaskStore(cerise_db, ttl=ttl, running_ttl=running_ttl, flush_interval=flush_interval,
+                               max_pending=max_pending, max_cached=max_cached, max_attempts=max_attempts)
+    reactor.addSystemEventTrigger('before', 'shutdown', _default_store.flush)
+
+    return _default_store
+
+
+def get_task_store(cerise_db):
+    """
+    The process wide task store, created with the default settings if
+    not configured for `cerise_db`
+    """
+
+    if _default_store is None or _default_store.cerise_db is not cerise_db:
+        return configure_task_store(cerise_db)
+
+    return _default_store
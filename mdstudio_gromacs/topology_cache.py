@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: topology_cache.py
+
+Persistent cache of parsed topology files.
+
+Parsed topologies are stored as compressed NumPy `.npz` archives keyed by
+the SHA-256 digest of the file content, so the same atom types, protein
+or ligand topology is parsed only once regardless of its file name or
+location. The cache is bounded in size and evicts the least recently
+used entries first.
+"""
+
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from mdstudio_gromacs.topology_table import TopologyTable
+
+# Bump when the layout of the cached tables changes
+CACHE_VERSION = b'topology-table-2'
+
+_default_cache = None
+
+
+def file_digest(filename, blocksize=1 << 20):
+    """
+    SHA-256 hex digest of the content of `filename`
+    """
+
+    sha = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+class TopologyCache(object):
+    """
+    On-disk cache of parsed topologies with LRU eviction.
+
+    :param cache_dir: directory to store the cached topologies in
+    :param max_size:  maximum total size of the cache in bytes
+    """
+
+    def __init__(self, cache_dir, max_size=512 * 1024 ** 2):
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, filename):
+        """
+        Location of the cache entry for the content of `filename`
+        """
+
+        sha = hashlib.sha256(CACHE_VERSION)
+        sha.update(file_digest(filename).encode('ascii'))
+
+        return os.path.join(self.cache_dir, '{0}.npz'.format(sha.hexdigest()))
+
+    def load(self, filename, parser):
+        """
+        Return the parsed topology for `filename`, calling `parser` on a
+        cache miss.
+
+        :param filename: topology file
+        :param parser:   callable returning a (dict of TopologyTable, keys)
+                         tuple for a filename
+        """
+
+        path = self.path(filename)
+        if os.path.exists(path):
+            try:
+                result = read_tables(path)
+                self._count('hits')
+                # Mark as recently used
+                os.utime(path, None)
+                return result
+            except (IOError, OSError, ValueError, KeyError):
+                # Corrupted or concurrently evicted entry, parse again
+                pass
+
+        self._count('misses')
+        tables, keys = parser(filename)
+        write_tables(path, tables, keys)
+        self.evict()
+
+        return tables, keys
+
+    def entries(self):
+        """
+        Cache entries as (path, size, last access) tuples, oldest first
+        """
+
+        entries = []
+        for path in glob.glob(os.path.join(self.cache_dir, '*.npz')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, stat.st_size, stat.st_mtime))
+
+        return sorted(entries, key=lambda x: x[2])
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits
+        in `max_size`.
+        """
+
+        entries = self.entries()
+        size = sum(x[1] for x in entries)
+        for path, entry_size, _ in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def _count(self, counter):
+        """
+        Increment the hit or miss `counter`, the cache is used from the
+        setup pool threads
+        """
+
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        """
+        Hit/miss counters and the current size of the cache
+        """
+
+        entries = self.entries()
+
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(entries),
+                'size': sum(x[1] for x in entries)}
+
+
+def write_tables(path, tables, keys):
+    """
+    Store the `tables` in the order of `keys` as npz archive at `path`.
+    The archive is written to a temporary file first and moved in place
+    so concurrent readers never see a partial entry.
+    """
+
+    arrays = {'keys': np.array(keys, dtype=str),
+              'names': np.array([tables[k].name for k in keys], dtype=str)}
+    for i, key in enumerate(keys):
+        arrays['data_{0}'.format(i)] = tables[key].data
+        arrays['ncols_{0}'.format(i)] = tables[key].ncols
+
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.rename(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
+
+
+def read_tables(path):
+    """
+    Load the tables stored by `write_tables`
+    """
+
+    with np.load(path, allow_pickle=False) as archive:
+        keys = archive['keys'].tolist()
+        names = archive['names'].tolist()
+        tables = {}
+        for i, (key, name) in enumerate(zip(keys, names)):
+            tables[key] = TopologyTable(name, archive['data_{0}'.format(i)], archive['ncols_{0}'.format(i)])
+
+    return tables, keys
+
+
+def configure_cache(cache_dir, max_size=512 * 1024 ** 2):
+    """
+    Set the process wide topology cache, None disables caching.
+    """
+
+    global _default_cache
+    if cache_dir is None:
+        _default_cache = None
+    else:
+        _default_cache = TopologyCache(cache_dir, max_size=max_size)
+
+    return _default_cache
+
+
+def get_cache():
+    """
+    The process wide topology cache or None if not configured
+    """
+
+    return _default_cache
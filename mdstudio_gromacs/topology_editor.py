@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: topology_editor.py
+
+Molecule level edits of a topology in a single pass over its blocks.
+
+A topology is handled as the list of blocks and block names returned by
+`gromacs_topology.readCard`. Removing molecule types, renaming molecules
+in the `[ molecules ]` section and adding molecule types are collected
+first and applied together, so the blocks are traversed and rebuilt only
+once whatever the number of edits.
+"""
+
+from mdstudio_gromacs.atomtypes import AtomTypeRegistry
+from mdstudio_gromacs.topology_index import TopologyIndex
+
+
+def list_molecules(blocks, names):
+    """
+    Molecule types of a topology as dictionaries with the molecule `name`
+    and the index of its `atoms` and `bonds` blocks
+    """
+
+    mols = []
+    mol = {}
+    for i, name in enumerate(names):
+        if name == 'moleculetype':
+            if mol:
+                mols.append(mol)
+            mol = {'name': blocks[i][0][0]}
+        elif name in ('atoms', 'bonds'):
+            # rows continuing the section after a directive are not part
+            # of the leading block
+            mol.setdefault(name, i)
+
+    if mol:
+        mols.append(mol)
+
+    return mols
+
+
+class TopologyEditor(object):
+    """
+    Collect molecule edits of a topology and apply them in one pass.
+
+    :param blocks: list of blocks or `TopologyIndex` of the topology
+    :param names:  block names, None for preprocessor directives
+    """
+
+    def __init__(self, blocks, names):
+
+        self.blocks = blocks
+        self.names = names
+        self._removed = set()
+        self._replaced = {}
+        self._added = []
+
+    def remove(self, molecules):
+        """
+        Remove the molecule types named in `molecules`, together with
+        all blocks up to the next molecule type or `[ system ]`
+        """
+
+        self._removed.update(molecules)
+
+    def replace(self, old, new):
+        """
+        Rename molecule `old` to `new` in the `[ molecules ]` section
+        """
+
+        self._replaced[old] = new
+
+    def add(self, blocks, names):
+        """
+        Add the blocks of other topologies. Atom types are merged into
+        the `[ atomtypes ]` section, other blocks are inserted before
+        `[ system ]`.
+        """
+
+        self._added.extend(zip(blocks, names))
+
+    def apply(self):
+        """
+        Apply the collected edits. The blocks and names are updated in
+        place and returned together with the molecule list of the new
+        topology, molecules that were added are flagged with `added`.
+
+        :returns: tuple of blocks, names and molecule list
+        """
+
+        blocks = self.blocks
+        names = self.names
+
+        new_types = [block for block, name in self._added if name == 'atomtypes']
+        new_blocks = [(block, name) for block, name in self._added if name != 'atomtypes']
+        types_pending = bool(new_types)
+        has_types = 'atomtypes' in names
+
+        items = []
+        new_names = []
+        mols = []
+
+        def emit(item, name, added=False):
+            items.append(item)
+            new_names.append(name)
+            if name == 'moleculetype':
+                block = item if added else blocks[item]
+                mols.append({'name': block[0][0], 'added': True} if added else {'name': block[0][0]})
+            elif name in ('atoms', 'bonds'):
+                # atoms outside of a molecule type
+                if not mols:
+                    mols.append({})
+                mols[-1].setdefault(name, len(items) - 1)
+
+        def emit_types():
+            registry = AtomTypeRegistry()
+            rows = []
+            for block in new_types:
+                rows.extend(registry.merge(block))
+            emit(rows, 'atomtypes', added=True)
+
+        removing = False
+        for i, name in enumerate(names):
+            if name == 'moleculetype':
+                removing = blocks[i][0][0] in self._removed
+                if types_pending and not has_types:
+                    emit_types()
+                    types_pending = False
+            elif name == 'system':
+                removing = False
+                for block, block_name in new_blocks:
+                    emit(block, block_name, added=True)
+                new_blocks = []
+
+            if removing:
+                continue
+
+            if name == 'atomtypes' and types_pending:
+                registry = AtomTypeRegistry(blocks[i])
+                for block in new_types:
+                    blocks[i].extend(registry.merge(block))
+                types_pending = False
+            elif name == 'molecules' and self._replaced:
+                for row in blocks[i]:
+                    row[0] = self._replaced.get(row[0], row[0])
+
+            emit(i, name)
+
+        # topologies without [ system ] or [ moleculetype ]
+        if types_pending:
+            emit_types()
+        for block, block_name in new_blocks:
+            emit(block, block_name, added=True)
+
+        if isinstance(blocks, TopologyIndex):
+            blocks.reorder(items)
+        else:
+            blocks[:] = [blocks[item] if isinstance(item, int) else item for item in items]
+        names[:] = new_names
+
+        self._removed = set()
+        self._replaced = {}
+        self._added = []
+
+        return blocks, names, mols
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: topology_index.py
+
+Byte offset index of the sections in a GROMACS topology file.
+
+The file is memory mapped and scanned once for section headers and
+preprocessor directives. Sections are only parsed when they are first
+accessed and sections that were never accessed are written back
+verbatim by copying their byte range.
+"""
+
+import mmap
+import re
+
+try:
+    from collections.abc import MutableSequence
+except ImportError:
+    from collections import MutableSequence
+
+from mdstudio_gromacs.parsers import tokenize_rows
+from mdstudio_gromacs.topology_table import TopologyTable
+
+# Section headers and preprocessor directives at the start of a line
+MARKER = re.compile(br'^[ \t]*(?:\[[ \t]*([^\]\n]*?)[ \t]*\]|#)', re.M)
+
+# Any line with content that is not a comment
+CONTENT = re.compile(br'^[ \t]*[^;\s]', re.M)
+
+
+def index_sections(buf):
+    """
+    Scan `buf` for section headers and preprocessor directives.
+
+    :param buf: bytes like object (e.g. a memory map) holding the topology
+    :returns:   list of (name, start, end, continued) tuples. The name
+                is None for preprocessor directives and text without
+                section rows. Rows following a directive inside a section
+                are indexed under the name of the enclosing section and
+                flagged as `continued`, they have no section header.
+    """
+
+    entries = []
+    section = None
+    header = False
+    start = 0
+    for match in MARKER.finditer(buf):
+        entries.extend(_index_chunk(buf, section, header, start, match.start()))
+        if match.group(1) is not None:
+            section = match.group(1).decode('ascii')
+            header = True
+            start = match.start()
+        else:
+            end = buf.find(b'\n', match.start())
+            end = len(buf) if end < 0 else end + 1
+            entries.append((None, match.start(), end, False))
+            header = False
+            start = end
+
+    entries.extend(_index_chunk(buf, section, header, start, len(buf)))
+
+    return entries
+
+
+def _index_chunk(buf, section, header, start, end):
+    """
+    Index entry for the bytes in between two markers
+    """
+
+    if start >= end:
+        return []
+
+    if header:
+        return [(section, start, end, False)]
+    if section is not None and CONTENT.search(buf, start, end):
+        return [(section, start, end, True)]
+
+    return [(None, start, end, False)]
+
+
+class TopologyIndex(MutableSequence):
+    """
+    Lazily materialised list of the blocks in a topology file.
+
+    Items are the rows of a section (list of lists of strings) or the raw
+    text of preprocessor directives, in the same layout as returned by
+    `gromacs_topology.readCard`. Rows following a directive inside a
+    section are returned as `Continuation`. Blocks are parsed on first
+    access, blocks that were never accessed keep a reference to their
+    byte range and can be copied verbatim using `raw`.
+
+    :param filename: path to the topology file
+
+    The index holds the file memory mapped until it is closed, use it as
+    context manager or call `close` once the blocks have been written.
+
+    The `names` attribute lists the section names (None for directives)
+    as found in the file, it is not updated when blocks are inserted or
+    removed.
+    """
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can not be memory mapped
+                self._buf = b''
+
+        entries = index_sections(self._buf)
+        self.names = [entry[0] for entry in entries]
+        self._items = [_Lazy(*entry) for entry in entries]
+
+    def __len__(self):
+
+        return len(self._items)
+
+    def __getitem__(self, i):
+
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+
+        item = self._items[i]
+        if isinstance(item, _Lazy):
+            text = self._buf[item.start:item.end].decode('utf-8')
+            if item.name is None:
+                item = text
+            elif item.continued:
+                item = Continuation(tokenize_rows(text.splitlines()))
+            else:
+                item = tokenize_rows(text.splitlines())
+            self._items[i] = item
+
+        return item
+
+    def __setitem__(self, i, value):
+
+        self._items[i] = value
+
+    def __delitem__(self, i):
+
+        del self._items[i]
+
+    def insert(self, i, value):
+
+        self._items.insert(i, value)
+
+    def pop(self, i=-1):
+        """
+        Remove the block at `i` without parsing it
+        """
+
+        item = self._items.pop(i)
+        if isinstance(item, _Lazy):
+            return None
+
+        return item
+
+    def reorder(self, items):
+        """
+        Replace the blocks by `items` in a single pass. Integer items
+        refer to the current block at that position, which is kept
+        unparsed if it was not accessed yet, other items are new blocks.
+        """
+
+        self._items = [self._items[item] if isinstance(item, int) else item for item in items]
+
+    def continues(self, i):
+        """
+        True if the block at `i` continues the section of the previous
+        block, without parsing it
+        """
+
+        item = self._items[i]
+        if isinstance(item, _Lazy):
+            return item.continued
+
+        return is_continuation(item)
+
+    def is_loaded(self, i):
+        """
+        True if the block at `i` has been materialised
+        """
+
+        return not isinstance(self._items[i], _Lazy)
+
+    def raw(self, i):
+        """
+        Verbatim text of the block at `i`, None if the block has been
+        materialised (and may have been modified).
+        """
+
+        item = self._items[i]
+        if isinstance(item, _Lazy):
+            return self._buf[item.start:item.end].decode('utf-8')
+
+        return None
+
+    def table(self, i, name):
+        """
+        The block at `i` as a typed `TopologyTable` for section `name`
+        """
+
+        return TopologyTable.from_rows(name, self[i])
+
+    def close(self):
+        """
+        Release the memory map, blocks that were not accessed can no
+        longer be read
+        """
+
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+
+class Continuation(list):
+    """
+    Rows of a section following a preprocessor directive inside the
+    section. The block continues the section and is written without a
+    section header.
+    """
+
+
+def is_continuation(block):
+    """
+    True if `block` continues the section of the previous block
+    """
+
+    return isinstance(block, Continuation)
+
+
+class _Lazy(object):
+    """
+    Byte range of a block that has not been parsed yet
+    """
+
+    __slots__ = ('name', 'start', 'end', 'continued')
+
+    def __init__(self, name, start, end, continued=False):
+
+        self.name = name
+        self.start = start
+        self.end = end
+        self.continued = continued
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: topology_preprocessor.py
+
+Preprocessor aware loader for GROMACS topologies.
+
+Resolves the `#include` graph of a topology and evaluates `#define`,
+`#undef`, `#ifdef`, `#ifndef`, `#else` and `#endif` directives for a
+given set of defines, the way `grompp` does. Expression conditionals
+(`#if`, `#elif`) are not supported and raise a ValueError. Tokenized
+files are cached by content digest so shared include files (force
+field, atom types, position restraints) are reused across molecules and
+requests regardless of where they are staged. The cache is bounded and
+drops the least recently used files first.
+"""
+
+import os
+import threading
+
+from collections import OrderedDict
+
+from mdstudio_gromacs.topology_cache import file_digest
+
+DIRECTIVE = 0
+SECTION = 1
+ROW = 2
+
+# Maximum number of tokenized lines kept in the include cache
+INCLUDE_CACHE_SIZE = 2000000
+
+# Maximum number of file digests remembered
+DIGEST_MEMO_SIZE = 4096
+
+
+class LRUCache(object):
+    """
+    Mapping bounded in size that drops the least recently used items.
+    Safe to share between threads.
+
+    :param max_size: maximum total size of the items
+    :param sizeof:   size of an item, 1 per item by default
+    """
+
+    def __init__(self, max_size, sizeof=None):
+
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+
+        return len(self._items)
+
+    def get(self, key):
+        """
+        Item stored under `key` or None, marked as recently used
+        """
+
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+
+        return value
+
+    def put(self, key, value):
+        """
+        Store `value` under `key`, items larger than the cache are not
+        stored
+        """
+
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self.size -= self.sizeof(previous)
+
+            self._items[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def clear(self):
+
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+
+# digest -> tokenized file
+_include_cache = LRUCache(INCLUDE_CACHE_SIZE, sizeof=len)
+
+# (path, mtime, size) -> digest
+_digest_memo = LRUCache(DIGEST_MEMO_SIZE)
+
+
+class PreprocessedTopology(object):
+    """
+    Result of preprocessing a topology.
+
+    :ivar sections: list of (section name, rows, source file) tuples in
+                    the order grompp would read them
+    :ivar defines:  defines in effect at the end of the topology
+    :ivar includes: include graph, file -> list of included files
+    :ivar missing:  include statements that could not be resolved
+    """
+
+    def __init__(self):
+
+        self.sections = []
+        self.defines = {}
+        self.includes = {}
+        self.missing = []
+
+    def section(self, name):
+        """
+        All rows of the sections called `name` concatenated
+        """
+
+        rows = []
+        for section, section_rows, _ in self.sections:
+            if section == name:
+                rows.extend(section_rows)
+
+        return rows
+
+
+def tokenize_file(filename):
+    """
+    Tokenize a topology file into directives, section headers and rows.
+
+    :returns: list of (kind, value) tuples with kind one of DIRECTIVE
+              ((keyword, argument) value), SECTION (name) or ROW (tokens)
+    """
+
+    items = []
+    with open(filename, 'r') as f:
+        pending = ''
+        for line in f:
+            line = pending + line.split(';', 1)[0].rstrip()
+            # Line continuation
+            if line.endswith('\\'):
+                pending = line[:-1] + ' '
+                continue
+            pending = ''
+
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith('#'):
+                parts = line[1:].strip().split(None, 1)
+                keyword = parts[0] if parts else ''
+                argument = parts[1].strip() if len(parts) > 1 else ''
+                items.append((DIRECTIVE, (keyword, argument)))
+            elif line.startswith('['):
+                items.append((SECTION, line[1:line.find(']')].strip()))
+            else:
+                items.append((ROW, line.split()))
+
+    return items
+
+
+def cached_tokenize(filename):
+    """
+    Tokenized form of `filename`, taken from the process wide include
+    cache when a file with the same content was read before.
+    """
+
+    stat = os.stat(filename)
+    memo_key = (os.path.realpath(filename), stat.st_mtime, stat.st_size)
+    digest = _digest_memo.get(memo_key)
+    if digest is None:
+        digest = file_digest(filename)
+        _digest_memo.put(memo_key, digest)
+
+    items = _include_cache.get(digest)
+    if items is None:
+        items = tokenize_file(filename)
+        _include_cache.put(digest, items)
+
+    return items
+
+
+def clear_include_cache():
+    """
+    Drop all cached include files
+    """
+
+    _include_cache.clear()
+    _digest_memo.clear()
+
+
+def resolve_include(name, current_file, include_dirs):
+    """
+    Locate an included file, first relative to the including file then
+    in the `include_dirs`. Returns None if the file is not found.
+    """
+
+    name = name.strip('"<>')
+    candidates = [os.path.dirname(os.path.abspath(current_file))] + list(include_dirs)
+    for directory in candidates:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+
+    return None
+
+
+def load_topology(filename, defines=None, include_dirs=(), strict=False):
+    """
+    Preprocess the topology `filename`.
+
+    :param filename:     topology (.top or .itp) file
+    :param defines:      defines to evaluate the conditionals with, either
+                         a list of names or a name -> value dictionary
+    :param include_dirs: directories searched for included files
+    :param strict:       raise IOError for includes that can not be found,
+                         otherwise they are listed in `missing`
+    :rtype:              PreprocessedTopology
+    """
+
+    topology = PreprocessedTopology()
+    if isinstance(defines, dict):
+        topology.defines = dict(defines)
+    else:
+        topology.defines = {name: None for name in defines or []}
+
+    state = {'section': None}
+    _expand(os.path.abspath(filename), topology, include_dirs, strict, state, [])
+
+    return topology
+
+
+def _expand(filename, topology, include_dirs, strict, state, stack):
+    """
+    Evaluate the tokenized `filename` into `topology`
+    """
+
+    if filename in stack:
+        raise ValueError('Recursive include of {0} from {1}'.format(filename, stack[-1]))
+    stack.append(filename)
+    topology.includes.setdefault(filename, [])
+
+    defines = topology.defines
+
+    # Stack of (enclosing block active, branch taken) tuples
+    conditions = []
+    active = True
+    for kind, value in cached_tokenize(filename):
+        if kind == DIRECTIVE:
+            keyword, argument = value
+            if keyword in ('if', 'elif'):
+                raise ValueError('#{0} {1} in {2}: expression conditionals are not supported'.format(
+                    keyword, argument, filename))
+            elif keyword in ('ifdef', 'ifndef'):
+                taken = (argument in defines) == (keyword == 'ifdef')
+                conditions.append((active, taken))
+                active = active and taken
+                continue
+            elif keyword == 'else':
+                if not conditions:
+                    raise ValueError('#else without #ifdef in {0}'.format(filename))
+                enclosing, taken = conditions.pop()
+                conditions.append((enclosing, not taken))
+                active = enclosing and not taken
+                continue
+            elif keyword == 'endif':
+                if not conditions:
+                    raise ValueError('#endif without #ifdef in {0}'.format(filename))
+                active = conditions.pop()[0]
+                continue
+
+            if not active:
+                continue
+
+            if keyword == 'define':
+                parts = argument.split(None, 1)
+                if parts:
+                    defines[parts[0]] = parts[1] if len(parts) > 1 else None
+            elif keyword == 'undef':
+                defines.pop(argument, None)
+            elif keyword == 'include':
+                path = resolve_include(argument, filename, include_dirs)
+                if path is None:
+                    if strict:
+                        raise IOError('Unable to find include {0} in {1}'.format(argument, filename))
+                    topology.missing.append((filename, argument.strip('"<>')))
+                    continue
+                topology.includes[filename].append(path)
+                _expand(path, topology, include_dirs, strict, state, stack)
+
+        elif not active:
+            continue
+
+        elif kind == SECTION:
+            state['section'] = (value, [], filename)
+            topology.sections.append(state['section'])
+
+        elif state['section'] is not None:
+            state['section'][1].append(_substitute(value, defines))
+
+    if conditions:
+        raise ValueError('Unterminated #ifdef in {0}'.format(filename))
+
+    stack.pop()
+
+
+def _substitute(tokens, defines):
+    """
+    Replace macros in a row of `tokens` by their defined value, the
+    cached tokens are never returned to keep the include cache intact.
+    """
+
+    if not any(token in defines for token in tokens):
+        return list(tokens)
+
+    row = []
+    for token in tokens:
+        value = defines.get(token) if token in defines else None
+        if value is None:
+            row.append(token)
+        else:
+            row.extend(value.split())
+
+    return row
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: topology_table.py
+
+Typed, columnar storage for the sections of GROMACS topology files.
+
+Every section is stored as a NumPy structured array. The leading columns
+of well known sections have a fixed type (integer indices, fixed width
+byte strings for names), all remaining columns (force field parameters)
+are kept as fixed width byte strings so they are written back verbatim.
+Float columns (charges and masses) keep their original text as well and
+are read as floats; only the cells that are assigned a new value are
+formatted, using `FLOAT_FORMATS`.
+"""
+
+import numpy as np
+import six
+
+# Typed leading columns per section
+SECTION_SCHEMAS = {
+    'atomtypes': [('name', 'S')],
+    'moleculetype': [('name', 'S'), ('nrexcl', 'i4')],
+    'atoms': [('nr', 'i4'), ('type', 'S'), ('resnr', 'i4'), ('residue', 'S'), ('atom', 'S'), ('cgnr', 'i4'),
+              ('charge', 'f8'), ('mass', 'f8')],
+    'bonds': [('ai', 'i4'), ('aj', 'i4'), ('funct', 'i2')],
+    'pairs': [('ai', 'i4'), ('aj', 'i4'), ('funct', 'i2')],
+    'angles': [('ai', 'i4'), ('aj', 'i4'), ('ak', 'i4'), ('funct', 'i2')],
+    'dihedrals': [('ai', 'i4'), ('aj', 'i4'), ('ak', 'i4'), ('al', 'i4'), ('funct', 'i2')],
+    'position_restraints': [('ai', 'i4'), ('funct', 'i2')],
+    'molecules': [('name', 'S'), ('count', 'i4')]}
+
+# Output format of edited cells of float columns
+FLOAT_FORMATS = {'charge': '%.6f', 'mass': '%.4f'}
+DEFAULT_FLOAT_FORMAT = '%.5f'
+
+# Number of rows formatted per buffered write
+CHUNK_SIZE = 65536
+
+
+def section_schema(section):
+    """
+    Typed leading columns for a `section`, renamed duplicate sections
+    (e.g. dihedrals_2) share the schema of the original section.
+    """
+
+    if section not in SECTION_SCHEMAS and section.endswith('_2'):
+        section = section[:-2]
+
+    return SECTION_SCHEMAS.get(section, [])
+
+
+def column_widths(columns, padding=2):
+    """
+    Width of every string column: the longest item plus `padding`
+    """
+
+    return [int(np.char.str_len(column).max()) + padding if len(column) else padding for column in columns]
+
+
+def justify_columns(columns, widths, ncols=None):
+    """
+    Right-justify the string `columns` to the minimal `widths` and join
+    them into lines. Items longer than the width are not truncated and
+    cells beyond the number of items in a row (`ncols`) are left empty.
+    """
+
+    lines = None
+    for i, (column, width) in enumerate(zip(columns, widths)):
+        cells = np.char.rjust(column, np.maximum(np.char.str_len(column), width))
+        if ncols is not None:
+            cells = np.where(ncols > i, cells, '')
+        lines = cells if lines is None else np.char.add(lines, cells)
+
+    return lines
+
+
+def write_columns(output, columns, widths, ncols=None, chunk_size=CHUNK_SIZE):
+    """
+    Write the justified string `columns` to `output`, formatting and
+    flushing `chunk_size` rows at a time.
+    """
+
+    nrows = len(columns[0]) if columns else 0
+    for start in range(0, nrows, chunk_size):
+        stop = start + chunk_size
+        chunk_ncols = None if ncols is None else ncols[start:stop]
+        lines = justify_columns([column[start:stop] for column in columns], widths, chunk_ncols)
+        output.write('\n'.join(lines.tolist()) + '\n')
+
+
+class TopologyTable(object):
+    """
+    Typed table holding the rows of a single topology section.
+
+    :param name:  section name
+    :param data:  structured array with one record per row
+    :param ncols: number of columns present in every row
+    """
+
+    def __init__(self, name, data, ncols):
+
+        self.name = name
+        self.data = data
+        self.ncols = ncols
+
+    @classmethod
+    def from_rows(cls, name, rows):
+        """
+        Build a table from rows of string tokens as returned by the
+        topology tokenizer.
+        """
+
+        ncols = np.array([len(row) for row in rows], dtype=np.uint8)
+        width = int(ncols.max()) if len(rows) else 0
+        if len(rows) and (ncols != width).any():
+            rows = [row + [''] * (width - len(row)) for row in rows]
+
+        text = np.array(rows, dtype=str).reshape(len(rows), width)
+        schema = section_schema(name)
+
+        columns = []
+        dtypes = []
+        for i in range(width):
+            field, kind = schema[i] if i < len(schema) else ('c{0}'.format(i), 'S')
+            column = text[:, i]
+            if kind in ('S', 'f8'):
+                column = column.astype('S')
+            else:
+                column = np.where(column == '', '0', column).astype(kind)
+            columns.append(column)
+            dtypes.append((field, column.dtype))
+
+        data = np.empty(len(rows), dtype=dtypes)
+        for (field, _), column in zip(dtypes, columns):
+            data[field] = column
+
+        return cls(name, data, ncols)
+
+    @property
+    def fields(self):
+        """Column names of the table"""
+
+        return self.data.dtype.names or ()
+
+    def __len__(self):
+
+        return len(self.data)
+
+    def is_float(self, field):
+        """
+        Whether `field` is a float column stored as text
+        """
+
+        return dict(section_schema(self.name)).get(field) == 'f8'
+
+    def __getitem__(self, key):
+        """
+        Column by name or a new table holding a selection of rows
+        """
+
+        if isinstance(key, six.string_types):
+            column = self.data[key]
+            if self.is_float(key):
+                column = np.where(column == b'', b'0', column).astype(float)
+            return column
+
+        return TopologyTable(self.name, self.data[key], self.ncols[key])
+
+    def __setitem__(self, key, value):
+
+        if isinstance(key, six.string_types) and self.is_float(key):
+            self.set_floats(key, value)
+        else:
+            self.data[key] = value
+
+    def set_floats(self, field, values):
+        """
+        Assign the float column `field`, only the cells whose value
+        changes are formatted, the others keep their original text.
+        """
+
+        values = np.asarray(values, dtype=float)
+        changed = values != self[field]
+        if not changed.any():
+            return
+
+        column = self.data[field].copy()
+        edited = np.char.mod(FLOAT_FORMATS.get(field, DEFAULT_FLOAT_FORMAT), values[changed]).astype('S')
+        if edited.dtype.itemsize > column.dtype.itemsize:
+            column = column.astype(edited.dtype)
+        column[changed] = edited
+
+        if column.dtype != self.data.dtype[field]:
+            dtypes = [(name, column.dtype if name == field else self.data.dtype[name]) for name in self.fields]
+            self.data = self.data.astype(dtypes)
+        self.data[field] = column
+
+    def append(self, other):
+        """
+        Return a new table with the rows of `other` appended, text columns
+        are widened as needed.
+        """
+
+        if self.fields != other.fields:
+            return TopologyTable.from_rows(self.name, self.rows() + other.rows())
+
+        dtypes = []
+        for field in self.fields:
+            dt_self = self.data.dtype[field]
+            dt_other = other.data.dtype[field]
+            dtypes.append((field, np.promote_types(dt_self, dt_other)))
+
+        data = np.concatenate((self.data.astype(dtypes), other.data.astype(dtypes)))
+        ncols = np.concatenate((self.ncols, other.ncols))
+
+        return TopologyTable(self.name, data, ncols)
+
+    def text_columns(self):
+        """
+        Format the table column wise as arrays of strings. Cells beyond
+        the number of columns of a row are empty strings.
+        """
+
+        columns = []
+        for i, field in enumerate(self.fields):
+            column = self.data[field].astype(str)
+            missing = self.ncols <= i
+            if missing.any():
+                column = np.where(missing, '', column)
+            columns.append(column)
+
+        return columns
+
+    def rows(self):
+        """
+        Rows of the table as lists of strings
+        """
+
+        columns = [column.tolist() for column in self.text_columns()]
+
+        return [list(row[:n]) for row, n in zip(zip(*columns), self.ncols.tolist())]
@@ -13,15 +13,38 @@ import uuid
 
 from autobahn.wamp import RegisterOptions
 from tempfile import mktemp
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 
 from mdstudio.api.endpoint import endpoint
 from mdstudio.component.session import ComponentSession
 from mdstudio.deferred.chainable import chainable
 from mdstudio.deferred.return_value import return_value
 
-from mdstudio_gromacs.cerise_interface import (call_async_cerise_gromit, call_cerise_gromit, create_cerise_config,
-                                               query_simulation_results)
-from mdstudio_gromacs.md_config import set_gromacs_input
+from mdstudio_gromacs.blob_store import configure_blob_store, get_blob_store
+from mdstudio_gromacs.cerise_calls import configure_call_pool
+from mdstudio_gromacs.cerise_interface import (call_async_cerise_gromit, call_async_cerise_gromit_batch,
+                                               call_cerise_gromit, create_cerise_config, create_service,
+                                               monitor_running_tasks, query_simulation_results,
+                                               query_simulation_states)
+from mdstudio_gromacs.file_transfer import DEFAULT_UPLOAD_DIR, configure_uploads, get_uploads, write_content
+from mdstudio_gromacs.gromacs_topology_amber import close_correction_pool, configure_correction_pool
+from mdstudio_gromacs.job_monitor import configure_monitors
+from mdstudio_gromacs.md_config import set_gromacs_input, set_gromacs_inputs
+from mdstudio_gromacs.output_retrieval import configure_retriever
+from mdstudio_gromacs.polling import configure_polling
+from mdstudio_gromacs.prepared_topology import configure_prepared_cache
+from mdstudio_gromacs.service_pool import configure_service_pool
+from mdstudio_gromacs.task_events import configure_events
+from mdstudio_gromacs.task_store import configure_task_store
+from mdstudio_gromacs.topology_cache import configure_cache
+
+
+# Input files modified in the task workdir, these are never hard linked.
+# The ligand topology is replaced by the prepared ligand.itp which may
+# have the same name.
+MUTABLE_FILES = ('attype_itp', 'topology_file')
 
 
 class MDWampApi(ComponentSession):
@@ -29,9 +52,95 @@ class MDWampApi(ComponentSession):
     Molecular dynamics WAMP methods.
     """
 
+    # Worker pool running `setup_environment`, see `configure_setup_pool`
+    setup_pool = None
+    setup_queue_depth = 0
+    setup_pending = 0
+
     def authorize_request(self, uri, claims):
         return True
 
+    def on_run(self):
+        """
+        Configure the component wide resources from the settings.
+        """
+        settings = self.component_config.settings
+
+        # Simulation environments are prepared outside the reactor thread
+        self.configure_setup_pool(settings.get('setup_pool', {}))
+
+        # Worker processes preparing the ligand topologies of a batch, started on first use
+        configure_correction_pool(settings.get('correction_pool', {}).get('processes'))
+        reactor.addSystemEventTrigger('before', 'shutdown', close_correction_pool)
+
+        # Task state transitions are published for subscribers
+        configure_events(self.publish)
+
+        # Blocking calls of the Cerise client run outside the reactor thread
+        configure_call_pool(**settings.get('cerise_calls', {}))
+
+        # Waits between the checks of the remote job states
+        backoff = configure_polling(**settings.get('polling', {}))
+
+        # Cached and batched access to the task documents
+        tasks = configure_task_store(self.db, **settings.get('task_store', {}))
+        tasks.ensure_indexes()
+
+        # One monitor per Cerise service tracks the submitted jobs until they end
+        configure_monitors(tasks, backoff=backoff)
+
+        # Tasks still running from a previous run are monitored again
+        monitor_running_tasks(self.db).addErrback(
+            lambda failure: self.log.warn("monitoring the running tasks failed: {0}".format(failure.getErrorMessage())))
+
+        # Cerise services are kept running between submissions
+        configure_service_pool(create_service, **settings.get('service_pool', {}))
+
+        # Job outputs are retrieved in parallel
+        configure_retriever(**settings.get('output_retrieval', {}))
+
+        # Store of the input files shared by the task directories
+        blob_settings = settings.get('blob_store', {})
+        if blob_settings.get('directory') is not None:
+            store = configure_blob_store(**blob_settings)
+            freed = store.collect()
+            self.log.info("blob store at: {0}, {1} unreferenced bytes removed".format(
+                blob_settings['directory'], freed))
+
+        # Staging area of chunked uploads
+        upload_settings = settings.get('uploads', {})
+        configure_uploads(upload_settings.get('directory', DEFAULT_UPLOAD_DIR))
+
+        # Cache of parsed topologies shared by all requests
+        cache_settings = settings.get('topology_cache', {})
+        if cache_settings.get('directory') is not None:
+            configure_cache(cache_settings['directory'], max_size=cache_settings.get('max_size', 512 * 1024 ** 2))
+            self.log.info("topology cache at: {0}".format(cache_settings['directory']))
+
+        # Cache of prepared ligand topologies shared by all requests
+        prepared_settings = settings.get('prepared_topology_cache', {})
+        if prepared_settings.get('directory') is not None:
+            configure_prepared_cache(prepared_settings['directory'],
+                                     max_size=prepared_settings.get('max_size', 512 * 1024 ** 2))
+            self.log.info("prepared topology cache at: {0}".format(prepared_settings['directory']))
+
+    def configure_setup_pool(self, pool_settings):
+        """
+        Start the worker pool preparing the simulation environments.
+
+        :param pool_settings: dictionary with the number of worker threads
+                              (`size`) and the maximum number of requests
+                              being prepared or waiting (`queue_depth`)
+        """
+        if self.setup_pool is not None:
+            return
+
+        self.setup_pool = ThreadPool(minthreads=1, maxthreads=pool_settings.get('size', 4),
+                                     name='mdstudio_gromacs_setup')
+        self.setup_queue_depth = pool_settings.get('queue_depth', 32)
+        self.setup_pool.start()
+        reactor.addSystemEventTrigger('before', 'shutdown', self.setup_pool.stop)
+
     @endpoint('query_gromacs_results', 'query_gromacs_results_request', 'async_gromacs_response',
               options=RegisterOptions(invoke='roundrobin'))
     def query_gromacs_results(self, request, claims):
@@ -40,6 +149,11 @@ class MDWampApi(ComponentSession):
 
         The request should at least contain a task_id stored in the cerise job DB.
         The response is a typical async_gromacs response, a 'Future' object.
+
+        Instead of polling, clients can subscribe to the topic of the task,
+        mdgroup.mdstudio_gromacs.task.<task_id>, see `task_events`. The
+        results are retrieved as soon as the job ends and every transition,
+        up to completed or failed, is published without querying.
         """
 
         output = yield query_simulation_results(request, self.db)
@@ -49,6 +163,44 @@ class MDWampApi(ComponentSession):
 
         return_value(output)
 
+    @endpoint('query_gromacs_tasks', 'query_gromacs_tasks_request', 'query_gromacs_tasks_response',
+              options=RegisterOptions(invoke='roundrobin'))
+    def query_gromacs_tasks(self, request, claims):
+        """
+        Check the status of many simulations at once, selected by a list of
+        task_ids or by the batch_id of an async_gromacs_batch submission.
+
+        The response holds the status of every task, the results are only
+        retrieved and serialized if `include_results` is set.
+        """
+        tasks = yield query_simulation_states(tasks_query(request), self.db,
+                                              include_results=request.get('include_results', False))
+
+        # Report the tasks in the requested order, unknown tasks included
+        if request.get('task_ids'):
+            found = {task['task_id']: task for task in tasks}
+            tasks = [found.get(task_id, {'task_id': task_id, 'status': 'unknown'}) for task_id in request['task_ids']]
+
+        return_value({'batch_id': request.get('batch_id'), 'tasks': tasks})
+
+    @endpoint('upload_chunk', 'upload_chunk_request', 'upload_chunk_response',
+              options=RegisterOptions(invoke='roundrobin'))
+    def upload_chunk(self, request, claims):
+        """
+        Receive a chunk of a large input file. Chunks are decompressed and
+        appended to the staged file as they arrive, a simulation request
+        uses the staged file by setting `upload_id` in a path_file object.
+        """
+        if self.setup_pool is None:
+            self.configure_setup_pool({})
+
+        output = yield deferToThreadPool(reactor, self.setup_pool, get_uploads().append, request['upload_id'],
+                                         request['index'], request['content'],
+                                         compression=request.get('compression'),
+                                         encoding=request.get('encoding') or 'utf-8')
+
+        return_value(output)
+
     @endpoint('async_gromacs_ligand', 'async_gromacs_ligand_request', 'async_gromacs_response',
               options=RegisterOptions(invoke='roundrobin'))
     def run_async_ligand_solvent_md(self, request, claims):
@@ -76,6 +228,26 @@ class MDWampApi(ComponentSession):
         output = yield self.run_async_gromacs_gromacs(request, claims)
         return_value(output)
 
+    @endpoint('async_gromacs_batch', 'async_gromacs_batch_request', 'async_gromacs_batch_response',
+              options=RegisterOptions(invoke='roundrobin'))
+    def run_async_batch_md(self, request, claims):
+        """
+        Run asynchronous Gromacs MD of one protein with a batch of ligands.
+
+        The protein inputs are staged and the ligand topologies prepared
+        once for the whole batch, all simulations are submitted to the
+        same Cerise service. Returns the batch_id and the task_id of every
+        ligand, the results are queried per task. State transitions of the
+        tasks are published on the batch topic in the response.
+        """
+        cerise_configs, gromacs_configs = yield self.prepare_environment(request, self.setup_batch_environment)
+        for cerise_config in cerise_configs:
+            cerise_config['clean_remote'] = request.get('clean_remote_workdir', True)
+
+        output = yield call_async_cerise_gromit_batch(gromacs_configs, cerise_configs, self.db)
+
+        return_value(output)
+
     @endpoint('gromacs_ligand', 'gromacs_ligand_request', 'gromacs_response',
               options=RegisterOptions(invoke='roundrobin'))
     def run_ligand_solvent_md(self, request, claims):
@@ -130,11 +302,16 @@ class MDWampApi(ComponentSession):
         identifiers is expected, for example:
         residues=[1, 5, 7, 8]
 
+        The outputs copied back from the remote server are selected with
+        `outputs`, a preset (energies, decomposition, logs or all) or a list
+        of presets and output names, all outputs by default:
+        outputs=['energies', 'gromitout']
+
         Note: the protein_file arguments is optional if you do not provide it
         the method will perform a SOLVENT LIGAND MD if you provide the
         `protein_file` it will perform a PROTEIN-LIGAND MD.
         """
-        cerise_config, gromacs_config = self.setup_environment(request)
+        cerise_config, gromacs_config = yield self.prepare_environment(request)
         cerise_config['clean_remote'] = request.get('clean_remote_workdir', True)
 
         # Run the MD and retrieve the energies
@@ -147,13 +324,36 @@ class MDWampApi(ComponentSession):
         """
         async version of the `run_gromacs_gromacs` function.
         """
-        cerise_config, gromacs_config = self.setup_environment(request)
+        cerise_config, gromacs_config = yield self.prepare_environment(request)
         cerise_config['clean_remote'] = request.get('clean_remote_workdir', True)
 
         output = yield call_async_cerise_gromit(gromacs_config, cerise_config, self.db)
 
         return_value(output)
 
+    @chainable
+    def prepare_environment(self, request, setup=None):
+        """
+        Run `setup_environment` (or `setup`) in the setup worker pool,
+        keeping the component responsive while files are staged and
+        topologies are prepared. Requests beyond the configured queue
+        depth are refused.
+        """
+        if self.setup_pool is None:
+            self.configure_setup_pool({})
+
+        if self.setup_pending >= self.setup_queue_depth:
+            raise RuntimeError('Too many simulations being prepared ({0}), try again later'.format(
+                self.setup_pending))
+
+        self.setup_pending += 1
+        try:
+            configs = yield deferToThreadPool(reactor, self.setup_pool, setup or self.setup_environment, request)
+        finally:
+            self.setup_pending -= 1
+
+        return_value(configs)
+
     def setup_environment(self, request):
         """
         Set all the configuration to perform a simulation.
@@ -190,6 +390,73 @@ class MDWampApi(ComponentSession):
 
         return cerise_config, gromacs_config
 
+    def setup_batch_environment(self, request):
+        """
+        Set the configuration of a batch of simulations of one protein
+        with many ligands. The shared inputs are staged once in the batch
+        workdir, every ligand gets a task workdir inside it.
+        """
+        # Base workdir needs to exist. Might be shared between docker and host
+        check_workdir(request['workdir'])
+
+        batch_id = uuid.uuid1().hex
+        ligands = request.pop('ligands')
+        request['workdir'] = create_task_workdir(request['workdir'])
+        self.log.info("starting gromacs batch_id: {0} with {1} ligands".format(batch_id, len(ligands)))
+        self.log.info("store output in: {0}".format(request['workdir']))
+
+        # Copy the shared input files to the batch workdir
+        shared = copy_file_path_objects_to_workdir(request.copy())
+        shared['include'] = []
+        for file_type in ('attype_itp', 'protein_posre_itp'):
+            shared['include'].append(shared[file_type])
+
+        requests = []
+        for ligand in ligands:
+            task_request = shared.copy()
+            task_request['include'] = list(shared['include'])
+            task_request['task_id'] = uuid.uuid1().hex
+            task_request['batch_id'] = batch_id
+
+            # Copy the ligand input files to the task workdir
+            ligand['workdir'] = create_task_workdir(shared['workdir'])
+            task_request.update(copy_file_path_objects_to_workdir(ligand))
+            requests.append(task_request)
+
+        # Prepare the ligand topologies, adding all atom types at once
+        gromacs_configs = set_gromacs_inputs(requests, attype_itp=shared['attype_itp'])
+
+        # Load Cerise configuration once
+        batch_cerise_config = create_cerise_config(shared)
+
+        cerise_configs = []
+        for task_request in requests:
+            cerise_config = batch_cerise_config.copy()
+            cerise_config['log'] = os.path.join(task_request['workdir'], 'cerise.log')
+            cerise_config['workdir'] = task_request['workdir']
+            cerise_config['task_id'] = task_request['task_id']
+            cerise_config['batch_id'] = batch_id
+            cerise_configs.append(cerise_config)
+
+            with open(os.path.join(task_request['workdir'], "cerise.json"), "w") as f:
+                json.dump(cerise_config, f)
+
+        return cerise_configs, gromacs_configs
+
+
+def tasks_query(request):
+    """
+    MongoDB filter of the tasks selected by a `query_gromacs_tasks`
+    request, a list of task_ids takes precedence over the batch_id
+    """
+
+    if request.get('task_ids'):
+        return {'task_id': {'$in': request['task_ids']}}
+    elif request.get('batch_id') is not None:
+        return {'batch_id': request['batch_id']}
+
+    raise ValueError('Query requires a list of task_ids or a batch_id')
+
 
 def create_task_workdir(workdir):
     """
@@ -219,33 +486,48 @@ def copy_file_path_objects_to_workdir(d):
     """
 
     # Check if d is path_file object
-    path_file = {'content', 'path', 'extension', 'encoding'}
+    path_file = {'content', 'path', 'extension', 'encoding', 'compression', 'upload_id'}
 
     def condition(y):
         return isinstance(y, dict) and set(y.keys()).issubset(path_file)
 
     workdir = d['workdir']
     for key, val in d.items():
+        mutable = key in MUTABLE_FILES
         if condition(val):
-            d[key] = copy_file_to_workdir(val, workdir)
-        elif isinstance(val, list):
-            d[key] = [copy_file_to_workdir(x, workdir) for x in val if condition(x)]
+            d[key] = copy_file_to_workdir(val, workdir, mutable=mutable)
+        elif isinstance(val, list) and any(condition(x) for x in val):
+            d[key] = [copy_file_to_workdir(x, workdir, mutable=mutable) for x in val if condition(x)]
 
     return d
 
 
-def copy_file_to_workdir(serialized_file, workdir):
+def copy_file_to_workdir(serialized_file, workdir, mutable=False):
     """
     Dump the serialized file into a local folder
+
+    If a blob store is configured immutable files are staged from the
+    store as hard links, `mutable` files are written or copied into the
+    workdir without going through the store.
     """
 
-    # First try to copy the content
+    # First try a chunked upload or the content
     file_path = serialized_file['path']
     new_path = os.path.join(workdir, os.path.basename(file_path))
-
-    if serialized_file['content'] is not None:
-        with open(new_path,  'w') as f:
-            f.write(serialized_file['content'])
+    store = None if mutable else get_blob_store()
+
+    if serialized_file.get('upload_id') is not None:
+        get_uploads().claim(serialized_file['upload_id'], new_path)
+    elif serialized_file.get('content') is not None:
+        compression = serialized_file.get('compression')
+        encoding = serialized_file.get('encoding') or 'utf-8'
+        if store is not None:
+            digest = store.add_content(serialized_file['content'], compression=compression, encoding=encoding)
+            store.stage(digest, new_path)
+        else:
+            write_content(serialized_file['content'], new_path, compression=compression, encoding=encoding)
+    elif store is not None:
+        store.stage(store.add_file(file_path), new_path)
     else:
         shutil.copy(file_path, workdir)
 
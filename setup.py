@@ -39,11 +39,12 @@ setup(
     keywords='MDStudio GROMACS Molecular Dynamics',
     platforms=['Any'],
     packages=find_packages(),
-    package_data={'mdstudio_gromacs': ['data/*', 'schemas/endpoints/*', 'scripts/*']},
+    package_data={'mdstudio_gromacs': ['data/*', 'schemas/endpoints/*', 'schemas/resources/*', 'scripts/*']},
     py_modules=[distribution_name],
     scripts=['mdstudio_gromacs/scripts/getEnergies.py'],
-    install_requires=['cerise_client', 'mdstudio', 'numpy', 'pyparsing', 'panedr', 'retrying', 'six', 'docker',
-                      'twisted==18.4.0'],
+    install_requires=['cerise_client', 'mdstudio', 'numpy', 'pyparsing', 'panedr', 'requests', 'retrying', 'six',
+                      'docker', 'twisted==18.4.0'],
+    extras_require={'zstd': ['zstandard']},
     include_package_data=True,
     zip_safe=True,
     classifiers=[
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_amber_topology_test.py
+
+Unit tests for the amber ligand topology correction
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mdstudio_gromacs import gromacs_topology_amber
+from mdstudio_gromacs.gromacs_topology_amber import (close_correction_pool, configure_correction_pool, correct_itp,
+                                                   correct_itp_batch, fix_atom_types_file, get_correction_pool)
+from mdstudio_gromacs.parsers import parse_itp
+from mdstudio_gromacs.topology_cache import configure_cache
+
+currentpath = os.path.dirname(__file__)
+files = os.path.join(currentpath, '..', 'files')
+
+
+def read(filename):
+
+    with open(filename, 'r') as f:
+        return f.read()
+
+
+def section_text(text, name):
+    """
+    Text of the first section `name` in `text`, header included
+    """
+
+    start = text.index('[ {0} ]'.format(name))
+    end = text.find('\n[', start)
+
+    return text[start:] if end < 0 else text[start:end + 1]
+
+
+class TestCorrectItp(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_correct_itp_reference(self):
+        """
+        The corrected topology holds the sections of the reference, the
+        edited sections and the position restraints match the output of
+        the pyparsing based writers byte for byte
+        """
+
+        itp_file = os.path.join(self.workdir, 'ligand.itp')
+        results = correct_itp(os.path.join(files, 'input_GMX.itp'), itp_file)
+
+        reference = os.path.join(files, 'ligand_amber_ref.itp')
+        self.assertEqual(parse_itp(itp_file), parse_itp(reference))
+        for name in ('atoms', 'bonds'):
+            self.assertEqual(section_text(read(itp_file), name), section_text(read(reference), name))
+        self.assertEqual(read(results['posre_filename']), read(os.path.join(files, 'ligand_amber_ref-posre.itp')))
+        self.assertEqual(results['charge'], 0)
+        self.assertEqual(len(results['attypes']), 6)
+
+    def test_untouched_sections_are_copied(self):
+
+        itp_file = os.path.join(self.workdir, 'ligand.itp')
+        correct_itp(os.path.join(files, 'input_GMX.itp'), itp_file)
+
+        text = read(itp_file)
+        original = read(os.path.join(files, 'input_GMX.itp'))
+        for name in ('moleculetype', 'pairs', 'angles', 'dihedrals'):
+            self.assertEqual(section_text(text, name), section_text(original, name))
+        self.assertNotIn('[ atomtypes ]', text)
+
+    def test_correct_itp_without_posre(self):
+
+        itp_file = os.path.join(self.workdir, 'ligand.itp')
+        results = correct_itp(os.path.join(files, 'input_GMX.itp'), itp_file, posre=False)
+
+        self.assertIsNone(results['posre_filename'])
+        self.assertNotIn('POSRES', read(itp_file))
+
+
+class TestCorrectItpBatch(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        configure_correction_pool(2)
+
+    def tearDown(self):
+
+        close_correction_pool()
+        configure_correction_pool(None)
+        configure_cache(None)
+        shutil.rmtree(self.workdir)
+
+    def ligands(self, name, count=3):
+        """
+        Input and output topologies of `count` ligands and a copy of the
+        atom types file in directory `name`
+        """
+
+        directory = os.path.join(self.workdir, name)
+        os.mkdir(directory)
+        shutil.copy(os.path.join(files, 'attype.itp'), directory)
+        itp_files = [os.path.join(files, 'input_GMX.itp')] * count
+        new_itp_files = [os.path.join(directory, 'ligand{0}.itp'.format(i)) for i in range(count)]
+
+        return itp_files, new_itp_files, os.path.join(directory, 'attype.itp')
+
+    def test_batch_matches_serial(self):
+
+        itp_files, new_itp_files, attypes_file = self.ligands('serial')
+        serial = []
+        for itp_file, new_itp_file in zip(itp_files, new_itp_files):
+            serial.append(correct_itp(itp_file, new_itp_file))
+            fix_atom_types_file(attypes_file, serial[-1]['attypes'])
+
+        itp_files, batch_files, batch_attypes = self.ligands('batch')
+        batch = correct_itp_batch(itp_files, batch_files, attypes_file=batch_attypes)
+
+        self.assertIsNotNone(gromacs_topology_amber._correction_pool)
+        self.assertEqual(len(batch), len(serial))
+        for expected, result in zip(serial, batch):
+            self.assertEqual(result['charge'], expected['charge'])
+            self.assertEqual(result['attypes'].rows(), expected['attypes'].rows())
+            self.assertEqual(read(result['itp_filename']), read(expected['itp_filename']))
+            self.assertEqual(read(result['posre_filename']), read(expected['posre_filename']))
+        self.assertEqual(read(batch_attypes), read(attypes_file))
+
+    def test_pool_is_started_on_first_use(self):
+
+        self.assertIsNone(gromacs_topology_amber._correction_pool)
+
+        # A single ligand is prepared in this process
+        itp_files, new_itp_files, _ = self.ligands('single', count=1)
+        correct_itp_batch(itp_files, new_itp_files)
+        self.assertIsNone(gromacs_topology_amber._correction_pool)
+
+        configure_correction_pool(1)
+        self.assertIsNone(get_correction_pool())
+
+    def test_workers_use_the_topology_cache(self):
+
+        cache = configure_cache(os.path.join(self.workdir, 'cache'))
+        itp_files, new_itp_files, _ = self.ligands('cached')
+        correct_itp_batch(itp_files, new_itp_files)
+
+        # Parsed by the workers, not by this process
+        self.assertEqual(cache.misses, 0)
+        self.assertEqual(len(cache.entries()), 1)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_atomtypes_test.py
+
+Unit tests for the registry of force field atom types
+"""
+
+import unittest
+
+from mdstudio_gromacs.atomtypes import AtomTypeRegistry, same_parameters
+from mdstudio_gromacs.gromacs_topology import correctAttype
+
+C3 = ['c3', 'c3', '0.00000', '0.00000', 'A', '3.39967e-01', '4.57730e-01']
+H1 = ['h1', 'h1', '0.00000', '0.00000', 'A', '2.47135e-01', '6.56888e-02']
+OS = ['os', 'os', '0.00000', '0.00000', 'A', '3.00001e-01', '7.11280e-01']
+
+
+class TestSameParameters(unittest.TestCase):
+
+    def test_numbers_compare_by_value(self):
+
+        self.assertTrue(same_parameters(['A', '3.39967e-01'], ['A', '0.339967']))
+        self.assertFalse(same_parameters(['A', '3.39967e-01'], ['A', '0.339968']))
+
+    def test_text_and_length(self):
+
+        self.assertFalse(same_parameters(['A', '0.1'], ['D', '0.1']))
+        self.assertFalse(same_parameters(['A', '0.1'], ['A', '0.1', '0.2']))
+
+
+class TestAtomTypeRegistry(unittest.TestCase):
+
+    def test_duplicates_with_identical_parameters(self):
+
+        registry = AtomTypeRegistry([C3, H1])
+        same = ['c3', 'c3', '0.0', '0.0', 'A', '0.339967', '0.457730']
+
+        self.assertFalse(registry.add(same))
+        self.assertEqual(registry['c3'], C3)
+        self.assertEqual(registry.conflicts, [])
+        self.assertEqual(len(registry), 2)
+
+    def test_conflicting_redefinitions_are_recorded(self):
+
+        registry = AtomTypeRegistry([C3])
+        other = C3[:5] + ['3.50000e-01', C3[6]]
+
+        self.assertFalse(registry.add(other))
+        self.assertEqual(registry['c3'], C3)
+        self.assertEqual(registry.conflicts, [('c3', C3, other)])
+
+    def test_strict_registry_raises(self):
+
+        registry = AtomTypeRegistry([C3], strict=True)
+
+        self.assertRaises(ValueError, registry.add, C3[:5] + ['3.50000e-01', C3[6]])
+        self.assertFalse(registry.add(list(C3)))
+
+    def test_merge_order(self):
+
+        registry = AtomTypeRegistry([H1])
+        added = registry.merge([OS, H1, C3, OS])
+
+        # New types in the order given, each once
+        self.assertEqual(added, [OS, C3])
+        self.assertEqual([row[0] for row in registry.rows()], ['h1', 'os', 'c3'])
+        self.assertIn('os', registry)
+        self.assertNotIn('hc', registry)
+
+    def test_rows_are_copied(self):
+
+        row = list(C3)
+        registry = AtomTypeRegistry([row])
+        row[5] = '0.0'
+
+        self.assertEqual(registry['c3'], C3)
+
+    def test_correct_attype_adds_new_types(self):
+
+        itp = correctAttype({'atomtypes': [list(C3)]}, [C3, H1, OS])
+
+        self.assertEqual(itp['atomtypes'], [C3, H1, OS])
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_blob_store_test.py
+
+Unit tests for the content addressed store of input files
+"""
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+from mdstudio_gromacs import blob_store
+from mdstudio_gromacs.blob_store import BlobStore
+from mdstudio_gromacs.topology_cache import file_digest
+
+currentpath = os.path.dirname(__file__)
+files = os.path.join(currentpath, '..', 'files')
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.workdir = os.path.join(self.tmpdir, 'task1')
+        os.makedirs(self.workdir)
+        self.store = BlobStore(os.path.join(self.tmpdir, 'blobs'))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.tmpdir)
+
+    def test_add_file(self):
+
+        filename = os.path.join(files, 'protein.top')
+        digest = self.store.add_file(filename)
+
+        self.assertEqual(digest, file_digest(filename))
+        self.assertEqual(file_digest(self.store.path(digest)), digest)
+        self.assertEqual(self.store.add_file(filename), digest)
+        self.assertEqual(self.store.refcount(digest), 0)
+
+    def test_add_content(self):
+
+        digest = self.store.add_content(u'ATOM\n')
+        staged = self.store.stage(digest, os.path.join(self.workdir, 'compound.pdb'))
+
+        with open(staged, 'r') as f:
+            self.assertEqual(f.read(), 'ATOM\n')
+        self.assertEqual(self.store.add_content(u'ATOM\n'), digest)
+        self.assertEqual(len(os.listdir(os.path.dirname(self.store.path(digest)))), 1)
+
+    def test_stage_links_the_blob(self):
+
+        digest = self.store.add_file(os.path.join(files, 'attype.itp'))
+        staged = self.store.stage(digest, os.path.join(self.workdir, 'attype.itp'))
+
+        self.assertTrue(os.path.samefile(staged, self.store.path(digest)))
+        self.assertEqual(self.store.refcount(digest), 1)
+
+    def test_stage_copies_across_file_systems(self):
+
+        def link(source, destination):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        digest = self.store.add_file(os.path.join(files, 'attype.itp'))
+        os_link = blob_store.os.link
+        blob_store.os.link = link
+        try:
+            staged = self.store.stage(digest, os.path.join(self.workdir, 'attype.itp'))
+        finally:
+            blob_store.os.link = os_link
+
+        self.assertFalse(os.path.samefile(staged, self.store.path(digest)))
+        self.assertEqual(file_digest(staged), digest)
+        self.assertEqual(self.store.refcount(digest), 0)
+
+    def test_collect_after_stage(self):
+
+        staged = self.store.add_file(os.path.join(files, 'attype.itp'))
+        unused = self.store.add_file(os.path.join(files, 'protein.top'))
+        self.store.stage(staged, os.path.join(self.workdir, 'attype.itp'))
+
+        self.assertEqual(self.store.collect(grace=0), os.path.getsize(os.path.join(files, 'protein.top')))
+        self.assertTrue(os.path.exists(self.store.path(staged)))
+        self.assertFalse(os.path.exists(self.store.path(unused)))
+
+        # Removing the task directory releases the blob
+        shutil.rmtree(self.workdir)
+        self.store.collect(grace=0)
+        self.assertFalse(os.path.exists(self.store.path(staged)))
+
+    def test_collect_keeps_recent_blobs(self):
+
+        digest = self.store.add_file(os.path.join(files, 'protein.top'))
+
+        self.assertEqual(self.store.collect(), 0)
+        self.assertTrue(os.path.exists(self.store.path(digest)))
+
+    def test_digests_are_bounded(self):
+
+        self.store._digests.max_size = 1
+        self.store.add_file(os.path.join(files, 'attype.itp'))
+        self.store.add_file(os.path.join(files, 'protein.top'))
+
+        self.assertEqual(len(self.store._digests), 1)
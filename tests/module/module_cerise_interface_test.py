@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_cerise_interface_test.py
+
+Unit tests for the submission and monitoring of the Cerise jobs
+"""
+
+import requests
+import unittest
+
+from twisted.internet.defer import Deferred, maybeDeferred, succeed
+
+from mdstudio_gromacs import cerise_interface
+from mdstudio_gromacs.cerise_interface import (FAILURE_OUTPUTS, OUTPUT_FORMATS, monitor_task, output_keys,
+                                               query_simulation_results, query_simulation_states)
+
+
+class FakeTasks(object):
+    """
+    Task store recording the updates made
+    """
+
+    def __init__(self, docs=()):
+
+        self.docs = list(docs)
+        self.updates = []
+        self.queries = []
+
+    def find_many(self, query):
+
+        self.queries.append(query)
+        return succeed([dict(doc) for doc in self.docs])
+
+    def update(self, task_id, fields):
+
+        self.updates.append((task_id, fields))
+
+
+class FakeMonitor(object):
+
+    def __init__(self):
+
+        self.waiting = {}
+
+    def wait(self, task_id, condition=None, batch_id=None):
+
+        self.waiting[task_id] = Deferred()
+        return self.waiting[task_id]
+
+
+class CeriseInterfaceTestCase(unittest.TestCase):
+    """
+    Replaces the task store, job monitors and task events of the module
+    """
+
+    def setUp(self):
+
+        self.tasks = FakeTasks()
+        self.monitor = FakeMonitor()
+        self.published = []
+
+        self.patched = {}
+        self.patch('get_task_store', lambda cerise_db: self.tasks)
+        self.patch('get_monitor', lambda srv_data: self.monitor)
+        self.patch('publish_status', lambda task_id, status, batch_id=None: self.published.append(
+            (task_id, status, batch_id)))
+
+    def tearDown(self):
+
+        for name, value in self.patched.items():
+            setattr(cerise_interface, name, value)
+
+    def patch(self, name, value):
+
+        self.patched.setdefault(name, getattr(cerise_interface, name))
+        setattr(cerise_interface, name, value)
+
+
+class TestMonitorTask(CeriseInterfaceTestCase):
+
+    def test_missing_job_is_failed(self):
+
+        results = []
+        monitor_task({'task_id': 'task1', 'batch_id': 'batch1'}, None).addCallback(results.append)
+        self.monitor.waiting['task1'].errback(RuntimeError('Job task1 was not found in service cerise'))
+
+        self.assertEqual(results, [{'status': 'failed', 'task_id': 'task1'}])
+        self.assertEqual(self.tasks.updates, [('task1', {'task_id': 'task1', 'status': 'failed'})])
+        self.assertEqual(self.published, [('task1', 'failed', 'batch1')])
+
+    def test_results_are_retrieved_once_finished(self):
+
+        retrieved = []
+        self.patch('query_simulation_results', lambda srv_data, cerise_db: retrieved.append(srv_data['task_id']))
+
+        monitor_task({'task_id': 'task1'}, None)
+        self.assertEqual(retrieved, [])
+        self.monitor.waiting['task1'].callback('completed')
+
+        self.assertEqual(retrieved, ['task1'])
+        self.assertEqual(self.tasks.updates, [])
+
+
+class FakeJob(object):
+
+    def __init__(self, state):
+
+        self.state = state
+
+
+class FakeService(object):
+
+    def __init__(self, name, jobs=None):
+
+        self.name = name
+        self.jobs = jobs or {}
+
+    def get_job_by_name(self, name):
+
+        return self.jobs[name]
+
+
+class FakeCerise(object):
+    """
+    Cerise client module serving the services by name
+    """
+
+    class errors(object):
+
+        class ServiceNotFound(Exception):
+            pass
+
+        class JobNotFound(Exception):
+            pass
+
+    def __init__(self, *services):
+
+        self.services = dict((srv.name, srv) for srv in services)
+
+    def service_from_dict(self, srv_data):
+
+        return self.services[srv_data['name']]
+
+
+class TestQuerySimulationStates(CeriseInterfaceTestCase):
+
+    def setUp(self):
+
+        super(TestQuerySimulationStates, self).setUp()
+        self.tasks.docs = [
+            {'task_id': 'task1', 'name': 'cerise-a', 'port': 29593, 'batch_id': 'batch1', 'status': 'running'},
+            {'task_id': 'task2', 'name': 'cerise-b', 'port': 29593, 'batch_id': 'batch1', 'status': 'running'},
+            {'task_id': 'task3', 'name': 'cerise-a', 'port': 29593, 'batch_id': 'batch1', 'status': 'running'},
+            {'task_id': 'task4', 'name': 'cerise-b', 'port': 29593, 'batch_id': 'batch1', 'status': 'completed',
+             'results': {'energy_dataframe': 'energies'}}]
+        self.states = {'cerise-a': {'task1': 'Running', 'task3': 'Waiting'},
+                       'cerise-b': {'task2': 'PermanentFailure'}}
+        self.listed = []
+
+        self.patch('cc', FakeCerise(FakeService('cerise-a'), FakeService('cerise-b')))
+        self.patch('call_in_pool', maybeDeferred)
+        self.patch('job_states', self.job_states)
+
+    def job_states(self, srv):
+
+        self.listed.append(srv.name)
+        if srv.name not in self.states:
+            raise requests.ConnectionError('Connection refused')
+
+        return self.states[srv.name]
+
+    def query(self, query, include_results=False):
+
+        results = []
+        query_simulation_states(query, None, include_results=include_results).addCallback(results.append)
+
+        return results[0]
+
+    def test_one_listing_per_service(self):
+
+        tasks = self.query({'batch_id': 'batch1'})
+
+        self.assertEqual(self.tasks.queries, [{'batch_id': 'batch1'}])
+        self.assertEqual(sorted(self.listed), ['cerise-a', 'cerise-b'])
+        self.assertEqual(sorted((task['task_id'], task['status']) for task in tasks),
+                         [('task1', 'running'), ('task2', 'failed'), ('task3', 'queued'), ('task4', 'completed')])
+        self.assertEqual(sorted(self.published), [('task1', 'running', 'batch1'), ('task3', 'queued', 'batch1')])
+
+    def test_results_of_finished_tasks(self):
+
+        retrieved = []
+
+        def query_simulation_results(srv_data, cerise_db):
+            retrieved.append(srv_data['task_id'])
+            return succeed({'status': 'failed', 'results': {}})
+
+        self.patch('query_simulation_results', query_simulation_results)
+        tasks = dict((task['task_id'], task) for task in self.query({'batch_id': 'batch1'}, include_results=True))
+
+        # Jobs still on the service are retrieved, stored results are reused
+        self.assertEqual(retrieved, ['task2'])
+        self.assertEqual(tasks['task2']['results'], {})
+        self.assertEqual(tasks['task4']['results'], {'energy_dataframe': 'energies'})
+        self.assertNotIn('results', tasks['task1'])
+
+    def test_unreachable_service(self):
+
+        del self.states['cerise-b']
+        tasks = dict((task['task_id'], task['status']) for task in self.query({'batch_id': 'batch1'}))
+
+        # The stored status is reported
+        self.assertEqual(tasks['task2'], 'running')
+        self.assertEqual(tasks['task4'], 'completed')
+        self.assertEqual(tasks['task1'], 'running')
+
+
+class TestOutputKeys(unittest.TestCase):
+
+    def test_all_outputs_by_default(self):
+
+        self.assertEqual(output_keys(), sorted(OUTPUT_FORMATS))
+        self.assertEqual(output_keys('all'), sorted(OUTPUT_FORMATS))
+
+    def test_presets_and_outputs(self):
+
+        self.assertEqual(output_keys('energies'), ['energy_dataframe'])
+        self.assertEqual(output_keys(['decomposition', 'logs', 'energy_edr', 'energy_dataframe']),
+                         ['decompose_dataframe', 'energy_dataframe', 'energy_edr', 'gromiterr', 'gromitout'])
+        self.assertEqual(output_keys([]), [])
+
+    def test_unknown_output(self):
+
+        self.assertRaises(ValueError, output_keys, ['energies', 'trajectory'])
+
+
+class TestFailedJobOutputs(CeriseInterfaceTestCase):
+
+    def setUp(self):
+
+        super(TestFailedJobOutputs, self).setUp()
+        self.extracted = []
+        self.stored = []
+
+        self.patch('cc', FakeCerise(FakeService('cerise-a', {'task1': FakeJob('PermanentFailure')})))
+        self.patch('call_in_pool', maybeDeferred)
+        self.patch('wait_extract_clean', lambda job, srv, workdir, clean_remote, keys=None: self.extracted.append(keys))
+        self.patch('update_srv_info_at_db', lambda srv_data, cerise_db: self.stored.append(srv_data))
+
+    def query(self, outputs):
+
+        srv_data = {'task_id': 'task1', 'name': 'cerise-a', 'workdir': '/tmp', 'clean_remote': True,
+                    'status': 'running', 'outputs': outputs}
+        results = []
+        query_simulation_results(srv_data, None).addCallback(results.append)
+
+        return results[0]
+
+    def test_logs_of_failed_jobs_are_retrieved(self):
+
+        result = self.query(output_keys('energies'))
+
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(self.extracted, [sorted(['energy_dataframe'] + FAILURE_OUTPUTS)])
+        self.assertEqual(self.stored[0]['status'], 'failed')
+        self.assertEqual(self.published, [('task1', 'failed', None)])
+
+    def test_all_outputs_without_manifest(self):
+
+        self.query(None)
+
+        self.assertEqual(self.extracted, [sorted(OUTPUT_FORMATS)])
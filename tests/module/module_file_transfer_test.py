@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_file_transfer_test.py
+
+Unit tests for the compressed and chunked transfer of input files
+"""
+
+import base64
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from mdstudio_gromacs.file_transfer import UploadStore, iter_content, write_content
+
+
+def gzip_content(text):
+    """
+    Base64 encoded gzip compressed `text`
+    """
+
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as f:
+        f.write(text.encode('utf-8'))
+
+    return base64.b64encode(buf.getvalue()).decode('ascii')
+
+
+class TestContent(unittest.TestCase):
+
+    def test_plain_content(self):
+
+        self.assertEqual(b''.join(iter_content(u'[ atoms ]\n')), b'[ atoms ]\n')
+
+    def test_gzip_content(self):
+
+        text = u'[ atoms ]\n' * 1000
+        content = gzip_content(text)
+        # Line breaks in the encoded content are ignored
+        content = '\n'.join(content[i:i + 76] for i in range(0, len(content), 76))
+
+        self.assertEqual(b''.join(iter_content(content, compression='gzip')), text.encode('utf-8'))
+
+    def test_invalid_content(self):
+
+        self.assertRaises(ValueError, list, iter_content('not base64!', compression='gzip'))
+        self.assertRaises(ValueError, list, iter_content('', compression='bz2'))
+
+
+class TestUploadStore(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.uploads = UploadStore(os.path.join(self.workdir, 'uploads'))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_chunked_upload(self):
+
+        self.uploads.append('protein', 0, u'[ atoms ]\n')
+        self.uploads.append('protein', 1, gzip_content(u'1 C\n'), compression='gzip')
+        state = self.uploads.append('protein', 2, u'2 H\n')
+
+        self.assertEqual(state, {'upload_id': 'protein', 'chunks': 3, 'size': 18})
+
+        destination = os.path.join(self.workdir, 'protein.top')
+        self.uploads.claim('protein', destination)
+        with open(destination, 'r') as f:
+            self.assertEqual(f.read(), '[ atoms ]\n1 C\n2 H\n')
+        self.assertEqual(os.listdir(self.uploads.directory), [])
+
+    def test_resent_chunk_is_ignored(self):
+
+        self.uploads.append('protein', 0, u'[ atoms ]\n')
+        state = self.uploads.append('protein', 0, u'[ atoms ]\n')
+
+        self.assertEqual(state['chunks'], 1)
+        self.assertEqual(state['size'], 10)
+
+    def test_chunk_out_of_order(self):
+
+        self.assertRaises(ValueError, self.uploads.append, 'protein', 1, u'1 C\n')
+
+    def test_invalid_upload_id(self):
+
+        self.assertRaises(ValueError, self.uploads.append, '../protein', 0, u'')
+
+    def test_unknown_upload(self):
+
+        self.assertRaises(IOError, self.uploads.claim, 'protein', os.path.join(self.workdir, 'protein.top'))
+
+    def test_write_content(self):
+
+        path = os.path.join(self.workdir, 'ligand.itp')
+
+        self.assertEqual(write_content(gzip_content(u'[ atoms ]\n'), path, compression='gzip'), 10)
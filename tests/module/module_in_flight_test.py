@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_in_flight_test.py
+
+Unit tests for the deferred operations shared by concurrent callers
+"""
+
+import unittest
+
+from twisted.internet.defer import Deferred
+
+from mdstudio_gromacs.in_flight import InFlight
+
+
+class TestInFlight(unittest.TestCase):
+
+    def test_concurrent_callers_share_the_result(self):
+
+        operation = Deferred()
+        calls = []
+        in_flight = InFlight()
+
+        def start():
+            calls.append(1)
+            return operation
+
+        results = []
+        in_flight.run('task1', start).addCallback(results.append)
+        in_flight.run('task1', start).addCallback(results.append)
+        self.assertIn('task1', in_flight)
+
+        operation.callback('done')
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['done', 'done'])
+        self.assertNotIn('task1', in_flight)
+
+    def test_failures_reach_every_caller(self):
+
+        operation = Deferred()
+        in_flight = InFlight()
+        errors = []
+        in_flight.run('task1', lambda: operation).addErrback(errors.append)
+        in_flight.run('task1', lambda: operation).addErrback(errors.append)
+
+        operation.errback(IOError('connection lost'))
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(all(error.check(IOError) for error in errors))
+
+    def test_synchronous_operation(self):
+
+        in_flight = InFlight()
+        results = []
+        in_flight.run('task1', lambda: 'done').addCallback(results.append)
+
+        self.assertEqual(results, ['done'])
+        self.assertNotIn('task1', in_flight)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_job_monitor_test.py
+
+Unit tests for the monitor of the jobs of a Cerise service
+"""
+
+import unittest
+
+from twisted.internet import task
+
+from mdstudio_gromacs import job_monitor
+from mdstudio_gromacs.job_monitor import JobMonitor, job_states, jobs_url
+from mdstudio_gromacs.polling import Backoff
+
+
+class FakeTasks(object):
+
+    def __init__(self):
+
+        self.updates = []
+        self.invalidated = []
+
+    def update_many(self, task_ids, fields):
+
+        self.updates.append((sorted(task_ids), fields))
+
+    def invalidate(self, task_ids):
+
+        self.invalidated.extend(task_ids)
+
+
+class TestJobMonitor(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = task.Clock()
+        self.tasks = FakeTasks()
+        self.states = {}
+        self.published = []
+
+        self.monitor = JobMonitor({'name': 'cerise', 'port': 29593}, tasks=self.tasks,
+                                  backoff=Backoff(initial=10.0, maximum=10.0, jitter=0.0), clock=self.clock)
+        self.monitor.in_thread = False
+        self.monitor.list_states = lambda: dict(self.states)
+
+        self.publish_status = job_monitor.publish_status
+        job_monitor.publish_status = lambda task_id, status, batch_id=None: self.published.append(
+            (task_id, status, batch_id))
+
+    def tearDown(self):
+
+        job_monitor.publish_status = self.publish_status
+
+    def test_tracked_until_final(self):
+
+        self.states['task1'] = 'Waiting'
+        self.monitor.track('task1', batch_id='batch1')
+
+        self.clock.advance(10)
+        self.states['task1'] = 'Running'
+        self.clock.advance(10)
+        self.clock.advance(10)
+        self.states['task1'] = 'Success'
+        self.clock.advance(10)
+
+        self.assertEqual(self.published, [('task1', 'queued', 'batch1'), ('task1', 'running', 'batch1')])
+        self.assertEqual([fields['job_state'] for _, fields in self.tasks.updates], ['Waiting', 'Running', 'Success'])
+        self.assertEqual(self.tasks.invalidated, ['task1', 'task1', 'task1'])
+        self.assertEqual(self.monitor.tracked, [])
+        self.assertFalse(self.monitor.running)
+
+    def test_waiters_are_woken(self):
+
+        self.states['task1'] = 'Waiting'
+        running = self.monitor.wait('task1', lambda status: status != 'queued')
+        finished = self.monitor.wait('task1')
+        results = []
+        running.addCallback(results.append)
+        finished.addCallback(results.append)
+
+        self.clock.advance(10)
+        self.assertEqual(results, [])
+        self.states['task1'] = 'Running'
+        self.clock.advance(10)
+        self.assertEqual(results, ['running'])
+        self.states['task1'] = 'PermanentFailure'
+        self.clock.advance(10)
+        self.assertEqual(results, ['running', 'failed'])
+
+    def test_final_status_wakes_any_condition(self):
+
+        self.states['task1'] = 'Success'
+        results = []
+        self.monitor.wait('task1', lambda status: status == 'queued').addCallback(results.append)
+        self.clock.advance(10)
+
+        self.assertEqual(results, ['completed'])
+
+    def test_checks_back_off_until_a_change(self):
+
+        checks = []
+
+        def list_states():
+            checks.append(self.clock.seconds())
+            return dict(self.states)
+
+        self.monitor.backoff = Backoff(initial=2.0, maximum=8.0, factor=2.0, jitter=0.0)
+        self.monitor.list_states = list_states
+        self.states['task1'] = 'Waiting'
+        self.monitor.track('task1')
+
+        self.clock.pump([1] * 16)
+        self.states['task1'] = 'Running'
+        self.clock.pump([1] * 16)
+
+        # The waits start over once the first state and the change are seen
+        self.assertEqual(checks, [2, 4, 8, 16, 24, 26, 30])
+
+    def test_missing_job(self):
+
+        errors = []
+        self.monitor.wait('task1').addErrback(errors.append)
+        self.clock.advance(10)
+
+        self.assertTrue(errors[0].check(RuntimeError))
+        self.assertEqual(self.monitor.tracked, [])
+
+    def test_errors_keep_the_monitor_running(self):
+
+        self.states['task1'] = 'Waiting'
+        self.monitor.track('task1')
+        self.tasks.update_many = None
+
+        self.clock.advance(10)
+        self.assertTrue(self.monitor.running)
+
+        def list_failed():
+            raise IOError('service restarting')
+
+        self.monitor.list_states = list_failed
+        self.clock.advance(10)
+        self.assertTrue(self.monitor.running)
+        self.assertEqual(self.monitor.tracked, ['task1'])
+
+    def test_jobs_url(self):
+
+        class Service(object):
+            name = 'cerise'
+
+        self.assertRaises(RuntimeError, jobs_url, Service())
+
+    def test_job_states_time_out(self):
+
+        class Service(object):
+            _jobs = 'http://localhost:29593/jobs'
+
+        class Response(object):
+
+            def raise_for_status(self):
+                pass
+
+            def json(self):
+                return [{'name': 'task1', 'state': 'Running'}]
+
+        calls = []
+
+        def get(url, **kwargs):
+            calls.append((url, kwargs))
+            return Response()
+
+        requests_get = job_monitor.requests.get
+        job_monitor.requests.get = get
+        try:
+            self.assertEqual(job_states(Service(), timeout=5.0), {'task1': 'Running'})
+        finally:
+            job_monitor.requests.get = requests_get
+
+        self.assertEqual(calls, [('http://localhost:29593/jobs', {'timeout': 5.0})])
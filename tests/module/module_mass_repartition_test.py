@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_mass_repartition_test.py
+
+Unit tests for the heavy hydrogen mass repartitioning
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from mdstudio_gromacs.gromacs_topology import correct_itp
+from mdstudio_gromacs.mass_repartition import hydrogen_mask, hydrogen_partners, repartition_masses
+
+MOLECULES = """[ moleculetype ]
+  MET  3
+
+[ atoms ]
+  1  CT  1  MET  C1  1  -0.1  12.01000
+  2  HC  1  MET  H1  1   0.0   1.00800
+  3  HC  1  MET  H2  1   0.0   1.00800
+  4  HC  1  MET  H3  1   0.0   1.00800
+  5  OH  1  MET  O1  1  -0.6  16.00000
+  6  HO  1  MET  H4  1   0.4   1.00800
+
+[ bonds ]
+  1  2  1
+  3  1  1
+  1  4  1
+  1  5  1
+  6  5  1
+
+[ moleculetype ]
+  WAT  3
+
+[ atoms ]
+  1  OW  1  WAT  O  1  -0.8  16.00000
+  2  HW  1  WAT  H1  1   0.4   1.00800
+  3  HW  1  WAT  H2  1   0.4   1.00800
+
+[ bonds ]
+  1  2  1
+  1  3  1
+
+[ system ]
+  test
+
+[ molecules ]
+  MET  1
+  WAT  10
+"""
+
+
+class TestMassRepartition(unittest.TestCase):
+
+    types = np.array(['CT', 'HC', 'HC', 'HC', 'OH', 'HO'])
+    masses = np.array([12.01, 1.008, 1.008, 1.008, 16.0, 1.008])
+    bonds = np.array([[0, 1], [2, 0], [0, 3], [0, 4], [5, 4]])
+
+    def test_hydrogen_mask(self):
+
+        self.assertEqual(hydrogen_mask(self.types).tolist(), [False, True, True, True, False, True])
+        self.assertEqual(hydrogen_mask(self.types.astype('S')).tolist(), [False, True, True, True, False, True])
+
+    def test_partners_in_any_order(self):
+
+        hs, ps = hydrogen_partners(self.types, self.bonds)
+
+        self.assertEqual(hs.tolist(), [1, 2, 3, 5])
+        self.assertEqual(ps.tolist(), [0, 0, 0, 4])
+
+    def test_repartition(self):
+
+        new_masses = repartition_masses(self.masses, self.types, self.bonds)
+
+        np.testing.assert_allclose(new_masses, [2.938, 4.032, 4.032, 4.032, 12.976, 4.032])
+        self.assertAlmostEqual(new_masses.sum(), self.masses.sum())
+
+    def test_without_hydrogens(self):
+
+        masses = np.array([12.01, 16.0])
+        new_masses = repartition_masses(masses, ['C', 'O'], [[0, 1]])
+
+        np.testing.assert_array_equal(new_masses, masses)
+        self.assertIsNot(new_masses, masses)
+
+    def test_heavy_atom_without_mass(self):
+
+        masses = np.array([4.938, 4.032, 4.032, 4.032])
+        types = ['N3', 'H', 'H', 'H']
+
+        self.assertRaises(ValueError, repartition_masses, masses, types, [[0, 1], [0, 2], [0, 3]])
+
+
+class TestHeavyHydrogens(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.top_file = os.path.join(self.workdir, 'topol.top')
+        with open(self.top_file, 'w') as f:
+            f.write(MOLECULES)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def atoms(self, top_file):
+
+        atoms = {}
+        molecule = None
+        section = None
+        with open(top_file, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    section = line.strip('[] ')
+                elif line and section == 'moleculetype':
+                    molecule = line.split()[0]
+                elif line and section == 'atoms':
+                    atoms.setdefault(molecule, []).append(float(line.split()[7]))
+
+        return atoms
+
+    def test_correct_itp_excludes(self):
+
+        out_file = os.path.join(self.workdir, 'out.top')
+        results = correct_itp(self.top_file, out_file, excludeHH=['WAT'], excludePosre=['WAT'])
+        atoms = self.atoms(out_file)
+
+        np.testing.assert_allclose(atoms['MET'], [2.938, 4.032, 4.032, 4.032, 12.976, 4.032])
+        self.assertEqual(atoms['WAT'], [16.0, 1.008, 1.008])
+        self.assertEqual(results['posre'], ['MET-posre.itp'])
+        self.assertTrue(os.path.isfile(os.path.join(self.workdir, 'MET-posre.itp')))
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_output_retrieval_test.py
+
+Unit tests for the retrieval of the outputs of a Cerise job
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet.defer import Deferred
+
+from mdstudio_gromacs import output_retrieval
+from mdstudio_gromacs.output_retrieval import MANIFEST, OutputRetriever, save_output
+
+
+class FakeOutput(object):
+
+    def __init__(self, content):
+
+        self.content = content
+
+    def save_as(self, path):
+
+        with open(path, 'w') as f:
+            f.write(self.content)
+
+
+class TestOutputRetriever(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.paths = {'gromitout': os.path.join(self.workdir, 'gromitout.out')}
+        self.outputs = {'gromitout': FakeOutput('gromit output\n')}
+
+        # Downloads run when the test fires them instead of in the pool
+        self.downloads = []
+        self.deferToThreadPool = output_retrieval.deferToThreadPool
+        output_retrieval.deferToThreadPool = self.download
+
+        self.retriever = OutputRetriever()
+        self.retriever.pool = object()
+
+    def tearDown(self):
+
+        output_retrieval.deferToThreadPool = self.deferToThreadPool
+        shutil.rmtree(self.workdir)
+
+    def download(self, reactor, pool, f, *args, **kwargs):
+
+        d = Deferred()
+        self.downloads.append((d, f, args, kwargs))
+
+        return d
+
+    def finish_downloads(self):
+
+        downloads, self.downloads = self.downloads, []
+        for d, f, args, kwargs in downloads:
+            try:
+                result = f(*args, **kwargs)
+            except Exception as e:
+                d.errback(e)
+            else:
+                d.callback(result)
+
+    def test_concurrent_retrievals(self):
+
+        results = []
+        self.retriever.retrieve(self.outputs, self.paths, self.workdir).addCallback(results.append)
+        self.retriever.retrieve(self.outputs, self.paths, self.workdir).addCallback(results.append)
+
+        self.assertEqual(len(self.downloads), 1)
+        self.finish_downloads()
+
+        self.assertEqual(results, [self.paths, self.paths])
+        self.assertEqual(sorted(os.listdir(self.workdir)), ['gromitout.out', MANIFEST])
+        with open(os.path.join(self.workdir, MANIFEST), 'r') as f:
+            self.assertEqual(json.load(f), {'gromitout': {'size': 14}})
+
+    def test_retrievals_of_other_outputs_are_not_shared(self):
+
+        outputs = dict(self.outputs, gromiterr=FakeOutput('gromit errors\n'))
+        paths = dict(self.paths, gromiterr=os.path.join(self.workdir, 'gromiterr.err'))
+
+        results = []
+        self.retriever.retrieve(self.outputs, self.paths, self.workdir).addCallback(results.append)
+        self.retriever.retrieve(outputs, paths, self.workdir).addCallback(results.append)
+
+        self.assertEqual(len(self.downloads), 3)
+        self.finish_downloads()
+
+        self.assertEqual(results, [self.paths, paths])
+
+    def test_overlapping_retrievals(self):
+
+        outputs = dict(self.outputs, gromiterr=FakeOutput('gromit errors\n'))
+        paths = dict(self.paths, gromiterr=os.path.join(self.workdir, 'gromiterr.err'))
+
+        results = []
+        self.retriever.retrieve(self.outputs, self.paths, self.workdir).addCallback(results.append)
+        self.retriever.retrieve(outputs, paths, self.workdir).addCallback(results.append)
+
+        # The first retrieval saves its output last
+        self.downloads.reverse()
+        self.finish_downloads()
+
+        self.assertEqual(sorted(results, key=len), [self.paths, paths])
+        self.assertEqual(sorted(os.listdir(self.workdir)), ['gromiterr.err', 'gromitout.out', MANIFEST])
+        with open(os.path.join(self.workdir, MANIFEST), 'r') as f:
+            self.assertEqual(json.load(f), {'gromitout': {'size': 14}, 'gromiterr': {'size': 14}})
+
+    def test_saves_use_their_own_temporary_file(self):
+
+        saved = []
+
+        class Recording(FakeOutput):
+            def save_as(self, path):
+                saved.append(path)
+                FakeOutput.save_as(self, path)
+
+        save_output(Recording('first\n'), self.paths['gromitout'])
+        save_output(Recording('second\n'), self.paths['gromitout'])
+
+        self.assertNotEqual(saved[0], saved[1])
+        self.assertTrue(all(os.path.dirname(path) == self.workdir for path in saved))
+        self.assertEqual(os.listdir(self.workdir), ['gromitout.out'])
+
+    def test_retrieved_outputs_are_skipped(self):
+
+        self.retriever.retrieve(self.outputs, self.paths, self.workdir)
+        self.finish_downloads()
+
+        results = []
+        self.retriever.retrieve(self.outputs, self.paths, self.workdir).addCallback(results.append)
+
+        self.assertEqual(self.downloads, [])
+        self.assertEqual(results, [self.paths])
+
+    def test_missing_output(self):
+
+        results = []
+        self.retriever.retrieve({'gromitout': None}, self.paths, self.workdir).addCallback(results.append)
+        self.finish_downloads()
+
+        self.assertEqual(results, [{'gromitout': None}])
+
+    def test_save_output_cleans_up(self):
+
+        class Broken(object):
+            def save_as(self, path):
+                with open(path, 'w') as f:
+                    f.write('partial')
+                raise IOError('connection lost')
+
+        self.assertRaises(IOError, save_output, Broken(), self.paths['gromitout'])
+        self.assertEqual(os.listdir(self.workdir), [])
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_polling_test.py
+
+Unit tests for the polling of remote state on reactor timers
+"""
+
+import unittest
+
+from twisted.internet import task
+
+from mdstudio_gromacs.polling import Backoff, poll
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_delays_grow_to_the_maximum(self):
+
+        delays = Backoff(initial=2.0, maximum=10.0, factor=2.0, jitter=0.0).delays()
+
+        self.assertEqual([next(delays) for _ in range(5)], [2.0, 4.0, 8.0, 10.0, 10.0])
+
+    def test_jitter(self):
+
+        delays = Backoff(initial=10.0, maximum=10.0, jitter=0.1).delays()
+
+        self.assertTrue(all(9.0 <= next(delays) <= 11.0 for _ in range(100)))
+
+    def test_invalid_backoff(self):
+
+        self.assertRaises(ValueError, Backoff, initial=0)
+        self.assertRaises(ValueError, Backoff, initial=10.0, maximum=5.0)
+        self.assertRaises(ValueError, Backoff, factor=0.5)
+        self.assertRaises(ValueError, Backoff, jitter=1.0)
+
+
+class TestPoll(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = task.Clock()
+        self.backoff = Backoff(initial=2.0, maximum=10.0, factor=2.0, jitter=0.0)
+
+    def test_checks_until_done(self):
+
+        states = iter(['Waiting', 'Running', 'Running', 'Success'])
+        checks = []
+
+        def check():
+            checks.append(self.clock.seconds())
+            return next(states)
+
+        results = []
+        poll(check, lambda state: state == 'Success', backoff=self.backoff, clock=self.clock,
+             in_thread=False).addCallback(results.append)
+
+        self.clock.pump([1] * 20)
+
+        self.assertEqual(results, ['Success'])
+        self.assertEqual(checks, [0, 2, 6, 14])
+
+    def test_check_failure(self):
+
+        def check():
+            raise IOError('service unreachable')
+
+        errors = []
+        poll(check, bool, backoff=self.backoff, clock=self.clock, in_thread=False).addErrback(errors.append)
+
+        self.assertTrue(errors[0].check(IOError))
+
+    def test_done_failure(self):
+
+        errors = []
+        poll(lambda: 'Running', lambda state: state.missing, backoff=self.backoff, clock=self.clock,
+             in_thread=False).addErrback(errors.append)
+
+        self.assertTrue(errors[0].check(AttributeError))
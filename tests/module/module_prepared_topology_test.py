@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_prepared_topology_test.py
+
+Unit tests for the cache of prepared ligand topologies
+"""
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from mdstudio_gromacs.gromacs_topology_amber import correct_itp, fix_atom_types_file
+from mdstudio_gromacs.md_config import fix_topology_ligands
+from mdstudio_gromacs.prepared_topology import PreparedTopologyCache, configure_prepared_cache
+from mdstudio_gromacs.topology_cache import file_digest
+
+currentpath = os.path.dirname(__file__)
+files = os.path.join(currentpath, '..', 'files')
+
+
+def is_writable(path):
+
+    return bool(os.stat(path).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+class TestPreparedTopologyCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.cache = PreparedTopologyCache(os.path.join(self.workdir, 'cache'))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def task(self, name):
+        """
+        Task directory with the ligand topology and atom types inputs
+        """
+
+        task_dir = os.path.join(self.workdir, name)
+        os.mkdir(task_dir)
+        shutil.copy(os.path.join(files, 'input_GMX.itp'), task_dir)
+        shutil.copy(os.path.join(files, 'attype.itp'), task_dir)
+
+        return os.path.join(task_dir, 'input_GMX.itp'), os.path.join(task_dir, 'attype.itp')
+
+    def prepare(self, name):
+
+        itp_file, attype_itp = self.task(name)
+        key = self.cache.key(itp_file, attype_itp, options={'posre': True})
+        ligand_itp = os.path.join(os.path.dirname(itp_file), 'ligand.itp')
+
+        results = self.cache.fetch(key, ligand_itp, attype_itp)
+        if results is None:
+            attypes_digest = file_digest(attype_itp)
+            results = correct_itp(itp_file, ligand_itp)
+            fix_atom_types_file(attype_itp, results['attypes'])
+            self.cache.store(key, results, attypes_digest=attypes_digest, attypes_file=attype_itp)
+
+        return results, attype_itp
+
+    def test_miss_then_hit(self):
+
+        prepared, prepared_attypes = self.prepare('task1')
+        cached, cached_attypes = self.prepare('task2')
+
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(cached['charge'], prepared['charge'])
+        self.assertEqual(cached['attypes'].rows(), prepared['attypes'].rows())
+        for key in ('itp_filename', 'posre_filename'):
+            self.assertEqual(file_digest(cached[key]), file_digest(prepared[key]))
+        self.assertEqual(file_digest(cached_attypes), file_digest(prepared_attypes))
+
+    def test_cached_files_are_read_only(self):
+
+        self.prepare('task1')
+        cached, attype_itp = self.prepare('task2')
+
+        self.assertFalse(is_writable(cached['itp_filename']))
+        self.assertFalse(is_writable(cached['posre_filename']))
+        entry = self.cache.entries()[0][0]
+        self.assertFalse(any(is_writable(os.path.join(entry, name)) for name in os.listdir(entry)))
+
+        # The restored atom types file is updated by later preparations
+        self.assertTrue(is_writable(attype_itp))
+
+    def test_other_atom_types_miss(self):
+
+        self.prepare('task1')
+        itp_file, attype_itp = self.task('task2')
+        with open(attype_itp, 'a') as f:
+            f.write('; changed\n')
+
+        key = self.cache.key(itp_file, attype_itp, options={'posre': True})
+
+        self.assertIsNone(self.cache.fetch(key, os.path.join(os.path.dirname(itp_file), 'ligand.itp'), attype_itp))
+
+
+class TestFixTopologyLigands(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.cache = configure_prepared_cache(os.path.join(self.workdir, 'cache'))
+
+    def tearDown(self):
+
+        configure_prepared_cache(None)
+        shutil.rmtree(self.workdir)
+
+    def batch(self, name, count=2):
+        """
+        Gromacs configurations of `count` ligands and the shared atom
+        types file in directory `name`
+        """
+
+        directory = os.path.join(self.workdir, name)
+        os.mkdir(directory)
+        shutil.copy(os.path.join(files, 'attype.itp'), directory)
+
+        configs = []
+        for i in range(count):
+            workdir = os.path.join(directory, 'task{0}'.format(i))
+            os.mkdir(workdir)
+            shutil.copy(os.path.join(files, 'input_GMX.itp'), workdir)
+            configs.append({'workdir': workdir, 'topology_file': os.path.join(workdir, 'input_GMX.itp'),
+                            'include': []})
+
+        return configs, os.path.join(directory, 'attype.itp')
+
+    def test_ligands_are_taken_from_cache(self):
+
+        configs, attype_itp = self.batch('batch1')
+        fix_topology_ligands(configs, attype_itp=attype_itp, processes=1)
+        self.assertEqual(self.cache.stats()['misses'], 2)
+
+        cached, cached_attype_itp = self.batch('batch2')
+        fix_topology_ligands(cached, attype_itp=cached_attype_itp, processes=1)
+        self.assertEqual(self.cache.stats()['hits'], 2)
+
+        for config, cached_config in zip(configs, cached):
+            self.assertEqual(cached_config['charge'], config['charge'])
+            self.assertEqual(file_digest(cached_config['topology_file']), file_digest(config['topology_file']))
+            self.assertEqual([file_digest(x) for x in cached_config['include']],
+                             [file_digest(x) for x in config['include']])
+        self.assertEqual(file_digest(cached_attype_itp), file_digest(attype_itp))
+
+    def test_ligands_match_serial_preparation(self):
+
+        configs, attype_itp = self.batch('batch')
+        fix_topology_ligands(configs, attype_itp=attype_itp, processes=1)
+
+        ligand_itp = os.path.join(self.workdir, 'ligand.itp')
+        serial_attype_itp = os.path.join(self.workdir, 'attype.itp')
+        shutil.copy(os.path.join(files, 'attype.itp'), serial_attype_itp)
+        results = correct_itp(os.path.join(files, 'input_GMX.itp'), ligand_itp)
+        fix_atom_types_file(serial_attype_itp, results['attypes'])
+
+        self.assertEqual(configs[0]['charge'], results['charge'])
+        self.assertEqual(file_digest(configs[0]['topology_file']), file_digest(ligand_itp))
+        self.assertEqual(file_digest(attype_itp), file_digest(serial_attype_itp))
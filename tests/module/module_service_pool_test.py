@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_service_pool_test.py
+
+Unit tests for the pool of warm Cerise services
+"""
+
+import unittest
+
+from twisted.internet import task
+from twisted.internet.defer import Deferred, maybeDeferred
+
+from mdstudio_gromacs import service_pool
+from mdstudio_gromacs.service_pool import ServicePool, managed_service_data, service_key
+
+CONFIG = {'docker_name': 'cerise-gromacs', 'port': 29593}
+
+
+class FakeService(object):
+
+    def __init__(self, name):
+
+        self.name = name
+
+
+class TestServicePool(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = task.Clock()
+        self.healthy = True
+        self.created = []
+        self.closed = []
+
+        # Cerise calls run synchronously in the tests
+        self.call_in_pool = service_pool.call_in_pool
+        self.service_is_healthy = service_pool.service_is_healthy
+        self.close_service = service_pool.close_service
+        service_pool.call_in_pool = maybeDeferred
+        service_pool.service_is_healthy = lambda srv: self.healthy
+        service_pool.close_service = lambda srv: self.closed.append(srv) or True
+
+        self.pool = ServicePool(self.create, idle_timeout=600.0, health_ttl=30.0, clock=self.clock)
+
+    def tearDown(self):
+
+        service_pool.call_in_pool = self.call_in_pool
+        service_pool.service_is_healthy = self.service_is_healthy
+        service_pool.close_service = self.close_service
+
+    def create(self, cerise_config):
+
+        srv = FakeService(cerise_config['docker_name'])
+        self.created.append(srv)
+
+        return srv
+
+    def acquire(self):
+
+        results = []
+        self.pool.acquire(CONFIG).addCallback(results.append)
+
+        return results[0]
+
+    def test_reuse(self):
+
+        srv = self.acquire()
+        self.clock.advance(60)
+
+        self.assertIs(self.acquire(), srv)
+        self.assertEqual(self.pool.stats(), {'services': 1, 'started': 1, 'reused': 1})
+
+    def test_unhealthy_service_is_restarted(self):
+
+        srv = self.acquire()
+        self.clock.advance(60)
+        self.healthy = False
+
+        self.assertIsNot(self.acquire(), srv)
+        self.assertEqual(len(self.created), 2)
+
+    def test_concurrent_acquisitions_share_the_start(self):
+
+        started = Deferred()
+        self.pool.create = lambda cerise_config: started
+
+        results = []
+        self.pool.acquire(CONFIG).addCallback(results.append)
+        self.pool.acquire(CONFIG).addCallback(results.append)
+        srv = FakeService('cerise-gromacs')
+        started.callback(srv)
+
+        self.assertEqual(results, [srv, srv])
+        self.assertEqual(self.pool.stats()['started'], 1)
+
+    def test_release_uses_the_acquire_key(self):
+
+        srv = self.acquire()
+        self.clock.advance(500)
+        self.pool.release({'name': 'cerise-gromacs', 'port': 29593, 'task_id': 'task1'})
+
+        self.clock.advance(500)
+        self.assertEqual(self.closed, [])
+        self.clock.advance(100)
+        self.assertEqual(self.closed, [srv])
+        self.assertEqual(self.pool.stats()['services'], 0)
+
+    def test_acquire_during_close_starts_a_fresh_service(self):
+
+        closing = Deferred()
+        service_pool.close_service = lambda srv: closing
+
+        srv = self.acquire()
+        self.clock.advance(600)
+
+        results = []
+        self.pool.acquire(CONFIG).addCallback(results.append)
+        self.assertEqual(results, [])
+
+        closing.callback(True)
+        self.assertEqual(len(results), 1)
+        self.assertIsNot(results[0], srv)
+        self.assertEqual(self.pool.stats(), {'services': 1, 'started': 2, 'reused': 0})
+
+    def test_acquire_during_close_reuses_a_service_with_jobs(self):
+
+        closing = Deferred()
+        service_pool.close_service = lambda srv: closing
+
+        srv = self.acquire()
+        self.clock.advance(600)
+
+        results = []
+        self.pool.acquire(CONFIG).addCallback(results.append)
+        closing.callback(False)
+
+        self.assertEqual(results, [srv])
+        self.assertEqual(self.pool.stats(), {'services': 1, 'started': 1, 'reused': 1})
+
+    def test_service_key(self):
+
+        self.assertEqual(service_key(managed_service_data({'docker_name': 'cerise-gromacs'})),
+                         service_key({'name': 'cerise-gromacs', 'port': 29593}))
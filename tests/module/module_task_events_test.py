@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_task_events_test.py
+
+Unit tests for the publication of task state transitions
+"""
+
+import threading
+import unittest
+
+from mdstudio_gromacs import task_events
+from mdstudio_gromacs.task_events import TaskEvents, batch_topic, task_topic
+
+
+class TestTaskEvents(unittest.TestCase):
+
+    def setUp(self):
+
+        self.published = []
+        self.callFromThread = task_events.reactor.callFromThread
+        task_events.reactor.callFromThread = lambda f, *args: f(*args)
+        self.events = TaskEvents(lambda topic, event: self.published.append((topic, event)), max_tasks=2)
+
+    def tearDown(self):
+
+        task_events.reactor.callFromThread = self.callFromThread
+
+    def test_transitions_are_published_once(self):
+
+        self.assertTrue(self.events.transition('task1', 'queued', batch_id='batch1'))
+        self.assertFalse(self.events.transition('task1', 'queued', batch_id='batch1'))
+        self.assertTrue(self.events.transition('task1', 'running', batch_id='batch1'))
+
+        event = {'task_id': 'task1', 'batch_id': 'batch1', 'status': 'queued'}
+        self.assertEqual(self.published[:2], [(task_topic('task1'), event), (batch_topic('batch1'), event)])
+        self.assertEqual(len(self.published), 4)
+
+    def test_unknown_status(self):
+
+        self.assertRaises(ValueError, self.events.transition, 'task1', 'lost')
+
+    def test_oldest_tasks_are_forgotten(self):
+
+        for task_id in ('task1', 'task2', 'task3'):
+            self.events.transition(task_id, 'queued')
+
+        self.assertTrue(self.events.transition('task1', 'queued'))
+        self.assertFalse(self.events.transition('task3', 'queued'))
+
+    def test_transitions_from_threads(self):
+
+        def publish(task_id):
+            for status in ('queued', 'running', 'downloading', 'completed'):
+                self.events.transition(task_id, status)
+
+        threads = [threading.Thread(target=publish, args=('task{0}'.format(i % 2),)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(self.events._status), ['task0', 'task1'])
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_task_store_test.py
+
+Unit tests for the cached and batched access to the task documents
+"""
+
+import copy
+import unittest
+
+from twisted.internet import task
+from twisted.internet.defer import fail, succeed
+
+from mdstudio_gromacs.task_store import TaskStore
+
+
+class FakeDB(object):
+    """
+    In memory `cerise` collection counting the calls made
+    """
+
+    def __init__(self, docs=()):
+
+        self.docs = dict((doc['task_id'], dict(doc)) for doc in docs)
+        self.calls = []
+
+    def find_one(self, collection, query):
+
+        self.calls.append('find_one')
+        return succeed({'result': copy.deepcopy(self.docs.get(query['task_id']))})
+
+    def find_many(self, collection, query):
+
+        self.calls.append('find_many')
+        return succeed({'results': [copy.deepcopy(doc) for doc in self.docs.values()]})
+
+    def insert_many(self, collection, docs):
+
+        self.calls.append('insert_many')
+        for doc in docs:
+            self.docs[doc['task_id']] = dict(doc)
+        return succeed(None)
+
+    def update_many(self, collection, query, update):
+
+        self.calls.append('update_many')
+        for task_id in query['task_id']['$in']:
+            self.docs[task_id].update(update['$set'])
+        return succeed(None)
+
+
+def result(d):
+
+    results = []
+    d.addCallback(results.append)
+
+    return results[0]
+
+
+class TestTaskStore(unittest.TestCase):
+
+    def setUp(self):
+
+        self.clock = task.Clock()
+        self.db = FakeDB([{'task_id': 'task1', 'status': 'running'},
+                          {'task_id': 'task2', 'status': 'completed'}])
+        self.store = TaskStore(self.db, ttl=30.0, running_ttl=5.0, clock=self.clock)
+
+    def test_cache_hit_and_miss(self):
+
+        self.assertEqual(result(self.store.find('task2')), {'task_id': 'task2', 'status': 'completed'})
+        self.assertEqual(result(self.store.find('task2')), {'task_id': 'task2', 'status': 'completed'})
+        self.assertEqual(self.db.calls, ['find_one'])
+
+        self.clock.advance(31)
+        result(self.store.find('task2'))
+        self.assertEqual(self.db.calls, ['find_one', 'find_one'])
+
+    def test_running_tasks_expire_sooner(self):
+
+        result(self.store.find('task1'))
+        self.clock.advance(6)
+        result(self.store.find('task1'))
+
+        self.assertEqual(self.db.calls, ['find_one', 'find_one'])
+
+    def test_miss_reads_queued_updates(self):
+
+        self.store.update('task1', {'job_state': 'Running'})
+
+        self.assertEqual(result(self.store.find('task1'))['job_state'], 'Running')
+        self.assertEqual(self.db.calls, ['update_many', 'find_one'])
+
+    def test_invalidate(self):
+
+        result(self.store.find('task1'))
+        self.store.update('task1', {'job_state': 'Success'})
+        self.store.invalidate(['task1'])
+        self.db.docs['task1']['status'] = 'completed'
+
+        self.assertEqual(result(self.store.find('task1')),
+                         {'task_id': 'task1', 'status': 'completed', 'job_state': 'Success'})
+
+    def test_batched_writes(self):
+
+        self.store.insert({'task_id': 'task3', 'status': 'running'})
+        self.store.update_many(['task1', 'task2'], {'job_state': 'Success'})
+        self.store.update('task3', {'job_state': 'Waiting'})
+
+        self.assertEqual(result(self.store.find('task3'))['job_state'], 'Waiting')
+        self.assertEqual(self.db.calls, [])
+
+        self.clock.advance(1)
+        self.assertEqual(self.db.calls, ['insert_many', 'update_many'])
+        self.assertEqual(self.db.docs['task3']['job_state'], 'Waiting')
+        self.assertEqual(self.db.docs['task2']['job_state'], 'Success')
+
+    def test_failed_writes_are_retried(self):
+
+        update_many = self.db.update_many
+        failures = [IOError('connection lost')]
+
+        def flaky_update_many(collection, query, update):
+            if failures:
+                self.db.calls.append('failed')
+                return fail(failures.pop())
+            return update_many(collection, query, update)
+
+        self.db.update_many = flaky_update_many
+        self.store.insert({'task_id': 'task3', 'status': 'running'})
+        self.store.update('task1', {'status': 'completed'})
+
+        self.clock.advance(1)
+        self.assertEqual(self.db.calls, ['insert_many', 'failed'])
+        self.assertEqual(self.db.docs['task1']['status'], 'running')
+
+        # Only the failed update is written again
+        self.clock.advance(1)
+        self.assertEqual(self.db.calls, ['insert_many', 'failed', 'update_many'])
+        self.assertEqual(self.db.docs['task1']['status'], 'completed')
+        self.assertEqual(self.db.docs['task3']['status'], 'running')
+
+    def test_later_batches_wait_for_the_retries(self):
+
+        insert_many = self.db.insert_many
+        self.db.insert_many = lambda collection, docs: fail(IOError('connection lost'))
+
+        self.store.insert({'task_id': 'task3', 'status': 'running'})
+        self.clock.advance(1)
+        self.store.update('task1', {'status': 'completed'})
+        self.clock.advance(1)
+        self.assertEqual(self.db.docs['task1']['status'], 'running')
+
+        # Third attempt of the insert, then the update
+        self.db.insert_many = insert_many
+        self.clock.advance(1)
+        self.assertEqual(self.db.docs['task3']['status'], 'running')
+        self.assertEqual(self.db.docs['task1']['status'], 'completed')
+
+    def test_writes_are_given_up(self):
+
+        self.store.max_attempts = 2
+        self.db.insert_many = lambda collection, docs: fail(IOError('connection lost'))
+
+        self.store.insert({'task_id': 'task3', 'status': 'running'})
+        self.clock.advance(1)
+        self.clock.advance(1)
+        self.store.update('task1', {'status': 'completed'})
+        self.clock.advance(1)
+
+        self.assertNotIn('task3', self.db.docs)
+        self.assertEqual(self.db.docs['task1']['status'], 'completed')
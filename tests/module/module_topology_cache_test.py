@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_topology_cache_test.py
+
+Unit tests for the on-disk cache of parsed topologies
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mdstudio_gromacs.gromacs_topology_amber import parse_include_topology
+from mdstudio_gromacs.topology_cache import TopologyCache
+
+currentpath = os.path.dirname(__file__)
+files = os.path.join(currentpath, '..', 'files')
+
+
+class TestTopologyCache(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.cache = TopologyCache(os.path.join(self.workdir, 'cache'))
+        self.calls = []
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def parser(self, filename):
+
+        self.calls.append(filename)
+        return parse_include_topology(filename)
+
+    def copy(self, name):
+
+        path = os.path.join(self.workdir, name)
+        shutil.copy(os.path.join(files, 'input_GMX.itp'), path)
+
+        return path
+
+    def test_hit_and_miss(self):
+
+        itp_file = self.copy('ligand.itp')
+        tables, keys = self.cache.load(itp_file, self.parser)
+        cached, cached_keys = self.cache.load(itp_file, self.parser)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+        self.assertEqual(cached_keys, keys)
+        for key in keys:
+            self.assertEqual(cached[key].rows(), tables[key].rows())
+
+    def test_keyed_on_content(self):
+
+        self.cache.load(self.copy('a.itp'), self.parser)
+        self.cache.load(self.copy('b.itp'), self.parser)
+
+        self.assertEqual(len(self.calls), 1)
+
+        itp_file = self.copy('c.itp')
+        with open(itp_file, 'a') as f:
+            f.write('\n; changed\n')
+        self.cache.load(itp_file, self.parser)
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.cache.stats()['entries'], 2)
+
+    def test_corrupted_entry(self):
+
+        itp_file = self.copy('ligand.itp')
+        self.cache.load(itp_file, self.parser)
+        with open(self.cache.path(itp_file), 'wb') as f:
+            f.write(b'corrupted')
+        self.cache.load(itp_file, self.parser)
+
+        self.assertEqual(len(self.calls), 2)
+
+    def test_evict(self):
+
+        self.cache.max_size = 0
+        self.cache.load(self.copy('ligand.itp'), self.parser)
+
+        self.assertEqual(self.cache.stats()['entries'], 0)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_topology_editor_test.py
+
+Unit tests for the single pass molecule editor, compared with the
+sequential molecule edits it replaces on the amber ligand topology
+"""
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from mdstudio_gromacs.gromacs_topology import itpAddMols, readCard, topReplaceMols, topRmMols
+from mdstudio_gromacs.topology_editor import TopologyEditor, list_molecules
+
+currentpath = os.path.dirname(__file__)
+files = os.path.join(currentpath, '..', 'files')
+
+WATER = """
+[ moleculetype ]
+ WAT  2
+
+[ atoms ]
+ 1  OW  1  WAT  O   1  -0.834  16.00000
+ 2  HW  1  WAT  H1  1   0.417   1.00800
+ 3  HW  1  WAT  H2  1   0.417   1.00800
+
+[ settles ]
+ 1  1  0.09572  0.15139
+
+[ system ]
+ ligand in water
+
+[ molecules ]
+ input  1
+ WAT    100
+"""
+
+IONS = """[ atomtypes ]
+ os       os          0.00000  0.00000   A     3.00001e-01   7.11280e-01
+ Na+      Na+         0.00000  0.00000   A     3.32840e-01   1.15897e-02
+ Cl-      Cl-         0.00000  0.00000   A     4.40104e-01   4.18400e-01
+
+[ moleculetype ]
+ NA  1
+
+[ atoms ]
+ 1  Na+  1  NA  NA  1  1.00000  22.99000
+
+[ moleculetype ]
+ CL  1
+
+[ atoms ]
+ 1  Cl-  1  CL  CL  1  -1.00000  35.45000
+"""
+
+
+def baseline_rm_mols(blocks, blockNames, mols2Del):
+    """
+    Removal of molecule types as done before the single pass editor
+    """
+
+    popOut = False
+    listOut = []
+    for nbl, blName in enumerate(blockNames):
+        if blName == 'moleculetype':
+            popOut = blocks[nbl][0][0] in mols2Del
+        if blName == 'system':
+            popOut = False
+        if popOut:
+            listOut.append(nbl)
+
+    for nbl in sorted(listOut, reverse=True):
+        blocks.pop(nbl)
+        blockNames.pop(nbl)
+
+    return blocks, blockNames
+
+
+def baseline_replace_mols(blocks, blockNames, mols2Rep):
+    """
+    Renaming in [ molecules ] as done before the single pass editor
+    """
+
+    listin = [x['in'] for x in mols2Rep]
+    for nbl, blName in enumerate(blockNames):
+        if blName == 'molecules':
+            for mol in blocks[nbl]:
+                if mol[0] in listin:
+                    mol[0] = mols2Rep[listin.index(mol[0])]['out']
+
+    return blocks, blockNames
+
+
+def baseline_add_mols(blocks, nameBlocks, miscBlocks, miscNameBlocks):
+    """
+    Insertion of molecule types as done before the single pass editor
+    """
+
+    idxTypes = nameBlocks.index('atomtypes')
+    idxNewTypes = [i for i, x in enumerate(miscNameBlocks) if x == 'atomtypes']
+    for block in idxNewTypes:
+        for newAtm in miscBlocks[block]:
+            if not any(newAtm[0] == atm[0] for atm in blocks[idxTypes]):
+                blocks[idxTypes].append(newAtm)
+
+    idxSystem = nameBlocks.index('system')
+    blNoAty = 0
+    for bl in range(len(miscNameBlocks)):
+        if bl not in idxNewTypes:
+            blocks.insert(idxSystem + blNoAty, miscBlocks[bl])
+            nameBlocks.insert(idxSystem + blNoAty, miscNameBlocks[bl])
+            blNoAty += 1
+
+    return blocks, nameBlocks
+
+
+class TestTopologyEditor(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        with open(os.path.join(files, 'input_GMX.itp'), 'r') as f:
+            ligand = f.read()
+
+        self.top_file = self.write('system.top', ligand + WATER)
+        self.ions_file = self.write('ions.itp', IONS)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def write(self, name, content):
+
+        path = os.path.join(self.workdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+
+        return path
+
+    def read(self, filename):
+        """
+        Blocks of `filename` as plain lists and the block names
+        """
+
+        blocks, names, _ = readCard(filename)
+
+        return [copy.deepcopy(blocks[i]) for i in range(len(names))], names
+
+    def assertBlocksEqual(self, blocks, names, reference, reference_names):
+
+        self.assertEqual(names, reference_names)
+        self.assertEqual([blocks[i] for i in range(len(names))], reference)
+
+    def test_remove(self):
+
+        reference, reference_names = baseline_rm_mols(*self.read(self.top_file) + (['WAT'],))
+        blocks, names, mols = topRmMols(*readCard(self.top_file)[:2] + (['WAT'],))
+
+        self.assertBlocksEqual(blocks, names, reference, reference_names)
+        self.assertNotIn('settles', names)
+        self.assertIn('system', names)
+        self.assertEqual(mols, list_molecules(reference, reference_names))
+
+    def test_replace(self):
+
+        replace = [{'in': 'WAT', 'out': 'SOL'}]
+        reference, reference_names = baseline_replace_mols(*self.read(self.top_file) + (replace,))
+        blocks, names = topReplaceMols(*readCard(self.top_file)[:2] + (replace,))
+
+        self.assertBlocksEqual(blocks, names, reference, reference_names)
+        self.assertEqual(blocks[names.index('molecules')], [['input', '1'], ['SOL', '100']])
+
+    def test_add(self):
+
+        reference, reference_names = baseline_add_mols(*self.read(self.top_file) + self.read(self.ions_file))
+        blocks, names = itpAddMols(*readCard(self.top_file)[:2] + self.read(self.ions_file))
+
+        self.assertBlocksEqual(blocks, names, reference, reference_names)
+        self.assertEqual([row[0] for row in blocks[names.index('atomtypes')]][-2:], ['Na+', 'Cl-'])
+        self.assertEqual(names[-4:], ['moleculetype', 'atoms', 'system', 'molecules'])
+
+    def test_single_pass_matches_sequential_edits(self):
+
+        replace = [{'in': 'WAT', 'out': 'SOL'}]
+        reference, reference_names = self.read(self.top_file)
+        baseline_rm_mols(reference, reference_names, ['WAT'])
+        baseline_replace_mols(reference, reference_names, replace)
+        baseline_add_mols(reference, reference_names, *self.read(self.ions_file))
+
+        editor = TopologyEditor(*readCard(self.top_file)[:2])
+        editor.remove(['WAT'])
+        editor.replace('WAT', 'SOL')
+        editor.add(*self.read(self.ions_file))
+        blocks, names, mols = editor.apply()
+
+        self.assertBlocksEqual(blocks, names, reference, reference_names)
+        self.assertEqual([(mol['name'], mol.get('added', False)) for mol in mols],
+                         [('input', False), ('NA', True), ('CL', True)])
+
+    def test_atomtypes_added_without_atomtypes_section(self):
+
+        top_file = self.write('water.top', WATER.lstrip())
+        editor = TopologyEditor(*readCard(top_file)[:2])
+        editor.add(*self.read(self.ions_file))
+        blocks, names, _ = editor.apply()
+
+        # The merged atom types go before the first molecule type
+        self.assertEqual(names[:2], ['atomtypes', 'moleculetype'])
+        self.assertEqual([row[0] for row in blocks[0]], ['os', 'Na+', 'Cl-'])
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_topology_parser_test.py
+
+Unit tests for the topology tokenizer, tables, section index and writers
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from mdstudio_gromacs import gromacs_topology
+from mdstudio_gromacs.gromacs_topology import correct_itp, itpOut, readCard
+from mdstudio_gromacs.gromacs_topology_amber import (IncludeTopology, parse_include_topology, read_include_topology,
+                                                   write_itp)
+from mdstudio_gromacs.parsers import parse_itp, tokenize_sections
+from mdstudio_gromacs.topology_cache import TopologyCache
+from mdstudio_gromacs.topology_index import TopologyIndex, is_continuation
+from mdstudio_gromacs.topology_table import TopologyTable, write_columns
+
+currentpath = os.path.dirname(__file__)
+files = os.path.join(currentpath, '..', 'files')
+
+CONTINUED_TOP = """[ moleculetype ]
+  MOL  3
+
+[ atoms ]
+  1  C  1  MOL  C1  1  0.0  12.011
+  2  H  1  MOL  H1  1  0.0   1.008
+#ifdef EXTRA
+  3  H  1  MOL  H2  1  0.0   1.008
+#endif
+
+[ system ]
+  test
+"""
+
+
+class TestTokenizer(unittest.TestCase):
+
+    def test_tokenizer_matches_pyparsing(self):
+
+        itp_file = os.path.join(files, 'input_GMX.itp')
+
+        self.assertEqual(parse_itp(itp_file), parse_itp(itp_file, use_pyparsing=True))
+
+    def test_comments_and_directives(self):
+
+        lines = ['; comment', '[ atoms ] ; header comment', '1 C ; trailing', '#ifdef POSRES', '',
+                 '[bonds]', '1 2 1']
+
+        self.assertEqual(list(tokenize_sections(lines)), [('atoms', [['1', 'C']]), ('bonds', [['1', '2', '1']])])
+
+
+class TestTopologyTable(unittest.TestCase):
+
+    rows = [['1', 'c3', '1', 'LIG', 'C', '1', '0.175100', '12.01000'],
+            ['2', 'h1', '1', 'LIG', 'H', '2', '0.033700', '1.00800'],
+            ['3', 'os', '1', 'LIG', 'O', '3', '-0.397900', '16.00000']]
+
+    def test_rows_round_trip(self):
+
+        table = TopologyTable.from_rows('atoms', self.rows)
+
+        self.assertEqual(table.rows(), self.rows)
+        self.assertEqual(table['nr'].tolist(), [1, 2, 3])
+        self.assertAlmostEqual(table['charge'].sum(), -0.1891)
+
+    def test_ragged_rows(self):
+
+        rows = [['1', '2', '1'], ['1', '3', '1', '0.1', '100.0']]
+        table = TopologyTable.from_rows('bonds', rows)
+
+        self.assertEqual(table.rows(), rows)
+
+    def test_only_edited_floats_are_formatted(self):
+
+        table = TopologyTable.from_rows('atoms', self.rows)
+        masses = table['mass']
+        masses[1] *= 4
+        table['mass'] = masses
+
+        self.assertEqual([row[7] for row in table.rows()], ['12.01000', '4.0320', '16.00000'])
+
+    def test_append_widens_text(self):
+
+        table = TopologyTable.from_rows('atomtypes', [['c3', 'c3', '0.0']])
+        other = TopologyTable.from_rows('atomtypes', [['c3long', 'c3long', '0.00000']])
+
+        self.assertEqual(table.append(other).rows(), [['c3', 'c3', '0.0'], ['c3long', 'c3long', '0.00000']])
+
+
+class TestTopologyIndex(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.top_file = os.path.join(self.workdir, 'continued.top')
+        with open(self.top_file, 'w') as f:
+            f.write(CONTINUED_TOP)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_raw_blocks_cover_file(self):
+
+        index = TopologyIndex(self.top_file)
+        text = ''.join(index.raw(i) for i in range(len(index)))
+        index.close()
+
+        self.assertEqual(text, CONTINUED_TOP)
+
+    def test_lazy_blocks(self):
+
+        index = TopologyIndex(self.top_file)
+
+        self.assertEqual(index.names, ['moleculetype', 'atoms', None, 'atoms', None, None, 'system'])
+        self.assertFalse(index.is_loaded(1))
+        self.assertEqual(index[1][1][4], 'H1')
+        self.assertTrue(index.is_loaded(1))
+        self.assertIsNone(index.raw(1))
+        self.assertFalse(is_continuation(index[1]))
+        self.assertTrue(is_continuation(index[3]))
+        index.close()
+
+    def test_context_manager_releases_the_map(self):
+
+        with TopologyIndex(self.top_file) as index:
+            self.assertEqual(index[1][1][4], 'H1')
+
+        self.assertTrue(index._buf.closed)
+        self.assertEqual(index[1][1][4], 'H1')
+        self.assertRaises(ValueError, index.raw, 0)
+
+    def test_correct_itp_closes_the_index(self):
+
+        indexes = []
+
+        def read_card(filetop):
+            card = readCard(filetop)
+            indexes.append(card[0])
+            return card
+
+        gromacs_topology.readCard = read_card
+        try:
+            correct_itp(self.top_file, os.path.join(self.workdir, 'out.top'), miscMols=[self.top_file])
+        finally:
+            gromacs_topology.readCard = readCard
+
+        self.assertEqual(len(indexes), 2)
+        self.assertTrue(all(index._buf.closed for index in indexes))
+
+    def test_continuation_has_no_header(self):
+
+        blocks, names, mols = readCard(self.top_file)
+        for i in range(len(blocks)):
+            blocks[i]
+
+        out_file = os.path.join(self.workdir, 'out.top')
+        with blocks:
+            itpOut(blocks, names, out_file, {})
+        with open(out_file, 'r') as f:
+            text = f.read()
+
+        self.assertEqual(mols, [{'name': 'MOL', 'atoms': 1}])
+        self.assertEqual(text.count('[ atoms ]'), 1)
+        self.assertEqual([name for name, _ in parse_itp(out_file)], ['moleculetype', 'atoms', 'system'])
+
+    def test_untouched_blocks_are_copied(self):
+
+        blocks, names, _ = readCard(os.path.join(files, 'protein.top'))
+        out_file = os.path.join(self.workdir, 'protein.top')
+        with blocks:
+            itpOut(blocks, names, out_file, {})
+
+        self.assertEqual(parse_itp(out_file), parse_itp(os.path.join(files, 'protein.top')))
+
+
+class TestIncludeTopology(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.itp_file = os.path.join(files, 'input_GMX.itp')
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_sections_match_the_parser(self):
+
+        tables, keys = parse_include_topology(self.itp_file)
+        with IncludeTopology(self.itp_file) as itp_dict:
+            self.assertEqual(list(itp_dict.keys()), keys)
+            self.assertIn('dihedrals_2', itp_dict)
+            for key in keys:
+                self.assertEqual(itp_dict[key].rows(), tables[key].rows())
+
+    def test_sections_are_parsed_on_access(self):
+
+        with IncludeTopology(self.itp_file) as itp_dict:
+            itp_dict['atoms']
+            loaded = [itp_dict.index.is_loaded(i) for i in range(len(itp_dict.index))]
+            self.assertEqual(sum(loaded), 1)
+            self.assertIsNone(itp_dict.raw('atoms'))
+            self.assertTrue(itp_dict.raw('pairs').startswith('[ pairs ]'))
+
+    def test_rows_after_directives_belong_to_the_section(self):
+
+        top_file = os.path.join(self.workdir, 'continued.top')
+        with open(top_file, 'w') as f:
+            f.write(CONTINUED_TOP)
+
+        with IncludeTopology(top_file) as itp_dict:
+            self.assertEqual(list(itp_dict.keys()), ['moleculetype', 'atoms', 'system'])
+            self.assertEqual(itp_dict['atoms'].rows(), parse_include_topology(top_file)[0]['atoms'].rows())
+            self.assertIsNone(itp_dict.raw('atoms'))
+
+    def test_cached_sections_are_written_alike(self):
+
+        outputs = []
+        for cache in (None, TopologyCache(os.path.join(self.workdir, 'cache'))):
+            itp_dict = IncludeTopology(self.itp_file, cache=cache)
+            out_file = os.path.join(self.workdir, 'ligand{0}.itp'.format(len(outputs)))
+            with itp_dict:
+                itp_dict['atoms']['mass'] = itp_dict['atoms']['mass'] * 2
+                write_itp(itp_dict, list(itp_dict.keys()), out_file)
+            with open(out_file, 'r') as f:
+                outputs.append(f.read())
+
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_pyparsing_reader(self):
+
+        itp_dict, keys = read_include_topology(self.itp_file, use_pyparsing=True)
+
+        self.assertIsInstance(itp_dict, dict)
+        self.assertEqual(keys, parse_include_topology(self.itp_file)[1])
+
+
+class TestWriters(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_write_columns(self):
+
+        columns = [np.array(['1', '10']), np.array(['C', 'CA']), np.array(['x', ''])]
+        output = io.StringIO()
+        write_columns(output, columns, [3, 3, 2], ncols=np.array([3, 2]), chunk_size=1)
+
+        self.assertEqual(output.getvalue(), u'  1  C x\n 10 CA\n')
+
+    def test_write_itp_round_trip(self):
+
+        itp_dict, keys = parse_include_topology(os.path.join(files, 'input_GMX.itp'))
+        out_file = os.path.join(self.workdir, 'ligand.itp')
+        write_itp(itp_dict, keys, out_file, exclude_list=[])
+
+        self.assertEqual(parse_itp(out_file), parse_itp(os.path.join(files, 'input_GMX.itp')))
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_topology_preprocessor_test.py
+
+Unit tests for the preprocessor aware topology loader
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mdstudio_gromacs import topology_preprocessor
+from mdstudio_gromacs.md_config import check_protein_topology
+from mdstudio_gromacs.topology_preprocessor import LRUCache, clear_include_cache, load_topology
+
+TOPOLOGY = """#define KB 1000
+#include "atoms.itp"
+
+[ bonds ]
+#ifdef FLEXIBLE
+  1  2  1  0.1  KB
+#else
+  1  2  5
+#endif
+
+#ifndef POSRES
+[ exclusions ]
+  1  2
+#endif
+"""
+
+ATOMS = """[ atoms ]
+  1  C  1  MOL  C1  1  0.0  12.011
+  2  H  1  MOL  H1  1  0.0   1.008
+"""
+
+
+class TestPreprocessor(unittest.TestCase):
+
+    def setUp(self):
+
+        clear_include_cache()
+        self.workdir = tempfile.mkdtemp()
+        self.top_file = self.write('topol.top', TOPOLOGY)
+        self.write('atoms.itp', ATOMS)
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def write(self, name, text):
+
+        path = os.path.join(self.workdir, name)
+        with open(path, 'w') as f:
+            f.write(text)
+
+        return path
+
+    def test_defines(self):
+
+        topology = load_topology(self.top_file, defines=['FLEXIBLE', 'POSRES'])
+
+        self.assertEqual([name for name, _, _ in topology.sections], ['atoms', 'bonds'])
+        self.assertEqual(topology.section('bonds'), [['1', '2', '1', '0.1', '1000']])
+        self.assertEqual(topology.defines['KB'], '1000')
+        self.assertEqual(topology.includes[self.top_file], [os.path.join(self.workdir, 'atoms.itp')])
+
+    def test_else_branch(self):
+
+        topology = load_topology(self.top_file)
+
+        self.assertEqual(topology.section('bonds'), [['1', '2', '5']])
+        self.assertEqual(topology.section('exclusions'), [['1', '2']])
+
+    def test_missing_include(self):
+
+        top_file = self.write('missing.top', '#include "forcefield.itp"\n')
+
+        self.assertEqual(load_topology(top_file).missing, [(top_file, 'forcefield.itp')])
+        self.assertRaises(IOError, load_topology, top_file, strict=True)
+
+    def test_unsupported_conditionals(self):
+
+        top_file = self.write('if.top', '#if KB > 10\n#endif\n')
+
+        self.assertRaises(ValueError, load_topology, top_file)
+
+    def test_protein_topology_problems_are_logged(self):
+
+        top_file = self.write('protein.top', '#include "forcefield.itp"\n#include "atoms.itp"\n')
+        topology = check_protein_topology({'protein_top': top_file, 'include': []})
+        self.assertEqual(topology.missing, [(top_file, 'forcefield.itp')])
+        self.assertEqual(topology.section('atoms'), [row.split() for row in ATOMS.splitlines()[1:]])
+
+        top_file = self.write('if.top', '#if KB > 10\n#endif\n')
+        self.assertIsNone(check_protein_topology({'protein_top': top_file, 'include': []}))
+        self.assertIsNone(check_protein_topology({'protein_top': None}))
+
+    def test_unbalanced_conditionals(self):
+
+        self.assertRaises(ValueError, load_topology, self.write('open.top', '#ifdef POSRES\n'))
+        self.assertRaises(ValueError, load_topology, self.write('endif.top', '#endif\n'))
+
+    def test_recursive_include(self):
+
+        top_file = self.write('self.top', '#include "self.top"\n')
+
+        self.assertRaises(ValueError, load_topology, top_file)
+
+    def test_include_cache(self):
+
+        load_topology(self.top_file)
+        cached = len(topology_preprocessor._include_cache)
+        copy = self.write('copy.top', TOPOLOGY)
+        load_topology(copy)
+
+        self.assertEqual(cached, 2)
+        self.assertEqual(len(topology_preprocessor._include_cache), 2)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+
+        cache = LRUCache(3, sizeof=len)
+        cache.put('a', [1])
+        cache.put('b', [1, 2])
+        cache.get('a')
+        cache.put('c', [1])
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), [1])
+        self.assertEqual(cache.size, 2)
+
+    def test_oversized_items_are_not_stored(self):
+
+        cache = LRUCache(1, sizeof=len)
+        cache.put('a', [1, 2])
+
+        self.assertEqual(len(cache), 0)
+        self.assertIsNone(cache.get('a'))
+
+    def test_shared_between_threads(self):
+
+        cache = LRUCache(50, sizeof=len)
+
+        def worker(offset):
+            for i in range(2000):
+                key = (offset + i) % 80
+                if cache.get(key) is None:
+                    cache.put(key, [i] * (1 + key % 3))
+
+        threads = [threading.Thread(target=worker, args=(n * 7,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertLessEqual(cache.size, 50)
+        self.assertEqual(cache.size, sum(len(cache.get(key) or []) for key in range(80)))
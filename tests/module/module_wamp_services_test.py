@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""
+file: module_wamp_services_test.py
+
+Unit tests for the staging of the request input files
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from mdstudio_gromacs import topology_preprocessor
+from mdstudio_gromacs.gromacs_topology_amber import configure_correction_pool
+from mdstudio_gromacs.topology_cache import file_digest
+from mdstudio_gromacs.topology_preprocessor import clear_include_cache
+from mdstudio_gromacs.wamp_services import MDWampApi, copy_file_path_objects_to_workdir, tasks_query
+from twisted.logger import Logger
+
+currentpath = os.path.dirname(__file__)
+files = os.path.join(currentpath, '..', 'files')
+
+
+def path_file(name, content=None):
+
+    return {'path': os.path.join(files, name), 'content': content, 'extension': os.path.splitext(name)[1]}
+
+
+class TestCopyFilePathObjects(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        shutil.rmtree(self.workdir)
+
+    def test_copy_inputs(self):
+
+        request = {'workdir': self.workdir,
+                   'protein_top': path_file('protein.top'),
+                   'ligand_file': path_file('compound.pdb', content=u'ATOM\n'),
+                   'include': [path_file('attype.itp'), path_file('ref_conf_1-posre.itp')],
+                   'parameters': {'sim_time': 0.001}}
+        staged = copy_file_path_objects_to_workdir(request)
+
+        self.assertEqual(staged['protein_top'], os.path.join(self.workdir, 'protein.top'))
+        self.assertEqual(staged['include'], [os.path.join(self.workdir, 'attype.itp'),
+                                             os.path.join(self.workdir, 'ref_conf_1-posre.itp')])
+        self.assertTrue(all(os.path.isfile(path) for path in staged['include']))
+        with open(staged['ligand_file'], 'r') as f:
+            self.assertEqual(f.read(), 'ATOM\n')
+        self.assertEqual(staged['parameters'], {'sim_time': 0.001})
+
+    def test_other_lists_are_kept(self):
+
+        request = {'workdir': self.workdir,
+                   'residues': [28, 29, 65],
+                   'outputs': ['energies', 'gromitout'],
+                   'include': []}
+        staged = copy_file_path_objects_to_workdir(request)
+
+        self.assertEqual(staged['residues'], [28, 29, 65])
+        self.assertEqual(staged['outputs'], ['energies', 'gromitout'])
+        self.assertEqual(staged['include'], [])
+
+
+class TestSetupBatchEnvironment(unittest.TestCase):
+
+    def setUp(self):
+
+        self.workdir = tempfile.mkdtemp()
+        self.cerise_file = os.path.join(self.workdir, 'cerise.json')
+        with open(self.cerise_file, 'w') as f:
+            json.dump({'docker_image': 'mdstudio/cerise-gromacs', 'clean_remote': True}, f)
+
+        # Ligands are prepared in this process
+        configure_correction_pool(1)
+        clear_include_cache()
+
+        self.api = MDWampApi.__new__(MDWampApi)
+        self.api.log = Logger()
+
+    def tearDown(self):
+
+        configure_correction_pool(None)
+        shutil.rmtree(self.workdir)
+
+    def request(self, count):
+
+        ligands = [{'ligand_file': path_file('compound.pdb'), 'topology_file': path_file('input_GMX.itp')}
+                   for _ in range(count)]
+
+        return {'workdir': self.workdir,
+                'cerise_file': {'path': self.cerise_file, 'content': None, 'extension': 'json'},
+                'protein_file': path_file('protein.pdb'),
+                'protein_top': path_file('protein.top'),
+                'attype_itp': path_file('attype.itp'),
+                'protein_posre_itp': path_file('ref_conf_1-posre.itp'),
+                'outputs': 'energies',
+                'ligands': ligands}
+
+    def test_shared_inputs_are_staged_once(self):
+
+        cerise_configs, gromacs_configs = self.api.setup_batch_environment(self.request(3))
+
+        batch_workdir = os.path.dirname(gromacs_configs[0]['workdir'])
+        self.assertEqual(os.path.dirname(batch_workdir), self.workdir)
+        staged = [x for x in os.listdir(batch_workdir) if os.path.splitext(x)[1] in ('.itp', '.pdb', '.top')]
+        self.assertEqual(sorted(staged), ['attype.itp', 'protein.pdb', 'protein.top', 'ref_conf_1-posre.itp'])
+
+        # The ligand atom types are added to the shared atom types file
+        attype_itp = os.path.join(batch_workdir, 'attype.itp')
+        with open(attype_itp, 'r') as f, open(os.path.join(files, 'attype.itp'), 'r') as original:
+            self.assertNotEqual(f.read(), original.read())
+
+        for config in gromacs_configs:
+            self.assertEqual(config['protein_top'], os.path.join(batch_workdir, 'protein.top'))
+            self.assertEqual(config['include'][:2], [attype_itp, os.path.join(batch_workdir, 'ref_conf_1-posre.itp')])
+            self.assertEqual(config['ligand_file'], os.path.join(config['workdir'], 'compound.pdb'))
+            self.assertEqual(config['topology_file'], os.path.join(config['workdir'], 'ligand.itp'))
+            self.assertTrue(os.path.isfile(config['include'][2]))
+            self.assertEqual(config['job_type'], 'protein_ligand_md')
+
+    def test_every_ligand_gets_a_task(self):
+
+        cerise_configs, gromacs_configs = self.api.setup_batch_environment(self.request(3))
+
+        self.assertEqual(len(cerise_configs), 3)
+        self.assertEqual(len(set(config['task_id'] for config in cerise_configs)), 3)
+        self.assertEqual(len(set(config['batch_id'] for config in cerise_configs)), 1)
+        self.assertEqual(len(set(config['workdir'] for config in gromacs_configs)), 3)
+        for cerise_config, gromacs_config in zip(cerise_configs, gromacs_configs):
+            self.assertEqual(cerise_config['task_id'], gromacs_config['task_id'])
+            self.assertEqual(cerise_config['workdir'], gromacs_config['workdir'])
+            self.assertEqual(cerise_config['outputs'], ['energy_dataframe'])
+            self.assertTrue(cerise_config['cwl_workflow'].endswith('protein_ligand.cwl'))
+            with open(os.path.join(gromacs_config['workdir'], 'cerise.json'), 'r') as f:
+                self.assertEqual(json.load(f)['task_id'], cerise_config['task_id'])
+
+    def test_protein_includes_are_cached(self):
+
+        cerise_configs, gromacs_configs = self.api.setup_batch_environment(self.request(2))
+
+        # The staged protein topology and the position restraints it includes
+        for name in ('protein.top', 'ref_conf_1-posre.itp'):
+            digest = file_digest(os.path.join(files, name))
+            self.assertIsNotNone(topology_preprocessor._include_cache.get(digest))
+
+class TestTasksQuery(unittest.TestCase):
+
+    def test_task_ids_take_precedence(self):
+
+        self.assertEqual(tasks_query({'task_ids': ['task1', 'task2'], 'batch_id': 'batch1'}),
+                         {'task_id': {'$in': ['task1', 'task2']}})
+
+    def test_batch_id(self):
+
+        self.assertEqual(tasks_query({'task_ids': [], 'batch_id': 'batch1'}), {'batch_id': 'batch1'})
+
+    def test_selection_required(self):
+
+        self.assertRaises(ValueError, tasks_query, {'task_ids': []})